@@ -1,40 +1,197 @@
 import chainlit as cl
+from chainlit.server import app as chainlit_app
 from chainlit.types import ThreadDict
+from chainlit.user_session import user_sessions
 from chainlit.input_widget import Select, Switch, Slider
 from fastapi import Request, Response
 
+import asyncio
 import logging
 import os
+from contextlib import asynccontextmanager
+from functools import partial
 from dotenv import load_dotenv, find_dotenv
-from collections import defaultdict
-from typing import Optional
+from typing import Callable, Optional
 
-import httpx
 import io
-import wave
-import numpy as np
-import audioop
+import time
+import uuid
 
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex
-from llama_index.core.agent.workflow import FunctionAgent, AgentStream, ToolCall
+from llama_index.core import StorageContext, VectorStoreIndex
+from llama_index.core.agent.workflow import FunctionAgent, AgentStream, ToolCall, ToolCallResult
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from llama_index.core.tools import FunctionTool, QueryEngineTool
-from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.workflow import Context
 from llama_index.embeddings.ollama import OllamaEmbedding
 from llama_index.llms.openai import OpenAI
-from llama_index.tools.mcp import BasicMCPClient, McpToolSpec
 from openai import AsyncOpenAI
 
+from utils.audio import PCMRingBuffer, wav_header
+from utils.context_store import ContextSnapshot, restore_context, snapshot_context
+from utils.describe import describe_documents, describe_filenames, tool_name
+from utils.embedding_batcher import BatchingEmbedding
+from utils.gazetteer import DEFAULT_PLACES_PATH, Gazetteer, parse_show_request
+from utils.http import RetryingTransport, client_factory, create_http_client
+from utils.index_cache import IndexCache
+from utils.ingest import StreamingIngestor
+from utils.lazy_query_engine import LazyQueryEngine
+from utils.mcp_pool import MCPConnectionPool
+from utils.memory import SummarizingMemory
+from utils.metrics import RATE_BUCKETS, Metrics, transport_collector
+from utils.response_cache import ResponseCache, stream_chunks
+from utils.session_state import SessionSlot, SessionStateManager
+from utils.speech import SentenceSplitter, SpeechPipeline
+from utils.streaming import TokenCoalescer
+from utils.task_scope import TaskScope
+from utils.thread_store import DocumentToolRecord, ThreadStore
+from utils.tool_cache import ToolResponseCache, parse_ttls
+from utils.tool_registry import ToolRegistry
+from utils.tool_selector import ToolSelector
+from utils.transcribe import StreamingTranscription, WhisperTranscriber
+from utils.tts_cache import TTSCache
+from utils.vad import VoiceActivityDetector
+from utils.vector_store import CompactVectorStore
+
 ### Global settings
 logger = logging.getLogger(__name__)
 _ = load_dotenv(find_dotenv())
-openai_client = AsyncOpenAI() #for whisper and dall-e-3
-embed_model = OllamaEmbedding(model_name="nomic-embed-text")
-SILENCE_THRESHOLD = 3500  # Adjust based on your audio level (e.g., lower for quieter audio)
-SILENCE_TIMEOUT = 1300.0  # Seconds of silence to consider the turn finished
+## One pooled, retrying transport for every outbound API call
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", 8))  # Requests waiting on response headers per API host
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))  # Retries of failed requests, POSTs only on connect errors and 429/502/503/504
+http_transport = RetryingTransport(max_per_host=HTTP_MAX_PER_HOST, max_retries=HTTP_MAX_RETRIES)
+http_client = create_http_client(http_transport)
+openai_client = AsyncOpenAI(http_client=http_client, max_retries=0) #for whisper and dall-e-3
+## Per-stage latency histograms, served on /metrics in the Prometheus text format
+METRICS = os.getenv("METRICS", "false").lower() == "true"  # Off, instrumented code paths are no-ops
+metrics = Metrics(enabled=METRICS)
+time_to_first_token = metrics.histogram("chat_time_to_first_token_seconds", "Time from a query to its first streamed token")
+tokens_per_second = metrics.histogram("chat_tokens_per_second", "Rate of streamed tokens after the first", RATE_BUCKETS)
+tool_call_seconds = metrics.histogram("chat_tool_call_seconds", "Latency of tool calls, by tool name")
+embedding_rate = metrics.histogram("embedding_chunks_per_second", "Chunks embedded per second while ingesting uploads", RATE_BUCKETS)
+embedded_chunks = metrics.counter("embedding_chunks_total", "Chunks ingested from uploads")
+end_of_turn_delay = metrics.histogram("audio_end_of_turn_delay_seconds", "Delay between the end of speech and the end-of-turn decision")
+streamed_deltas = metrics.counter("chat_stream_deltas_total", "Deltas streamed by the LLM")
+stream_emits = metrics.counter("chat_stream_emits_total", "Websocket emits of streamed replies, after coalescing")
+cancelled_work = metrics.counter("chat_cancelled_work_total", "In-flight work stopped by the user, by kind")
+audio_turn_seconds = metrics.histogram("audio_turn_seconds", "Time from the end of a voice turn to its transcript, first reply audio and full reply")
+if METRICS:
+    metrics.collect(transport_collector(http_transport))
+    metrics.mount(chainlit_app)
+## The embedding requests of every session are merged into micro-batches
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", 64))  # Texts per request to Ollama
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", 5))  # Longest a text waits for its batch to fill
+embedding_batch_size = metrics.histogram("embedding_batch_size", "Texts per embedding request", RATE_BUCKETS)
+embedding_queue_seconds = metrics.histogram("embedding_queue_seconds", "Longest wait of a text for its embedding batch")
+
+def record_embedding_batch(size: int, waited: float):
+    embedding_batch_size.observe(size)
+    embedding_queue_seconds.observe(waited)
+
+embed_model = BatchingEmbedding(
+    OllamaEmbedding(model_name="nomic-embed-text"),
+    max_batch_size=EMBED_MAX_BATCH,
+    max_wait_ms=EMBED_MAX_WAIT_MS,
+    batch_queries=True,  # nomic-embed-text is used without a query instruction
+    on_batch=record_embedding_batch,
+)
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", ".cache/index_cache")
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", 2 * 1024**3))  # 2GB of indexes and chunk embeddings
+index_cache = IndexCache(INDEX_CACHE_DIR, INDEX_CACHE_MAX_BYTES)
+if METRICS:
+    metrics.collect(index_cache.collect)
+thread_store = ThreadStore(os.path.join(INDEX_CACHE_DIR, "threads.sqlite"))
+## Uploaded documents are searched by vector similarity fused with BM25 keyword scores
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float16")  # float32, float16 or int8 storage of the chunk vectors
+RAG_HYBRID_ALPHA = float(os.getenv("RAG_HYBRID_ALPHA", 0.7))  # Weight of the vector score against BM25. 1 disables keywords
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", 8))  # Chunks retrieved per document query
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 32))  # Chunks per embedding request
+INGEST_MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", 4))  # Embedding requests in flight
+ingestor = StreamingIngestor(
+    index_cache,
+    embed_model,
+    batch_size=INGEST_BATCH_SIZE,
+    max_concurrency=INGEST_MAX_CONCURRENCY,
+)
+TOOL_TOP_K = int(os.getenv("TOOL_TOP_K", 10))  # MCP tools exposed per query. 0 exposes all tools
+tool_selector = ToolSelector(embed_model, top_k=TOOL_TOP_K)
+MCP_TOOLS_TTL = float(os.getenv("MCP_TOOLS_TTL", 300))  # Seconds before a server's tool list is fetched again
+mcp_pool = MCPConnectionPool(tools_ttl=MCP_TOOLS_TTL, httpx_client_factory=client_factory(http_transport))
+## Opt-in cache of read-only MCP tool results, e.g. "jira_search=60,jira_get_issue=120,confluence_get_page=300"
+MCP_CACHE_TTLS = parse_ttls(os.getenv("MCP_CACHE_TTLS", ""))
+mcp_response_cache = ToolResponseCache(MCP_CACHE_TTLS)
+## Opt-in cache of answers to standalone questions such as starters and FAQs
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))  # Seconds an answer is served from the cache
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.95))  # Paraphrases above this cosine similarity share an answer
+response_cache = (
+    ResponseCache(embed_model, ttl=RESPONSE_CACHE_TTL, similarity_threshold=RESPONSE_CACHE_SIMILARITY)
+    if RESPONSE_CACHE
+    else None
+)
+## Idle sessions give their heavy state back: contexts are spilled to disk, audio buffers and loaded indexes are dropped
+SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR", ".cache/sessions")
+SESSION_MEMORY_MAX_BYTES = int(os.getenv("SESSION_MEMORY_MAX_BYTES", 1024**3))  # Above this total, the least recently active sessions are spilled
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", 600))  # Sessions idle this long are spilled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Bearer token of /admin/sessions, the per-session memory report. Unset disables it
+session_state = SessionStateManager(
+    user_sessions,
+    lambda: cl.context.session.id,
+    SESSION_SPILL_DIR,
+    max_bytes=SESSION_MEMORY_MAX_BYTES,
+    idle_seconds=SESSION_IDLE_SECONDS,
+)
+for slot in (
+    SessionSlot(
+        "context",
+        spill="disk",  # Measured from its snapshot when spilled, never serialized just to be counted
+        dump=lambda ctx: snapshot_context(ctx).to_bytes(),
+        load=lambda data, session: restore_context(session["agent"], ContextSnapshot.from_bytes(data)),
+        rebuild=lambda session: Context(session["agent"]),
+    ),
+    SessionSlot("audio_buffer", size=lambda buffer: buffer.nbytes),  # Recreated by on_audio_start
+    SessionSlot("vad", size=lambda vad: 0),
+    SessionSlot("transcription", size=lambda transcription: 0),
+    SessionSlot(
+        "tool_registry",
+        size=lambda registry: document_tools_bytes(registry),
+        spill="shrink",
+        shrink=lambda registry: unload_document_tools(registry),
+    ),
+    SessionSlot("memory", size=lambda memory: sum(len(str(m.content or "")) for m in memory.get_all()), spill="keep"),
+    SessionSlot("mcp_connections", size=lambda connections: 0, spill="keep", close=lambda connections: release_mcp_connections(connections)),
+):
+    session_state.register(slot)
+if ADMIN_TOKEN:
+    session_state.mount(chainlit_app, ADMIN_TOKEN)
+if METRICS:
+    metrics.collect(session_state.collect)
+## Streamed replies are sent in coalesced chunks rather than one websocket emit per token
+STREAM_MIN_DELAY_MS = float(os.getenv("STREAM_MIN_DELAY_MS", 50))  # Longest a token waits to be sent while the socket keeps up
+STREAM_MAX_DELAY_MS = float(os.getenv("STREAM_MAX_DELAY_MS", 250))  # Longest it waits when the socket is backed up
+STREAM_MAX_BYTES = int(os.getenv("STREAM_MAX_BYTES", 1024))  # Buffered text is sent at once beyond this
+STOP_CLEANUP_TIMEOUT = float(os.getenv("STOP_CLEANUP_TIMEOUT", 5))  # Seconds stopped work gets to clean up
+MEMORY_TOKEN_LIMIT = int(os.getenv("MEMORY_TOKEN_LIMIT", 3000))  # Older turns are summarized beyond this
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", 12))  # Speech must be this far above the room's noise floor
+VAD_END_OF_TURN_MS = float(os.getenv("VAD_END_OF_TURN_MS", 800))  # Milliseconds of silence to consider the turn finished
+AUDIO_SAMPLE_RATE = 24000  # Matches [features.audio] sample_rate in .chainlit/config.toml
+AUDIO_MAX_SECONDS = float(os.getenv("AUDIO_MAX_SECONDS", 120))  # Longest utterance kept per turn
+STT_STREAMING = os.getenv("STT_STREAMING", "true").lower() == "true"  # Transcribe segments while the user is still talking
+STT_MIN_SEGMENT_SECONDS = float(os.getenv("STT_MIN_SEGMENT_SECONDS", 2))  # Shorter pauses are merged into one segment
+transcriber = WhisperTranscriber(openai_client)
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID")
+ELEVENLABS_MODEL_ID = "eleven_multilingual_v2"
+ELEVENLABS_VOICE_SETTINGS = {"stability": 0.5, "similarity_boost": 0.5}
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".cache/tts")
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", 32 * 1024**2))  # Hot phrases kept in memory
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", 512 * 1024**2))  # Synthesized audio kept on disk
+tts_cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MEMORY_BYTES, TTS_CACHE_MAX_BYTES)
+TTS_PIPELINED = os.getenv("TTS_PIPELINED", "true").lower() == "true"  # Speak replies sentence by sentence while they are generated
+TTS_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", 3))  # Sentences synthesized at once
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", DEFAULT_PLACES_PATH)  # Offline table of cities and landmarks
+gazetteer = Gazetteer.from_csv(GAZETTEER_PATH)
+MAP_FAST_PATH_MIN_SCORE = 0.85  # "Show me X" skips the LLM when X matches the gazetteer at least this well
+MAP_MOVE_TIMEOUT = 5  # Seconds to wait for the open map to acknowledge a move before reopening it
 SYSTEM_PROMPTS = {
     "The Assistant": "You are a helpful AI assistant. You can access tools using MCP servers if available.",
     "The Cowboy": "You are a helpful AI assistant who is also a cowboy! You can access tools using MCP servers if available but answer like a cowboy!",
@@ -70,27 +227,32 @@ async def chat_profile():
     ]
 
 @cl.on_chat_start
+@session_state.tracked
 async def start():
     """Handler for chat start events. Sets session variables."""
     
     # await open_map()
     await cl.context.emitter.set_commands(commands)
-    openai_llm = OpenAI(model="gpt-4o-mini", temperature=0)
-    agent_tool = FunctionTool.from_defaults(async_fn=move_map_to)
-    agent = FunctionAgent(tools=[agent_tool],llm=openai_llm,)
+    openai_llm = create_llm("gpt-4o-mini", 0)
+    tool_registry = ToolRegistry()
+    tool_registry.add(local_tools(), group="local")
+    agent = FunctionAgent(tools=tool_registry.tools(),llm=openai_llm,)
     chat_profile = cl.user_session.get("chat_profile")
     user = cl.user_session.get("user")
     logger.info(f"{user.identifier} has started the conversation")
     
     cl.user_session.set("llm", openai_llm)
-    cl.user_session.set("agent_tools", [agent_tool])
+    cl.user_session.set("tool_registry", tool_registry)
+    cl.user_session.set("mcp_connections", {})
     cl.user_session.set("context", Context(agent))
-    cl.user_session.set("mcp_tools", {})
-    cl.user_session.set("mcp_tool_cache", defaultdict(list))
     cl.user_session.set("agent", agent)
     
     system_prompt = SYSTEM_PROMPTS[chat_profile]
-    memory = ChatMemoryBuffer.from_defaults()
+    memory = SummarizingMemory(
+        openai_llm,
+        token_limit=MEMORY_TOKEN_LIMIT,
+        on_summary=partial(thread_store.save_summary, cl.context.session.thread_id),
+    )
     memory.put(
         ChatMessage(
             role=MessageRole.SYSTEM, 
@@ -112,6 +274,11 @@ async def start():
                 label="Greet user when message is received",
                 initial=False,
             ),
+            Switch(
+                id="Pipelined_voice",
+                label="Speak voice replies while they are generated",
+                initial=TTS_PIPELINED,
+            ),
             Slider(
                 id="Temperature",
                 label="Temperature of the LLM",
@@ -124,32 +291,35 @@ async def start():
     ).send()
 
 @cl.on_settings_update
+@session_state.tracked
 async def setup_agent(settings):
     """Handler to manage settings updates"""
     
-    openai_llm = OpenAI(
-        model=settings["LLM"], 
-        temperature=settings["Temperature"]
-    )
+    openai_llm = create_llm(settings["LLM"], settings["Temperature"])
     logger.info(f"New settings received. LLM: {settings['LLM']} | Temperature: {settings['Temperature']}")
     cl.user_session.set("llm", openai_llm)
     
-    agent_tools = cl.user_session.get("agent_tools")
-    mcp_tools = cl.user_session.get("mcp_tools", {})
-    if len(mcp_tools) > 0:
-        agent = FunctionAgent(tools=agent_tools + list(mcp_tools.values()),llm=openai_llm)
-    else:
-        agent = FunctionAgent(tools=agent_tools, llm=openai_llm)
-    logger.info("Agent instantiated")
-    cl.user_session.set("agent", agent)
+    ## Swap the LLM in place so the agent keeps its tools and workflow context
+    agent = cl.user_session.get("agent")
+    agent.llm = openai_llm
+    cl.user_session.get("memory").llm = openai_llm
+    logger.info("Agent updated")
     
     cl.user_session.set("greet", settings["Greet_on_message"])
+    cl.user_session.set("pipelined_voice", settings["Pipelined_voice"])
     
 
 @cl.on_message
+@session_state.tracked
+@metrics.timed("on_message")
 async def on_message(message: cl.Message):
     """On message handler to handle message received events"""
     
+    ## A stop cancels the work of this turn, not the background work of earlier ones
+    with session_tasks().guard("message"):
+        await handle_message(message)
+
+async def handle_message(message: cl.Message):
     user = cl.user_session.get("user")
     logger.info(f"Received message: '{message.content}' from {user.identifier}")
     
@@ -157,12 +327,13 @@ async def on_message(message: cl.Message):
     if greet is True:
         await cl.Message(f"Hello there {user.identifier}!").send()
     if message.command == "Picture":
-        response = await openai_client.images.generate(
-            model="dall-e-3",
-            prompt = message.content,
-            size = "1024x1024"
-        )
-        logger.info(f"Image generated. Reponse: {response}")
+        with metrics.span("image_generation"):
+            response = await openai_client.images.generate(
+                model="dall-e-3",
+                prompt = message.content,
+                size = "1024x1024"
+            )
+        logger.info(f"Image generated for '{message.content}'")
         image_url = response.data[0].url
         elements = [cl.Image(url=image_url)]
         await cl.Message(f"Here's what I generated for **{message.content}**", elements=elements).send()
@@ -170,48 +341,66 @@ async def on_message(message: cl.Message):
     else:
         if len(message.elements) > 0:
             ## Builds an in-memory RAG engine
-            await cl.Message("Processing files").send()
             filepaths = [file.path for file in message.elements]
             filenames = [file.name for file in message.elements]
             logger.info(f"filepaths: {filepaths}")
             logger.info(f"filenames: {filenames}")
             
-            ## Convert uploaded documents to LlamaIndex Document objects 
-            documents = SimpleDirectoryReader(input_files=filepaths).load_data()
-            
-            ## Ingest documents into in-memory Vector Database.
-            index = VectorStoreIndex.from_documents(documents, embed_model=embed_model)
-            await cl.Message("Processed uploaded files").send()
-            
+            ## Name and describe the documents while they are being embedded
             openai_llm = cl.user_session.get("llm")
-            name = openai_llm.complete(f"Based on these filenames, come up with a short, concise name that describes these documents. For example 'MBA Value Analysis'. Do not return any '.pdf' or file extensions, just the name. Filenames: {', '.join(filenames)}")
-            description = openai_llm.complete(f"Based on these filenames, come up with a consolidated description that describes these documents. For example 'Answers questions about animals'. Filenames: {', '.join(filenames)}")
-            await cl.Message(f"Uploaded document/s follow the theme: {name}. Here's the general description of the document/s uploaded: {description}").send()
+            describe_task = session_tasks().spawn(describe_documents(openai_llm, filenames), "describe")
             
-            tool = QueryEngineTool.from_defaults(
-                query_engine=index.as_query_engine(similarity_top_k=8, llm=openai_llm),
-                name = "_".join(str(name).split(" ")),
-                description=str(description)
-            )
-            agent_tools = cl.user_session.get("agent_tools", [])
-            agent_tools.append(tool)
+            ## Load the index of these files from the cache, or stream them into an
+            ## in-memory Vector Database. Returns once the first file is queryable.
+            index_key, index = await build_document_index(filepaths, filenames)
             
-            agent = FunctionAgent(tools=agent_tools, llm=openai_llm)
-            cl.user_session.set("agent", agent)
-            cl.user_session.set("agent_tools", agent_tools)
+            if index is None:
+                describe_task.cancel()
+            else:
+                ## Register the tool under a local name right away, the LLM's name and
+                ## description replace it in place once they arrive.
+                ## A re-upload under the same filename replaces the earlier document tool,
+                ## a name taken by a local or MCP tool is suffixed instead
+                tool_registry = cl.user_session.get("tool_registry")
+                name, description = describe_filenames(filenames)
+                if tool_registry.group_of(name) not in (None, "documents"):
+                    name = tool_registry.unique_name(name)
+                tool = QueryEngineTool.from_defaults(
+                    query_engine=document_query_engine(index_key, openai_llm, index),
+                    name=name,
+                    description=description,
+                )
+                tool_registry.add([tool], group="documents")
+                tool_registry.apply(cl.user_session.get("agent"))
+                ## Remember the tool against the thread so it can be restored on resume
+                thread_id = cl.context.session.thread_id
+                thread_store.save_tool(thread_id, DocumentToolRecord(index_key, name, description))
+                session_tasks().spawn(apply_document_description(tool, index_key, thread_id, describe_task), "describe")
+        
+        elif await answer_from_gazetteer(message.content):
+            return
         
         reply = await generate_answer(message.content)
     
 @cl.on_stop
+@metrics.timed("on_stop")
 async def on_stop():
     user = cl.user_session.get("user")
     logger.info(f"{user.identifier} has stopped the task!")
+    
+    ## Chainlit cancels the message task, the rest of the turn's work is cancelled here.
+    ## Chainlit's cancel only takes effect at the task's next await, so the turn is still running.
+    stopped = await session_tasks().cancel()
+    for kind, count in stopped.items():
+        cancelled_work.inc(count, kind=kind)
     await cl.Message("You have stopped the task!").send()
 
 @cl.on_chat_end
-def on_chat_end():
+async def on_chat_end():
     user = cl.user_session.get("user")
     logger.info(f"{user.identifier} has ended the chat")
+    ## Runs on every disconnect, the session can still reconnect until session_timeout.
+    ## Its MCP connections are released once the session is cleared, see release_mcp_connections.
 
 @cl.on_logout
 def on_logout(request: Request, response: Response):
@@ -221,61 +410,74 @@ def on_logout(request: Request, response: Response):
         response.delete_cookie(cookie_name)
 
 @cl.on_chat_resume
+@session_state.tracked
 async def on_chat_resume(thread: ThreadDict):
     """Handler function to resume a chat"""
     
     ## Setup LLM
-    openai_llm = OpenAI(model="gpt-4o-mini", temperature=0)
-    
-    ## Restore memory buffer
-    memory = ChatMemoryBuffer.from_defaults()
-    root_messages = [m for m in thread["steps"]]
-    for message in root_messages:
-        print(message)
-        if message["type"] == "user_message":
-            memory.put(
-                ChatMessage(
-                    role=MessageRole.USER,
-                    content=message['output']
-                )
-            )
-        else:
-            memory.put(
-                ChatMessage(
-                    role=MessageRole.ASSISTANT,
-                    content=message['output']
-                )
-            )
+    openai_llm = create_llm("gpt-4o-mini", 0)
+    
+    ## Restore memory: the stored summary plus the most recent messages that fit the budget,
+    ## and any older ones the summary does not cover yet.
+    ## Tool steps are skipped, they are not part of the conversation. Notices sent outside
+    ## remember_turn make the thread longer than the memory, which only errs on keeping more.
+    summary, summarized = thread_store.load_summary(thread["id"])
+    memory = SummarizingMemory(
+        openai_llm,
+        token_limit=MEMORY_TOKEN_LIMIT,
+        summary=summary,
+        summarized=summarized,
+        on_summary=partial(thread_store.save_summary, thread["id"]),
+    )
+    chat_profile = cl.user_session.get("chat_profile")
+    if chat_profile in SYSTEM_PROMPTS:
+        memory.put(ChatMessage(role=MessageRole.SYSTEM, content=SYSTEM_PROMPTS[chat_profile]))
+    roles = {"user_message": MessageRole.USER, "assistant_message": MessageRole.ASSISTANT}
+    memory.restore([
+        ChatMessage(role=roles[step["type"]], content=step["output"])
+        for step in thread["steps"]
+        if step["type"] in roles and step.get("output")
+    ])
     cl.user_session.set("memory", memory)
     
     # ## Restore agent
-    mcp_tools = cl.user_session.get("mcp_tools", {})
+    tool_registry = ToolRegistry()
+    tool_registry.add(local_tools(), group="local")
     
-    agent_tool = FunctionTool.from_defaults(async_fn=move_map_to)
-    agent_tools = [agent_tool]
+    ## Restore document tools. Their indexes are only loaded from disk on first use.
+    evicted = []
+    for record in thread_store.load_tools(thread["id"]):
+        if index_cache.has_index(record.index_key):
+            tool_registry.add([load_document_tool(record, openai_llm)], group="documents")
+        else:
+            evicted.append(record.name)
+    restored = len(tool_registry.group("documents"))
     
-    if len(mcp_tools)>0:
-        agent = FunctionAgent(
-            tools=agent_tools + list(mcp_tools.values()), #agent still has tools not removed
-            llm=openai_llm,
-        )
-    else:
-        agent = FunctionAgent(
-            tools=agent_tools,
-            llm=openai_llm,
-        )
+    agent = FunctionAgent(
+        tools=tool_registry.tools(),
+        llm=openai_llm,
+    )
+    cl.user_session.set("llm", openai_llm)
+    cl.user_session.set("tool_registry", tool_registry)
+    cl.user_session.set("mcp_connections", {})
     cl.user_session.set("agent", agent)
     cl.user_session.set("context", Context(agent))
     
     user = cl.user_session.get("user")
-    logger.info(f"{user} has resumed chat")
-    await cl.Message("Chat resumed. Do note that previously uploaded documents will not be available in this chat and must be uploaded again").send()
+    logger.info(f"{user} has resumed chat with {restored} document tools")
+    reply = "Chat resumed."
+    if restored > 0:
+        reply += f" Restored {restored} previously uploaded document set/s."
+    if evicted:
+        reply += f" These documents are no longer cached and must be uploaded again: {', '.join(evicted)}"
+    await cl.Message(reply).send()
     
 @cl.action_callback("close_map")
 async def on_test_action():
     """Callback handler to close the map"""
     await cl.Message(content="Closed map! 🗺️", type="assistant_message").send()
     await cl.ElementSidebar.set_elements([])
+    cl.user_session.set("map_open", False)
 
 @cl.set_starters
 async def set_starters():
@@ -300,89 +502,89 @@ async def set_starters():
 
 ## Audio handlers
 @cl.on_audio_start
+@session_state.tracked
 async def on_audio_start():
     """Handler to manage mic button click event"""
     
-    cl.user_session.set("silent_duration_ms", 0)
-    cl.user_session.set("is_speaking", False)
-    cl.user_session.set("audio_chunks", [])
+    ## The PCM buffer and VAD are created once per session and reused across turns
+    audio_buffer = cl.user_session.get("audio_buffer")
+    if audio_buffer is None:
+        audio_buffer = PCMRingBuffer(AUDIO_SAMPLE_RATE, AUDIO_MAX_SECONDS)
+        cl.user_session.set("audio_buffer", audio_buffer)
+        cl.user_session.set(
+            "vad",
+            VoiceActivityDetector(
+                AUDIO_SAMPLE_RATE,
+                margin_db=VAD_MARGIN_DB,
+                end_of_turn_ms=VAD_END_OF_TURN_MS,
+            ),
+        )
+    audio_buffer.clear()
+    cl.user_session.get("vad").reset()
+    start_transcription(audio_buffer)
     
     user = cl.user_session.get("user")
     logger.info(f"{user} is starting an audio stream...")
     return True
 
 @cl.on_audio_chunk
+@session_state.tracked
 async def on_audio_chunk(chunk: cl.InputAudioChunk):
     """Handller function to manage audio chunks"""
     
-    audio_chunks = cl.user_session.get("audio_chunks")
-
-    if audio_chunks is not None:
-        audio_chunk = np.frombuffer(chunk.data, dtype=np.int16)
-        audio_chunks.append(audio_chunk)
-
-    # If this is the first chunk, initialize timers and state
-    if chunk.isStart:
-        cl.user_session.set("last_elapsed_time", chunk.elapsedTime)
-        cl.user_session.set("is_speaking", True)
+    audio_buffer = cl.user_session.get("audio_buffer")
+    vad = cl.user_session.get("vad")
+    if audio_buffer is None or vad is None:
         return
 
-    last_elapsed_time = cl.user_session.get("last_elapsed_time")
-    silent_duration_ms = cl.user_session.get("silent_duration_ms")
-    is_speaking = cl.user_session.get("is_speaking")
-
-    # Calculate the time difference between this chunk and the previous one
-    time_diff_ms = chunk.elapsedTime - last_elapsed_time
-    cl.user_session.set("last_elapsed_time", chunk.elapsedTime)
-
-    # Compute the RMS (root mean square) energy of the audio chunk
-    audio_energy = audioop.rms(
-        chunk.data, 2
-    )  # Assumes 16-bit audio (2 bytes per sample)
-
-    if audio_energy < SILENCE_THRESHOLD:
-        # Audio is considered silent
-        silent_duration_ms += time_diff_ms
-        cl.user_session.set("silent_duration_ms", silent_duration_ms)
-        if silent_duration_ms >= SILENCE_TIMEOUT and is_speaking:
-            cl.user_session.set("is_speaking", False)
+    audio_buffer.write(chunk.data)
+
+    # Classify every new frame of the buffer against the adaptive noise floor
+    decision = vad.process(audio_buffer)
+    transcription = cl.user_session.get("transcription")
+    if transcription is not None:
+        for start, end in decision.segments:
+            transcription.add_segment(start, end)
+    if decision.end_of_turn:
+        end_of_turn_delay.observe(vad.last_decision_latency_ms / 1000.0)
+        logger.info(
+            f"End of turn {vad.last_decision_latency_ms:.0f}ms after speech "
+            f"(noise floor {vad.noise_floor_db:.1f} dBFS)"
+        )
+        vad.reset()
+        with session_tasks().guard("voice_turn"):
             await process_audio()
-    else:
-        # Audio is not silent, reset silence timer and mark as speaking
-        cl.user_session.set("silent_duration_ms", 0)
-        if not is_speaking:
-            cl.user_session.set("is_speaking", True)
 
 ## MCP Utilities
 @cl.on_mcp_connect
+@session_state.tracked
+@metrics.timed("on_mcp_connect")
 async def on_mcp_connect(connection):
     """Handler to connect to an MCP server. 
     Lists tools available on the server and connects these tools to
     the LLM agent."""
     
-    openai_llm = cl.user_session.get("llm")
-    mcp_cache = cl.user_session.get("mcp_tool_cache", {})
-    mcp_tools = cl.user_session.get("mcp_tools", {})
-    agent_tools = cl.user_session.get("agent_tools", [])
+    tool_registry = cl.user_session.get("tool_registry")
+    mcp_connections = cl.user_session.get("mcp_connections", {})
     try:
         logger.info("Connecting to MCP")
-        mcp_client = BasicMCPClient(connection.url)
-        logger.info("Connected to MCP")
-        mcp_tool_spec = McpToolSpec(client=mcp_client)
-        logger.info("Unpacking tools")
-        new_tools = await mcp_tool_spec.to_tool_list_async()
-        for tool in new_tools:
-            if tool.metadata.name not in mcp_tools:
-                mcp_tools[tool.metadata.name] = tool
-                mcp_cache[connection.name].append(tool.metadata.name)
-        agent = FunctionAgent(
-            tools=agent_tools + list(mcp_tools.values()),
-            llm=openai_llm,
-        )
-        cl.user_session.set("agent", agent)
-        cl.user_session.set("context", Context(agent))
-        cl.user_session.set("mcp_tools", mcp_tools)
-        cl.user_session.set("mcp_tool_cache", mcp_cache)
+        ## Connections and tool lists are shared by every session using the same server and headers.
+        ## Older Chainlit releases send no headers.
+        headers = getattr(connection, "headers", None) or None
+        new_tools = await mcp_pool.acquire(connection.url, headers)
+        if headers is None:
+            ## Responses to a session's own credentials are not shared with other sessions
+            new_tools = [mcp_response_cache.wrap(tool) for tool in new_tools]
+        logger.info(f"Connected to MCP. Open connections: {mcp_pool.stats()}")
+        if connection.name in mcp_connections:
+            await mcp_pool.release(*mcp_connections[connection.name])
+        mcp_connections[connection.name] = (connection.url, headers)
+        cl.user_session.set("mcp_connections", mcp_connections)
+        ## A reconnect, possibly to another URL, replaces the tools of the previous connection
+        tool_registry.remove_group(f"mcp:{connection.name}")
+        tool_registry.add(new_tools, group=f"mcp:{connection.name}")
+        tool_registry.apply(cl.user_session.get("agent"))
+        session_tasks().spawn(tool_selector.warm(new_tools), "tool_warmup")
         await cl.Message(f"Connected to MCP server: {connection.name} on {connection.url}", type="assistant_message").send()
 
         await cl.Message(
@@ -392,49 +594,38 @@ async def on_mcp_connect(connection):
         await cl.Message(f"Error conecting to tools from MCP server: {str(e)}", type="assistant_message").send()
 
 @cl.on_mcp_disconnect
+@session_state.tracked
 async def on_mcp_disconnect(name: str):
     """Handler to handle disconnects from an MCP server.
     Updates tool list available for the LLM agent.
     """
-    openai_llm = cl.user_session.get("llm")
-    agent_tools = cl.user_session.get("agent_tools", [])
-    mcp_tools = cl.user_session.get("mcp_tools", {})
-    mcp_cache = cl.user_session.get("mcp_tool_cache", {})
-    
-    if name in mcp_cache:
-        for tool_name in mcp_cache[name]:
-            del mcp_tools[tool_name]
-        del mcp_cache[name]
+    tool_registry = cl.user_session.get("tool_registry")
+    tool_registry.remove_group(f"mcp:{name}")
+    mcp_connections = cl.user_session.get("mcp_connections", {})
+    if name in mcp_connections:
+        await mcp_pool.release(*mcp_connections.pop(name))
 
     # Update tools list in agent
-    if len(mcp_tools)>0:
-        agent = FunctionAgent(
-            tools=agent_tools + list(mcp_tools.values()), #agent still has tools not removed
-            llm=openai_llm,
-        )
-    else:
-        agent = FunctionAgent(
-            tools=agent_tools,
-            llm=openai_llm,
-        )
-    cl.user_session.set("context", Context(agent))
-    cl.user_session.set("mcp_tools", mcp_tools)
-    cl.user_session.set("mcp_tool_cache", mcp_cache)
-    cl.user_session.set("agent", agent)
+    tool_registry.apply(cl.user_session.get("agent"))
     
     await cl.Message(f"Disconnected from MCP server: {name}", type="assistant_message").send()
 
 ## Steps
 @cl.step(type="tool")
-async def speech_to_text(audio_file):
-    response = await openai_client.audio.transcriptions.create(
-        model="whisper-1", file=audio_file, language="en",
-    )
+@metrics.timed("speech_to_text")
+async def speech_to_text(wav: bytes):
+    return await transcriber.transcribe(wav)
 
-    return response.text
+@cl.step(name="speech_to_text", type="tool")
+@metrics.timed("speech_to_text")
+async def finish_transcription(transcription: StreamingTranscription):
+    """Waits for the segments still being transcribed and stitches the turn together"""
+
+    return await transcription.finish()
 
 
 @cl.step(type="tool")
+@metrics.timed("text_to_speech")
 async def text_to_speech(text: str, mime_type: str):
     CHUNK_SIZE = 1024
 
@@ -448,46 +639,124 @@ async def text_to_speech(text: str, mime_type: str):
 
     data = {
         "text": text,
-        "model_id": "eleven_multilingual_v2",
-        "voice_settings": {"stability": 0.5, "similarity_boost": 0.5},
+        "model_id": ELEVENLABS_MODEL_ID,
+        "voice_settings": ELEVENLABS_VOICE_SETTINGS,
     }
 
-    async with httpx.AsyncClient(timeout=25.0) as client:
-        response = await client.post(url, json=data, headers=headers)
-        response.raise_for_status()  # Ensure we notice bad responses
-
-        buffer = io.BytesIO()
-        buffer.name = f"output_audio.{mime_type.split('/')[1]}"
+    async def download():
+        async with http_client.stream("POST", url, json=data, headers=headers) as response:
+            response.raise_for_status()  # Ensure we notice bad responses
 
-        async for chunk in response.aiter_bytes(chunk_size=CHUNK_SIZE):
-            if chunk:
-                buffer.write(chunk)
+            buffer = io.BytesIO()
+            async for chunk in response.aiter_bytes(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    buffer.write(chunk)
+            return buffer.getvalue()
 
-        buffer.seek(0)
-        return buffer.name, buffer.read()
+    ## Repeated replies ("Map moved!", greetings...) are played from the cache
+    key = tts_cache.key(text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL_ID, ELEVENLABS_VOICE_SETTINGS, mime_type)
+    audio = await tts_cache.get(key, download)
+    return f"output_audio.{mime_type.split('/')[1]}", audio
     
+async def synthesize_speech(text: str):
+    """Streams the ElevenLabs synthesis of a sentence as raw 16-bit PCM at the audio sample rate"""
+
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}/stream"
+    output_format = f"pcm_{AUDIO_SAMPLE_RATE}"
+    headers = {
+        "Content-Type": "application/json",
+        "xi-api-key": ELEVENLABS_API_KEY,
+    }
+    data = {
+        "text": text,
+        "model_id": ELEVENLABS_MODEL_ID,
+        "voice_settings": ELEVENLABS_VOICE_SETTINGS,
+    }
+
+    async def download():
+        async with http_client.stream(
+            "POST", url, json=data, headers=headers, params={"output_format": output_format}
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size=4096):
+                if chunk:
+                    yield chunk
+
+    key = tts_cache.key(text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL_ID, ELEVENLABS_VOICE_SETTINGS, output_format)
+    async for chunk in tts_cache.stream(key, download):
+        yield chunk
+
 @cl.step(type="tool")
 async def move_map_to(latitude: float, longitude: float):
     """Move the map to the given latitude and longitude."""
     
-    await open_map(
+    await show_on_map(
         latitude=latitude,
         longitude=longitude
     )
 
-    fn = cl.CopilotFunction(
-        name="move-map", args={"latitude": latitude, "longitude": longitude}
-    )
-    await fn.acall()
-
     return "Map moved!"
 
+@cl.step(type="tool")
+async def move_map_to_place(place: str):
+    """Move the map to a city or landmark by name, e.g. "Paris" or "Eiffel Tower".
+    Prefer this over move_map_to, the coordinates are looked up offline."""
+    
+    match = gazetteer.lookup(place)
+    if match is None:
+        return f"'{place}' is not in the offline gazetteer, use move_map_to with its coordinates instead."
+    if match.how != "exact" and match.score < MAP_FAST_PATH_MIN_SCORE:
+        ## Fuzzy matches this weak are often another place, e.g. "Bern" for Berlin
+        return (
+            f"'{place}' is not in the offline gazetteer, the closest entry is {match.place.describe()}. "
+            f"If that is not the place meant, use move_map_to with its coordinates instead."
+        )
+    
+    await show_on_map(match.place.latitude, match.place.longitude, match.place.zoom)
+    return f"Map moved to {match.place.describe()}!"
+
 ## Utility functions
-async def generate_answer(query: str):
+def create_llm(model: str, temperature: float) -> OpenAI:
+    """OpenAI LLM on the shared HTTP client, which does the retrying"""
+
+    return OpenAI(model=model, temperature=temperature, async_http_client=http_client, max_retries=0)
+
+@metrics.timed("generate_answer")
+async def generate_answer(query: str, on_delta: Optional[Callable[[str], None]] = None):
+    started = time.perf_counter()
     agent = cl.user_session.get("agent")
     memory = cl.user_session.get("memory")
     chat_history = memory.get()
     msg = cl.Message("", type="assistant_message")
+    tool_registry = cl.user_session.get("tool_registry")
+    
+    ## Standalone questions (no earlier turns to depend on) can be answered from the cache
+    cache_lookup = None
+    if response_cache is not None and not any(m.role == MessageRole.USER for m in chat_history):
+        llm = cl.user_session.get("llm")
+        ## Document tools are named after the filenames, their content hashes tell uploads apart
+        documents = sorted(tool.query_engine.key for tool in tool_registry.group("documents"))
+        scope = response_cache.scope(
+            cl.user_session.get("chat_profile"), llm.model, llm.temperature, tool_registry.fingerprint, *documents
+        )
+        cache_lookup = await response_cache.lookup(query, scope)
+        if cache_lookup.text is not None:
+            logger.info(f"Answering '{query}' from the response cache ({cache_lookup.how} match)")
+            time_to_first_token.observe(time.perf_counter() - started, source="cache")
+            async with token_stream(msg) as stream:
+                for token in stream_chunks(cache_lookup.text):
+                    await stream.add(token)
+                    if on_delta is not None:
+                        on_delta(token)
+            await msg.send()
+            remember_turn(memory, query, cache_lookup.text)
+            return msg
+    
+    ## Only expose the MCP tools relevant to this query
+    mcp_tools, other_tools = [], []
+    for group in tool_registry.groups():
+        (mcp_tools if group.startswith("mcp:") else other_tools).extend(tool_registry.group(group))
+    agent.tools = await tool_selector.select(query, mcp_tools, pinned=other_tools)
     
     context = cl.user_session.get("context")
     handler = agent.run(
@@ -495,15 +764,67 @@ async def generate_answer(query: str):
         chat_history = chat_history,
         ctx = context
     )
-    async for event in handler.stream_events():
-        if isinstance(event, AgentStream):
-            await msg.stream_token(event.delta)
-        elif isinstance(event, ToolCall):
-            with cl.Step(name=f"{event.tool_name} tool", type="tool"):
-                continue
-    
-    response = await handler
+    tools_called = []
+    tools_started = {}
+    first_token, tokens = None, 0
+    try:
+        ## Flushed on exit, so a stopped run still shows what it had generated
+        async with token_stream(msg) as stream:
+            async for event in handler.stream_events():
+                if isinstance(event, AgentStream):
+                    if event.delta:
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                            time_to_first_token.observe(first_token - started, source="agent")
+                        tokens += 1
+                    await stream.add(event.delta)
+                    if on_delta is not None:
+                        on_delta(event.delta)
+                elif isinstance(event, ToolCall):
+                    ## The text before a tool call is shown ahead of its step
+                    await stream.flush()
+                    tools_called.append(event.tool_name)
+                    tools_started[event.tool_id] = time.perf_counter()
+                    with cl.Step(name=f"{event.tool_name} tool", type="tool"):
+                        continue
+                elif isinstance(event, ToolCallResult) and event.tool_id in tools_started:
+                    tool_call_seconds.observe(time.perf_counter() - tools_started.pop(event.tool_id), tool=event.tool_name)
+        
+        response = await handler
+    except asyncio.CancelledError:
+        await stop_agent_run(handler, agent, len(tools_started))
+        raise
+    if tokens > 1:
+        tokens_per_second.observe((tokens - 1) / max(time.perf_counter() - first_token, 1e-6))
     await msg.send()
+    remember_turn(memory, query, str(response))
+    
+    ## A cached answer would skip the tool calls, so only answers without side effects are stored
+    if cache_lookup is not None:
+        side_effects = [name for name in tools_called if not is_read_only_tool(tool_registry, name)]
+        if side_effects:
+            response_cache.bypass(side_effects)
+        else:
+            response_cache.store(cache_lookup, str(response))
+    return msg
+
+async def stop_agent_run(handler, agent: FunctionAgent, pending_tool_calls: int):
+    """Cancels a stopped agent run, with the LLM and tool calls it is waiting on, and waits for it to wind down"""
+    
+    await handler.cancel_run()
+    await asyncio.wait([handler], timeout=STOP_CLEANUP_TIMEOUT)
+    if handler.done() and not handler.cancelled():
+        handler.exception()  # The run ends with WorkflowCancelledByUser
+    ## A cancelled run can leave events queued in its context, the next turn starts afresh
+    cl.user_session.set("context", Context(agent))
+    cancelled_work.inc(kind="agent_run")
+    if pending_tool_calls:
+        cancelled_work.inc(pending_tool_calls, kind="tool_call")
+    logger.info(f"Agent run cancelled with {pending_tool_calls} tool calls in flight")
+
+def remember_turn(memory: SummarizingMemory, query: str, answer: str):
+    """Adds a question and its answer to the session memory"""
+    
     memory.put(
         ChatMessage(
             role = MessageRole.USER,
@@ -513,56 +834,286 @@ async def generate_answer(query: str):
     memory.put(
         ChatMessage(
             role = MessageRole.ASSISTANT,
-            content = str(response)
+            content = answer
         )
     )
     cl.user_session.set("memory", memory)
-    return msg
+
+def is_read_only_tool(tool_registry: ToolRegistry, name: str) -> bool:
+    """Document queries and the MCP tools allowlisted as read-only have no side effects"""
+    
+    documents = {tool.metadata.name for tool in tool_registry.group("documents")}
+    return name in documents or mcp_response_cache.is_cacheable(name)
+
+def document_query_engine(index_key: str, llm, index: Optional[VectorStoreIndex] = None) -> LazyQueryEngine:
+    """Query engine over a cached index, loaded on first use unless the index is passed in"""
+    
+    def build(index: VectorStoreIndex):
+        return index.as_query_engine(similarity_top_k=RAG_TOP_K, llm=llm)
+    
+    def load():
+        ## The index may have been evicted from the shared cache since the tool was unloaded.
+        ## The agent gets the error as the tool's output and can relay it.
+        index = index_cache.load_index(index_key, embed_model)
+        if index is None:
+            raise RuntimeError("These documents are no longer cached, ask the user to upload them again")
+        return build(index)
+    
+    return LazyQueryEngine(
+        load,
+        engine=build(index) if index is not None else None,
+        key=index_key,
+    )
+
+def load_document_tool(record: DocumentToolRecord, llm) -> QueryEngineTool:
+    """Builds a QueryEngineTool over a cached index that is only loaded on first use"""
+    
+    return QueryEngineTool.from_defaults(
+        query_engine=document_query_engine(record.index_key, llm),
+        name=record.name,
+        description=record.description,
+    )
+
+async def release_mcp_connections(mcp_connections: dict):
+    """Releases a cleared session's references on the shared MCP connections"""
+    
+    for url, headers in mcp_connections.values():
+        await mcp_pool.release(url, headers)
+    mcp_connections.clear()
+
+def document_tools_bytes(tool_registry: ToolRegistry) -> int:
+    """Approximate memory of the loaded document indexes: their size on disk"""
+    
+    return sum(
+        index_cache.index_bytes(tool.query_engine.key)
+        for tool in tool_registry.group("documents")
+        if tool.query_engine.is_loaded
+    )
+
+def unload_document_tools(tool_registry: ToolRegistry):
+    """Unloads the document indexes that are persisted, the next query loads them from the cache"""
+    
+    for tool in tool_registry.group("documents"):
+        if index_cache.has_index(tool.query_engine.key):
+            tool.query_engine.unload()
+
+async def build_document_index(filepaths: list, filenames: list):
+    """Loads the index of the uploaded files from the cache, or streams them into a new one.
+    Returns as soon as the first file is queryable, the remaining files are inserted in the background.
+    The index is None if no file could be ingested."""
+    
+    index_key = await cl.make_async(index_cache.index_key)(filepaths, embed_model)
+    index = await cl.make_async(index_cache.load_index)(index_key, embed_model)
+    if index is not None:
+        await cl.Message("Loaded uploaded files from cache").send()
+        return index_key, index
+    
+    vector_store = CompactVectorStore(dtype=VECTOR_STORE_DTYPE, alpha=RAG_HYBRID_ALPHA)
+    index = VectorStoreIndex(
+        nodes=[],
+        embed_model=embed_model,
+        storage_context=StorageContext.from_defaults(vector_store=vector_store),
+    )
+    first_file_ready = asyncio.Event()
+    ingest_task = session_tasks().spawn(
+        stream_into_index(index, index_key, filepaths, filenames, first_file_ready), "ingest"
+    )
+    first_file_task = asyncio.create_task(first_file_ready.wait())
+    try:
+        await asyncio.wait([ingest_task, first_file_task], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        first_file_task.cancel()
+    if not first_file_ready.is_set():
+        return index_key, None
+    return index_key, index
+
+async def apply_document_description(
+    tool: QueryEngineTool,
+    index_key: str,
+    thread_id: str,
+    describe_task: asyncio.Task,
+):
+    """Renames and redescribes a document tool in place once the LLM has described it"""
+    
+    try:
+        spec = await describe_task
+    except Exception as e:
+        logger.warning(f"Could not describe uploaded documents, keeping '{tool.metadata.name}': {e}")
+        return
+    
+    old_name, old_description = tool.metadata.name, tool.metadata.description
+    tool.metadata.name = tool_name(spec.name)
+    tool.metadata.description = spec.description
+    if not cl.user_session.get("tool_registry").rename(old_name, tool):
+        ## Replaced by a later upload of the same filename while it was being described
+        tool.metadata.name, tool.metadata.description = old_name, old_description
+        return
+    thread_store.rename_tool(
+        thread_id, old_name, DocumentToolRecord(index_key, tool.metadata.name, spec.description)
+    )
+    await cl.Message(f"Uploaded document/s follow the theme: {spec.name}. Here's the general description of the document/s uploaded: {spec.description}").send()
+
+@metrics.timed("ingest")
+async def stream_into_index(
+    index: VectorStoreIndex,
+    index_key: str,
+    filepaths: list,
+    filenames: list,
+    first_file_ready: asyncio.Event,
+):
+    """Inserts each uploaded file into the index as soon as it is embedded, then caches the index"""
+    
+    names = dict(zip(filepaths, filenames))
+    progress = []
+    started, chunks = time.perf_counter(), 0
+    try:
+        async with cl.Step(name="Processing files", type="tool") as step:
+            async for path, nodes in ingestor.ingest(filepaths):
+                index.insert_nodes(nodes)
+                chunks += len(nodes)
+                first_file_ready.set()
+                progress.append(f"Indexed {names[path]} ({len(nodes)} chunks)")
+                step.output = "\n".join(progress)
+                await step.update()
+        embedded_chunks.inc(chunks)
+        embedding_rate.observe(chunks / max(time.perf_counter() - started, 1e-6))
+        await cl.make_async(index_cache.save_index)(index_key, index)
+        logger.info(f"Ingested {len(filepaths)} files into {index_key}")
+    except asyncio.CancelledError:
+        logger.info(f"Ingest into {index_key} stopped after {chunks} chunks, the index is not cached")
+        raise
+    except Exception as e:
+        logger.exception("Error processing uploaded files")
+        await cl.Message(f"Error processing uploaded files: {str(e)}").send()
 
 async def open_map(
     latitude: float = 1.290270, 
-    longitude: float = 103.851959
+    longitude: float = 103.851959,
+    zoom: int = 12
 ):
     """Handler function to shift the canvas to a specific longitude and latitude component"""
     
-    map_props = {"latitude": latitude, "longitude": longitude, "zoom": 12}
+    map_props = {"latitude": latitude, "longitude": longitude, "zoom": zoom}
     custom_element = cl.CustomElement(name="Map", props=map_props, display="inline")
     await cl.ElementSidebar.set_title("canvas")
     await cl.ElementSidebar.set_elements([custom_element], key="map-canvas")
+    cl.user_session.set("map_open", True)
 
-async def process_audio():
-    """ Processes the audio buffer from the session"""
+async def show_on_map(latitude: float, longitude: float, zoom: int = 12):
+    """Pans the open map in place, or opens the map at the location"""
+    
+    ## The mounted map element (or a copilot's host page) handles move-map, pans without
+    ## the sidebar being re-rendered and acks with {"moved": true}. Open a new map otherwise.
+    if cl.user_session.get("map_open", cl.context.session.client_type == "copilot"):
+        args = {"latitude": latitude, "longitude": longitude, "zoom": zoom}
+        try:
+            ack = await cl.context.emitter.send_call_fn("move-map", args, timeout=MAP_MOVE_TIMEOUT)
+        except Exception as e:
+            logger.info(f"The map did not answer move-map: {e}")
+            ack = None
+        if isinstance(ack, dict) and ack.get("moved"):
+            return
+        ## Closed without the close action, e.g. the sidebar was dismissed. Later moves skip the wait.
+        cl.user_session.set("map_open", False)
+    await open_map(latitude, longitude, zoom)
+
+def local_tools() -> list:
+    """Tools every session starts with"""
+    
+    return [
+        FunctionTool.from_defaults(async_fn=move_map_to_place),
+        FunctionTool.from_defaults(async_fn=move_map_to),
+    ]
+
+async def answer_from_gazetteer(query: str) -> bool:
+    """Fast path for "Show me X": moves the map without an LLM round trip when X is a known place.
+    Returns False if the query should go to the agent."""
+    
+    place = parse_show_request(query)
+    match = gazetteer.lookup(place) if place else None
+    if match is None or match.score < MAP_FAST_PATH_MIN_SCORE:
+        return False
+    
+    logger.info(f"Resolved '{place}' to {match.place.describe()} ({match.how} match)")
+    await show_on_map(match.place.latitude, match.place.longitude, match.place.zoom)
+    reply = f"Here's {match.place.name}, {match.place.country}! 🗺️"
+    await cl.Message(reply, type="assistant_message").send()
+    
+    ## Keep the exchange in memory so follow-up questions have the context
+    remember_turn(cl.user_session.get("memory"), query, reply)
+    return True
+
+@asynccontextmanager
+async def token_stream(msg: cl.Message):
+    """Streams into a message through a TokenCoalescer, counting deltas and emits"""
     
-    if audio_chunks := cl.user_session.get("audio_chunks"):
-        # Concatenate all chunks
-        concatenated = np.concatenate(list(audio_chunks))
+    coalescer = TokenCoalescer(
+        msg.stream_token,
+        min_delay=STREAM_MIN_DELAY_MS / 1000,
+        max_delay=STREAM_MAX_DELAY_MS / 1000,
+        max_bytes=STREAM_MAX_BYTES,
+    )
+    try:
+        async with coalescer:
+            yield coalescer
+    finally:
+        streamed_deltas.inc(coalescer.deltas)
+        stream_emits.inc(coalescer.emits)
 
-        # Create an in-memory binary stream
-        wav_buffer = io.BytesIO()
+def session_tasks() -> TaskScope:
+    """The session's in-flight work that on_stop cancels"""
+    
+    tasks = cl.user_session.get("tasks")
+    if tasks is None:
+        tasks = TaskScope(cleanup_timeout=STOP_CLEANUP_TIMEOUT)
+        cl.user_session.set("tasks", tasks)
+    return tasks
 
-        # Create WAV file with proper parameters
-        with wave.open(wav_buffer, "wb") as wav_file:
-            wav_file.setnchannels(1)  # mono
-            wav_file.setsampwidth(2)  # 2 bytes per sample (16-bit)
-            wav_file.setframerate(24000)  # sample rate (24kHz PCM)
-            wav_file.writeframes(concatenated.tobytes())
+def start_transcription(pcm_buffer: PCMRingBuffer):
+    """Starts streaming transcription of a new turn, when enabled"""
 
-        # Reset buffer position
-        wav_buffer.seek(0)
-        cl.user_session.set("audio_chunks", [])
+    if STT_STREAMING:
+        transcription = StreamingTranscription(transcriber, pcm_buffer, min_segment_seconds=STT_MIN_SEGMENT_SECONDS)
+        cl.user_session.set("transcription", transcription)
+        session_tasks().on_cancel("stt_segment", cancel_transcription)
+
+def cancel_transcription() -> int:
+    """Cancels the segments of the session's transcription still in flight"""
+    
+    ## Looked up when stopping, so the callback does not keep an idle session's audio buffer alive
+    transcription = cl.user_session.get("transcription")
+    return transcription.cancel() if transcription is not None else 0
 
-    frames = wav_file.getnframes()
-    rate = wav_file.getframerate()
+async def process_audio():
+    """ Processes the audio buffer from the session"""
+    
+    pcm_buffer = cl.user_session.get("audio_buffer")
+    if pcm_buffer is None:
+        return
 
-    duration = frames / float(rate)
+    streaming = cl.user_session.get("transcription")
+    duration = pcm_buffer.duration
     if duration <= 1.71:
-        print("The audio is too short, please try again.")
+        pcm_buffer.clear()
+        if streaming is not None:
+            streaming.cancel()
+        logger.info(f"Discarded a {duration:.2f}s voice turn as too short")
+        await cl.Message("The audio is too short, please try again.").send()
         return
 
-    audio_buffer = wav_buffer.getvalue()
+    turn_started = time.perf_counter()
+    # WAV header plus the buffered samples, without concatenating chunks
+    audio_buffer = pcm_buffer.wav_bytes()
+    if streaming is not None:
+        streaming.flush()
+    pcm_buffer.clear()
     input_audio_el = cl.Audio(content=audio_buffer, mime="audio/wav")
-    whisper_input = ("audio.wav", audio_buffer, "audio/wav")
-    transcription = await speech_to_text(whisper_input)
+    if streaming is not None:
+        # Most segments were sent while the user was talking, only the tail is left
+        transcription = await finish_transcription(streaming)
+    else:
+        transcription = await speech_to_text(audio_buffer)
+    audio_turn_seconds.observe(time.perf_counter() - turn_started, stage="transcript")
     
     user = cl.user_session.get("user")
     logger.info(f"Received message: '{transcription}' from {user}")
@@ -575,14 +1126,49 @@ async def process_audio():
     ).send()
 
     ## Now to answer the question
-    msg = await generate_answer(transcription)
-
-    _, output_audio = await text_to_speech(msg.content, "audio/wav")
-
-    output_audio_el = cl.Audio(
-        auto_play=True,
-        mime="audio/wav",
-        content=output_audio,
-    )
+    if cl.user_session.get("pipelined_voice", TTS_PIPELINED):
+        ## Sentences are synthesized and played while the rest of the reply is generated
+        track = str(uuid.uuid4())
+        reply_started = time.perf_counter()
+        pipeline = SpeechPipeline(
+            synthesize_speech,
+            lambda pcm: cl.context.emitter.send_audio_chunk(
+                cl.OutputAudioChunk(mimeType="pcm16", data=pcm, track=track)
+            ),
+            max_concurrency=TTS_MAX_CONCURRENCY,
+        )
+        splitter = SentenceSplitter()
+        try:
+            msg = await generate_answer(
+                transcription,
+                on_delta=lambda delta: [pipeline.add(sentence) for sentence in splitter.feed(delta)],
+            )
+            pipeline.add(splitter.flush())
+            pcm = await pipeline.finish()
+        except asyncio.CancelledError:
+            cancelled_work.inc(pipeline.cancel(), kind="tts_sentence")
+            raise
+        except BaseException:
+            pipeline.cancel()
+            raise
+        if pipeline.time_to_first_audio is not None:
+            first_audio = reply_started + pipeline.time_to_first_audio - turn_started
+            audio_turn_seconds.observe(first_audio, stage="first_audio")
+        ## Already played, the element keeps the reply replayable
+        output_audio_el = cl.Audio(
+            mime="audio/wav",
+            content=wav_header(len(pcm) // 2, AUDIO_SAMPLE_RATE) + pcm,
+        )
+    else:
+        msg = await generate_answer(transcription)
+        _, output_audio = await text_to_speech(msg.content, "audio/wav")
+        output_audio_el = cl.Audio(
+            auto_play=True,
+            mime="audio/wav",
+            content=output_audio,
+        )
+        ## Auto-played once the reply is updated with it
+        audio_turn_seconds.observe(time.perf_counter() - turn_started, stage="first_audio")
     msg.elements=[output_audio_el]
     await msg.update()
+    audio_turn_seconds.observe(time.perf_counter() - turn_started, stage="reply")
@@ -0,0 +1,80 @@
+"""Per-turn cost of persisting the HITL workflow Context, against context size.
+
+Compares what hitl_app.py used to do on every turn (Context.to_dict with
+the JsonSerializer into the session, then Context.from_dict) with the
+ContextStore, which keeps the live Context between turns and only takes a
+compressed, incremental snapshot when the workflow suspends for a human.
+
+    python benchmarks/hitl_context_benchmark.py --sizes 10 100 1000 5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.agent.workflow import FunctionAgent  # noqa: E402
+from llama_index.core.llms import ChatMessage, MockLLM  # noqa: E402
+from llama_index.core.workflow import Context, JsonSerializer  # noqa: E402
+
+from utils.context_store import restore_context, snapshot_context  # noqa: E402
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return 1000.0 * (time.perf_counter() - started) / repeat, result
+
+
+async def context_of_size(agent, messages):
+    ctx = Context(agent)
+    history = [
+        ChatMessage(role="user" if i % 2 == 0 else "assistant", content=f"Message {i}: " + "lorem ipsum " * 20)
+        for i in range(messages)
+    ]
+    await ctx.store.set("chat_history", history)
+    await ctx.store.set("turn", 0)
+    return ctx
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000], help="chat messages in the context")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    agent = FunctionAgent(llm=MockLLM(), tools=[])
+    print(
+        f"{'messages':>8} {'json KB':>8} {'legacy turn':>12} {'live turn':>10} "
+        f"{'snapshot':>9} {'incremental':>12} {'snap KB':>8} {'restore':>8}"
+    )
+    for size in args.sizes:
+        ctx = await context_of_size(agent, size)
+
+        def legacy_turn():
+            ctx_dict = ctx.to_dict(serializer=JsonSerializer())
+            Context.from_dict(agent, ctx_dict, serializer=JsonSerializer())
+            return ctx_dict
+
+        legacy_ms, ctx_dict = timed(legacy_turn, args.repeat)
+        json_kb = len(json.dumps(ctx_dict)) / 1024
+
+        full_ms, snapshot = timed(lambda: snapshot_context(ctx), args.repeat)
+        await ctx.store.set("turn", 1)  # A typical turn only touches a small part of the state
+        incremental_ms, _ = timed(lambda: snapshot_context(ctx, snapshot), args.repeat)
+        restore_ms, _ = timed(lambda: restore_context(agent, snapshot), args.repeat)
+
+        # Between turns the ContextStore hands back the live object: nothing is serialized
+        print(
+            f"{size:>8} {json_kb:>8.0f} {legacy_ms:>10.2f}ms {0:>8.2f}ms "
+            f"{full_ms:>7.2f}ms {incremental_ms:>10.2f}ms {snapshot.nbytes / 1024:>8.1f} {restore_ms:>6.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
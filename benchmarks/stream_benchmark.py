@@ -0,0 +1,140 @@
+"""Websocket emits and CPU of streaming replies, per token against coalesced.
+
+Runs many concurrent streams of LLM-like deltas (a few characters each, at
+a given rate with jitter) into an emitter that does what Chainlit does per
+streamed token: append to the message, build the stream_token payload and
+encode it as a Socket.IO packet. The per-token path emits every delta, as
+app.py used to; the coalesced path goes through a TokenCoalescer. Emit
+latency simulates slow clients, which the coalescer adapts to by sending
+fewer, bigger chunks. Stream CPU is the CPU time over that of the
+producers alone. Delay is how long a delta waits before being emitted.
+
+    python benchmarks/stream_benchmark.py --streams 10 100 500 --tokens 300 --rate 60
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engineio import packet as engineio_packet  # noqa: E402
+from socketio import packet as socketio_packet  # noqa: E402
+
+from utils.streaming import TokenCoalescer  # noqa: E402
+
+
+class FakeMessage:
+    """The work of cl.Message.stream_token and the Socket.IO emit, with a fake websocket.
+
+    Like engine.io, packets go through a queue to a writer task per client,
+    which encodes them and writes them to a socket drained by a thread.
+    """
+
+    def __init__(self, sock: socket.socket, emit_latency: float, stats: dict):
+        self.sock = sock
+        self.content = ""
+        self.emit_latency = emit_latency
+        self.stats = stats
+        self.pending = []  # Enqueue times of the deltas not emitted yet
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.writer = asyncio.create_task(self.write())
+
+    async def stream_token(self, token: str):
+        self.content += token
+        payload = {"id": "message-id", "token": token, "isSequence": False, "isInput": False}
+        encoded = socketio_packet.Packet(socketio_packet.EVENT, data=["stream_token", payload], namespace="/").encode()
+        await self.queue.put(engineio_packet.Packet(engineio_packet.MESSAGE, data=encoded))
+        self.stats["emits"] += 1
+        now = time.perf_counter()
+        self.stats["delays"].extend(now - enqueued for enqueued in self.pending)
+        self.pending.clear()
+        if self.emit_latency:
+            await asyncio.sleep(self.emit_latency)  # An emit awaited until the client drains it
+
+    async def write(self):
+        while (pkt := await self.queue.get()) is not None:
+            self.sock.sendall(pkt.encode().encode())
+
+    async def close(self):
+        await self.queue.put(None)
+        await self.writer
+
+
+def drain(sock: socket.socket):
+    while sock.recv(1 << 16):
+        pass
+
+
+async def stream(rng, sock, args, coalesce, stats):
+    msg = FakeMessage(sock, args.emit_latency_ms / 1000, stats)
+    deltas = [" " + "".join(rng.choices("abcdefghij", k=rng.randint(1, 6))) for _ in range(args.tokens)]
+    gap = 1.0 / args.rate
+    if coalesce is None:
+        for delta in deltas:
+            await asyncio.sleep(rng.uniform(0, 2 * gap))
+    elif coalesce:
+        async with TokenCoalescer(msg.stream_token) as stream:
+            for delta in deltas:
+                await asyncio.sleep(rng.uniform(0, 2 * gap))
+                msg.pending.append(time.perf_counter())
+                await stream.add(delta)
+    else:
+        for delta in deltas:
+            await asyncio.sleep(rng.uniform(0, 2 * gap))
+            msg.pending.append(time.perf_counter())
+            await msg.stream_token(delta)
+    await msg.close()
+
+
+async def run(streams, args, coalesce):
+    stats = {"emits": 0, "delays": []}
+    rng = random.Random(0)
+    sender, receiver = socket.socketpair()
+    drainer = threading.Thread(target=drain, args=(receiver,), daemon=True)
+    drainer.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    await asyncio.gather(*(stream(random.Random(rng.random()), sender, args, coalesce, stats) for _ in range(streams)))
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    sender.close()
+    drainer.join()
+    receiver.close()
+    delays = sorted(stats["delays"]) or [0.0]
+    return {
+        "emits/s": stats["emits"] / wall,
+        "emits": stats["emits"],
+        "cpu s": cpu,
+        "p50 ms": 1000.0 * statistics.median(delays),
+        "p99 ms": 1000.0 * delays[int(0.99 * (len(delays) - 1))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--tokens", type=int, default=300, help="deltas per stream")
+    parser.add_argument("--rate", type=float, default=60, help="deltas per second per stream")
+    parser.add_argument("--emit-latency-ms", type=float, default=0.0, help="time an emit takes to be written")
+    args = parser.parse_args()
+
+    print(f"{args.tokens} deltas per stream at {args.rate:g}/s, emit latency {args.emit_latency_ms:g}ms")
+    print(f"{'streams':>7} {'path':<10} {'emits':>8} {'emits/s':>9} {'cpu s':>7} {'stream cpu s':>12} {'p50 ms':>7} {'p99 ms':>7}")
+    for streams in args.streams:
+        # The producers alone, without emitting: their CPU is subtracted to get the cost of streaming
+        baseline = asyncio.run(run(streams, args, None))["cpu s"]
+        for name, coalesce in (("per-token", False), ("coalesced", True)):
+            r = asyncio.run(run(streams, args, coalesce))
+            print(
+                f"{streams:>7} {name:<10} {r['emits']:>8} {r['emits/s']:>9.0f} {r['cpu s']:>7.2f} "
+                f"{r['cpu s'] - baseline:>12.2f} {r['p50 ms']:>7.1f} {r['p99 ms']:>7.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Offline benchmark of end-of-turn detection over recorded WAV fixtures.
+
+Replays each 16-bit mono WAV through the app's VoiceActivityDetector and
+through the legacy fixed RMS gate (threshold 3500, 1300ms timeout) in
+chunks, as the browser would send them, and reports when each declared the
+end of the turn and how much CPU it used. If a fixture has a sidecar
+`<name>.json` with {"speech_end": seconds}, latencies are reported against it.
+
+No recorded fixtures ship with the repo, bring your own 16-bit mono WAVs.
+--synthesize writes synthetic ones instead: tone bursts gated at a syllable
+rate over Gaussian noise. They exercise the detector's timing and CPU cost,
+not its accuracy on real speech, breathing or babble noise, so numbers from
+them are labelled synthetic and are not evidence for tuning the thresholds.
+
+    python benchmarks/vad_benchmark.py recordings/*.wav
+    python benchmarks/vad_benchmark.py --synthesize benchmarks/fixtures
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.audio import PCMRingBuffer  # noqa: E402
+from utils.vad import VoiceActivityDetector  # noqa: E402
+
+LEGACY_THRESHOLD = 3500
+LEGACY_TIMEOUT_MS = 1300.0
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+            raise ValueError(f"{path} must be 16-bit mono PCM")
+        return wav.getframerate(), np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+
+
+def legacy_end_of_turn(samples, sample_rate, chunk_len):
+    """Per-chunk RMS gate of the original on_audio_chunk. Returns the decision time in seconds."""
+
+    silent_ms, speaking = 0.0, True
+    chunk_ms = 1000.0 * chunk_len / sample_rate
+    for i in range(0, len(samples), chunk_len):
+        chunk = samples[i : i + chunk_len].astype(np.float64)
+        if np.sqrt(np.mean(chunk**2)) < LEGACY_THRESHOLD:
+            silent_ms += chunk_ms
+            if silent_ms >= LEGACY_TIMEOUT_MS and speaking:
+                return (i + len(chunk)) / sample_rate
+        else:
+            silent_ms = 0.0
+    return None
+
+
+def vad_end_of_turn(samples, sample_rate, chunk_len):
+    """Returns the decision time in seconds and the detector's reported latency"""
+
+    buffer = PCMRingBuffer(sample_rate, max_seconds=len(samples) / sample_rate + 1)
+    vad = VoiceActivityDetector(sample_rate)
+    for i in range(0, len(samples), chunk_len):
+        buffer.write(samples[i : i + chunk_len].tobytes())
+        if vad.process(buffer).end_of_turn:
+            return buffer.end / sample_rate, vad.last_decision_latency_ms
+    return None, None
+
+
+def synthesize(directory, sample_rate=24000, seed=0):
+    """Writes speech-like fixtures: syllable bursts over room noise of varying loudness"""
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    fixtures = [("quiet_room", 30, 6000), ("office", 400, 6000), ("noisy_cafe", 1000, 6000), ("soft_speaker", 30, 2000)]
+    for name, noise_level, voice_level in fixtures:
+        lead, speech, tail = 0.5, 2.5, 2.5
+        n = int(sample_rate * (lead + speech + tail))
+        audio = rng.normal(0, noise_level, n)
+        t = np.arange(int(sample_rate * speech)) / sample_rate
+        syllables = (np.sin(2 * np.pi * 4 * t) > -0.3).astype(float)  # ~4 syllables per second
+        voice = voice_level * syllables * np.sin(2 * np.pi * 180 * t) * (1 + 0.3 * np.sin(2 * np.pi * 3 * t))
+        start = int(sample_rate * lead)
+        audio[start : start + len(voice)] += voice
+        path = os.path.join(directory, f"{name}.wav")
+        with wave.open(path, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(np.clip(audio, -32768, 32767).astype(np.int16).tobytes())
+        with open(os.path.join(directory, f"{name}.json"), "w") as f:
+            json.dump({"speech_end": lead + speech}, f)
+        yield path
+
+
+def fmt(value, unit="s"):
+    return "never" if value is None else f"{value:.2f}{unit}"
+
+
+def fmt_delay(value):
+    """Delay of a decision after the end of speech; negative means the turn was cut off"""
+
+    if value is None or value >= 0:
+        return fmt(value, "s late")
+    return fmt(-value, "s early")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("wavs", nargs="*")
+    parser.add_argument("--synthesize", metavar="DIR", help="write synthetic fixtures to DIR and benchmark them")
+    parser.add_argument("--chunk-ms", type=float, default=50.0, help="size of the simulated audio chunks")
+    args = parser.parse_args()
+
+    paths = list(args.wavs)
+    synthetic = list(synthesize(args.synthesize)) if args.synthesize else []
+    paths += synthetic
+    if not paths:
+        parser.error("pass WAV fixtures or --synthesize DIR")
+
+    print(f"{'fixture':<32} {'speech end':>10} {'legacy':>14} {'vad':>14} {'vad latency':>12} {'vad x realtime':>15}")
+    for path in paths:
+        sample_rate, samples = read_wav(path)
+        chunk_len = int(sample_rate * args.chunk_ms / 1000)
+        sidecar = os.path.splitext(path)[0] + ".json"
+        speech_end = json.load(open(sidecar))["speech_end"] if os.path.exists(sidecar) else None
+
+        legacy = legacy_end_of_turn(samples, sample_rate, chunk_len)
+        started = time.perf_counter()
+        decided, latency_ms = vad_end_of_turn(samples, sample_rate, chunk_len)
+        elapsed = time.perf_counter() - started
+        realtime = (len(samples) / sample_rate) / elapsed
+
+        def delay(t):
+            return t if speech_end is None or t is None else t - speech_end
+
+        name = os.path.basename(path) + (" (synthetic)" if path in synthetic else "")
+        print(
+            f"{name:<32} {fmt(speech_end):>10} {fmt_delay(delay(legacy)):>14} "
+            f"{fmt_delay(delay(decided)):>14} {fmt(latency_ms, 'ms'):>12} {realtime:>14.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
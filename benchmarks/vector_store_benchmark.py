@@ -0,0 +1,99 @@
+"""Memory and query latency of the document vector stores, per number of chunks.
+
+Compares the default SimpleVectorStore of an in-memory VectorStoreIndex, which
+keeps every embedding as a list of Python floats, with the CompactVectorStore
+at each storage dtype. Memory is what the store still holds once the chunks
+have been added and the nodes dropped, measured with tracemalloc. Recall is
+the overlap of the top-k with an exact float32 vector search. The hybrid
+rows show the cost of fusing in BM25 scores.
+
+    python benchmarks/vector_store_benchmark.py --chunks 10000 --dim 768
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from llama_index.core.schema import TextNode  # noqa: E402
+from llama_index.core.vector_stores import SimpleVectorStore  # noqa: E402
+from llama_index.core.vector_stores.types import VectorStoreQuery  # noqa: E402
+
+from utils.vector_store import CompactVectorStore  # noqa: E402
+
+
+def make_nodes(rng, vocabulary, chunks, dim, words):
+    embeddings = rng.standard_normal((chunks, dim), dtype=np.float32)
+    return [
+        TextNode(text=" ".join(rng.choice(vocabulary, words)), embedding=embedding.tolist(), id_=f"chunk-{i}")
+        for i, embedding in enumerate(embeddings)
+    ]
+
+
+def measure(build, rng, vocabulary, args):
+    """Bytes the store keeps after its nodes are gone"""
+
+    gc.collect()
+    tracemalloc.start()
+    store = build()
+    nodes = make_nodes(rng, vocabulary, args.chunks, args.dim, args.words)
+    store.add(nodes)
+    del nodes
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=768, help="nomic-embed-text has 768 dimensions")
+    parser.add_argument("--words", type=int, default=120, help="words per chunk")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=8)
+    args = parser.parse_args()
+
+    vocabulary = np.array([f"term{i}" for i in range(5000)])
+    backends = [
+        ("SimpleVectorStore (default)", lambda: SimpleVectorStore(), 1.0),
+        ("Compact float32", lambda: CompactVectorStore(dtype="float32", alpha=1.0), 1.0),
+        ("Compact float16", lambda: CompactVectorStore(dtype="float16", alpha=1.0), 1.0),
+        ("Compact int8", lambda: CompactVectorStore(dtype="int8", alpha=1.0), 1.0),
+        ("Compact float16 + BM25", lambda: CompactVectorStore(dtype="float16", alpha=0.7), 0.7),
+        ("Compact int8 + BM25", lambda: CompactVectorStore(dtype="int8", alpha=0.7), 0.7),
+    ]
+
+    rng = np.random.default_rng(0)
+    queries = [
+        (rng.standard_normal(args.dim, dtype=np.float32).tolist(), " ".join(rng.choice(vocabulary, 6)))
+        for _ in range(args.queries)
+    ]
+    exact = None
+
+    print(f"{args.chunks} chunks of {args.dim} dimensions, top {args.top_k}")
+    print(f"{'store':<28} {'MB':>8} {'KB/chunk':>9} {'query ms':>9} {'recall':>7}")
+    for name, build, alpha in backends:
+        store, held = measure(build, np.random.default_rng(1), vocabulary, args)
+        results, started = [], time.perf_counter()
+        for embedding, text in queries:
+            query = VectorStoreQuery(query_embedding=embedding, similarity_top_k=args.top_k, query_str=text)
+            results.append(set(store.query(query).ids))
+        query_ms = 1000.0 * (time.perf_counter() - started) / len(queries)
+        if exact is None:
+            exact = results  # The default store is an exact float32 search
+        # Random embeddings carry no meaning, so hybrid results are not comparable to vector search
+        recall = np.mean([len(r & e) / len(e) for r, e in zip(results, exact)])
+        recall = f"{recall:>7.3f}" if alpha == 1.0 else f"{'-':>7}"
+        print(f"{name:<28} {held / 1024**2:>8.1f} {held / 1024 / args.chunks:>9.2f} {query_ms:>9.2f} {recall}")
+        del store
+        gc.collect()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,37 @@
+import logging
+import os
+from typing import Optional
+
 from llama_index.llms.ollama import Ollama
 from llama_index.core.agent.workflow import FunctionAgent, AgentStream
 from llama_index.core.workflow import (
-    Context, InputRequiredEvent, HumanResponseEvent, JsonSerializer
+    Context, InputRequiredEvent, HumanResponseEvent
 )    
 
 import chainlit as cl
+from chainlit.server import app as chainlit_app
+from chainlit.types import ThreadDict
+
+from utils.approval_store import PendingApproval, create_approval_store
+from utils.context_store import ContextSnapshot, ContextStore
+from utils.metrics import Metrics
+from utils.streaming import TokenCoalescer
+
+logger = logging.getLogger(__name__)
+
+## Pending approvals outlive the worker that asked for them: any worker sharing the store can resume them
+APPROVAL_STORE_URL = os.getenv("APPROVAL_STORE_URL", ".cache/approvals.sqlite")  # SQLite path, or a redis:// URL shared by all workers
+APPROVAL_TTL = float(os.getenv("APPROVAL_TTL", 24 * 3600))  # Seconds before an unanswered approval expires
+approval_store = create_approval_store(APPROVAL_STORE_URL, APPROVAL_TTL)
+## Queue depth gauges, served on /metrics in the Prometheus text format
+METRICS = os.getenv("METRICS", "false").lower() == "true"
+metrics = Metrics(enabled=METRICS)
+approvals_pending = metrics.gauge("hitl_approvals_pending", "Approvals waiting for a human in the shared store")
+approvals_pending_by_user = metrics.gauge("hitl_approvals_pending_by_user", "Approvals waiting for a human, by user")
+approval_oldest_age = metrics.gauge("hitl_approval_oldest_age_seconds", "Time the oldest pending approval has been waiting")
+approvals_expired = metrics.gauge("hitl_approvals_expired", "Approvals this worker has dropped unanswered")
+if METRICS:
+    metrics.mount(chainlit_app)
 
 async def dangerous_task(ctx: Context) -> str:
     """A dangerous task that requires human confirmation."""
@@ -36,67 +63,125 @@ def setup_agent() -> FunctionAgent:
     
     return agent
 
+def session_user() -> str:
+    user = cl.user_session.get("user")
+    return user.identifier if user else "anonymous"
+
+async def suspend(context_store: ContextStore, handler, event: InputRequiredEvent):
+    """Keeps the run waiting for a human and records it in the shared approval store"""
+
+    context_store.suspend(handler)
+    approval = approval_store.new(
+        thread_id=cl.context.session.thread_id,
+        user=session_user(),
+        waiter_id=event.prefix,  # dangerous_task waits on its question
+        prefix=event.prefix,
+        user_name=event.user_name,
+        snapshot=context_store.snapshot.to_bytes(),
+    )
+    await approval_store.put(approval)
+    cl.user_session.set("approval_id", approval.approval_id)
+    await record_depth()
+
+async def record_depth():
+    """Sets the queue depth gauges from the shared store"""
+
+    depth = await approval_store.depth()
+    approvals_pending.set(depth.pending)
+    approval_oldest_age.set(depth.oldest_age)
+    approvals_expired.set(depth.expired_total)
+    approvals_pending_by_user.clear()
+    for user, count in depth.by_user.items():
+        approvals_pending_by_user.set(count, user=user)
+    logger.info(f"Approvals pending: {depth.pending}, oldest waiting {depth.oldest_age:.0f}s")
+
+async def claim(context_store: ContextStore, approval_id: str) -> Optional[PendingApproval]:
+    """Claims the approval being answered, restoring its run when this worker does not hold it live"""
+
+    approval = await approval_store.claim(approval_id)
+    await record_depth()
+    if approval is not None and (context_store.handler is None or context_store.handler.done()):
+        context_store.snapshot = ContextSnapshot.from_bytes(approval.snapshot)
+    return approval
+
 @cl.on_chat_start
 async def on_chat_start():
     agent = setup_agent()
-    ctx = Context(agent)
     cl.user_session.set("last_event", None)
     cl.user_session.set("agent", agent)
-    cl.user_session.set("context", ctx.to_dict(serializer=JsonSerializer()))
-    cl.user_session.set("input_ev", None)
+    ## The live context is kept across turns, it is only snapshotted while waiting for a human
+    cl.user_session.set("context", ContextStore(agent))
+    cl.user_session.set("approval_id", None)
+
+@cl.on_chat_resume
+async def on_chat_resume(thread: ThreadDict):
+    await on_chat_start()
+
+    ## The resumed thread picks up its approval left on another worker, or before a restart.
+    ## Only that thread's, a new chat's first message is never taken as an answer.
+    pending = await approval_store.pending(thread_id=thread["id"])
+    if pending:
+        cl.user_session.set("approval_id", pending[-1].approval_id)
+        await cl.Message(content=pending[-1].prefix).send()
     
 @cl.on_message
 async def on_message(message: cl.Message):
-    input_ev = cl.user_session.get("input_ev")
+    approval_id = cl.user_session.get("approval_id")
     agent = cl.user_session.get("agent")
-    ctx_dict = cl.user_session.get("context")
-    ctx = Context.from_dict(agent, ctx_dict, serializer=JsonSerializer())
+    context_store = cl.user_session.get("context")
     
     msg = cl.Message(content="")
     
-    if input_ev is None:
-        handler = agent.run(message.content, ctx=ctx)
-        async for event in handler.stream_events():
-            if isinstance(event, AgentStream):
-                await msg.stream_token(event.delta)
-                cl.user_session.set("last_event", "stop_event")
-            if isinstance(event, InputRequiredEvent):
-                input_ev = event
-                cl.user_session.set("context", ctx.to_dict(serializer=JsonSerializer()))
-                cl.user_session.set("input_ev", input_ev)
-                for chunk in event.prefix.split(" "):
-                    await msg.stream_token(chunk)
-                msg.content = event.prefix
-                cl.user_session.set("last_event", "input_required_event")
-                break
+    if approval_id is None:
+        handler = agent.run(message.content, ctx=context_store.ctx)
+        async with TokenCoalescer(msg.stream_token) as stream:
+            async for event in handler.stream_events():
+                if isinstance(event, AgentStream):
+                    await stream.add(event.delta)
+                    cl.user_session.set("last_event", "stop_event")
+                if isinstance(event, InputRequiredEvent):
+                    await suspend(context_store, handler, event)
+                    await stream.add(event.prefix)
+                    await stream.flush()
+                    msg.content = event.prefix
+                    cl.user_session.set("last_event", "input_required_event")
+                    break
         
     
     else: 
-        handler = agent.run(ctx=ctx)
+        approval = await claim(context_store, approval_id)
+        cl.user_session.set("approval_id", None)
+        if approval is None:
+            if context_store.handler is not None and not context_store.handler.done():
+                await context_store.handler.cancel_run()
+            context_store.finish()
+            await cl.Message(content="This approval expired or was already answered.").send()
+            return
+        ## The run still waiting for this answer, or one restored from its snapshot
+        handler = context_store.resume()
         handler.ctx.send_event(
             HumanResponseEvent(
                 response=message.content,
-                user_name=input_ev.user_name,
+                user_name=approval.user_name,
             )
         )
-        async for event in handler.stream_events():
-            if isinstance(event, AgentStream):
-                await msg.stream_token(event.delta)
-                cl.user_session.set("input_ev", None)
-                cl.user_session.set("last_event", "stop_event")
-            if isinstance(event, InputRequiredEvent):
-                input_ev = event
-                cl.user_session.set("context", ctx.to_dict(serializer=JsonSerializer()))
-                cl.user_session.set("input_ev", input_ev)
-                for chunk in event.prefix.split(" "):
-                    await msg.stream_token(chunk)
-                msg.content = event.prefix
-                cl.user_session.set("last_event", "stop_event")
-                break
+        async with TokenCoalescer(msg.stream_token) as stream:
+            async for event in handler.stream_events():
+                if isinstance(event, AgentStream):
+                    await stream.add(event.delta)
+                    cl.user_session.set("last_event", "stop_event")
+                if isinstance(event, InputRequiredEvent):
+                    await suspend(context_store, handler, event)
+                    await stream.add(event.prefix)
+                    await stream.flush()
+                    msg.content = event.prefix
+                    cl.user_session.set("last_event", "input_required_event")
+                    break
     
     last_event = cl.user_session.get("last_event")
     if last_event == "stop_event":
         response = await handler
+        context_store.finish()
         msg.content = str(response)
         
     await msg.update()
@@ -57,9 +57,9 @@ export default function GoogleMap() {
 
   useEffect(() => {
     if (callFn?.name === "move-map") {
-      const { latitude, longitude } = callFn.args;
-      moveMapTo(latitude, longitude);
-      callFn.callback();
+      const { latitude, longitude, zoom } = callFn.args;
+      // The server falls back to reopening the map unless it was moved here
+      callFn.callback({ moved: moveMapTo(latitude, longitude, zoom ?? 12) });
     }
   }, [callFn]);
 
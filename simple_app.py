@@ -1,13 +1,18 @@
 import chainlit as cl
 from llama_index.llms.openai import OpenAI
 
+from utils.streaming import TokenCoalescer
+
 llm = OpenAI('gpt-4o-mini', temperature=0)
 
 @cl.on_message
 async def on_message(message: cl.Message):
-    reply = await llm.acomplete(message.content)
-    response = await cl.Message(content=str(reply)).send()
-    
+    response = cl.Message(content="")
+    async with TokenCoalescer(response.stream_token) as stream:
+        async for chunk in await llm.astream_complete(message.content):
+            await stream.add(chunk.delta)
+    await response.send()
+
     if cl.context.session.client_type == "copilot":
         fn = cl.CopilotFunction(
             name="test",
@@ -0,0 +1,131 @@
+import asyncio
+
+import httpx
+import pytest
+
+from utils.http import RetryingTransport, create_http_client
+
+
+class StubServer:
+    """MockTransport handler answering each request with the next scripted status or error"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else 200
+        if isinstance(outcome, type) and issubclass(outcome, Exception):
+            raise outcome("stub failure", request=request)
+        return httpx.Response(outcome, headers={"Retry-After": "0"} if outcome == 429 else {})
+
+
+async def send(server, method: str, **kwargs) -> httpx.Response:
+    transport = RetryingTransport(httpx.MockTransport(server), backoff_base=0, **kwargs)
+    async with create_http_client(transport) as client:
+        return await client.request(method, "https://api.example.com/v1")
+
+
+@pytest.mark.parametrize(
+    "method, outcome, calls",
+    [
+        ("GET", 500, 4),
+        ("GET", httpx.ReadError, 4),
+        ("POST", 500, 1),
+        ("POST", httpx.ReadError, 1),
+        ("POST", httpx.ReadTimeout, 1),
+        ("POST", 429, 4),
+        ("POST", 502, 4),
+        ("POST", 503, 4),
+        ("POST", 504, 4),
+        ("POST", httpx.ConnectError, 4),
+        ("GET", 404, 1),
+    ],
+)
+def test_retries_by_method_and_outcome(method, outcome, calls):
+    server = StubServer(*[outcome] * 10)
+
+    async def run():
+        try:
+            await send(server, method, max_retries=3)
+        except httpx.TransportError:
+            pass
+
+    asyncio.run(run())
+    assert server.calls == calls
+
+
+def test_retry_succeeds_and_counts():
+    server = StubServer(503, 503, 200)
+
+    async def run():
+        transport = RetryingTransport(httpx.MockTransport(server), backoff_base=0, max_retries=3)
+        async with create_http_client(transport) as client:
+            response = await client.post("https://api.example.com/v1")
+        return response, transport.stats()["api.example.com"]
+
+    response, stats = asyncio.run(run())
+    assert response.status_code == 200
+    assert (stats["requests"], stats["retries"]) == (3, 2)
+
+
+def test_last_response_returned_when_retries_run_out():
+    server = StubServer(*[503] * 10)
+    response = asyncio.run(send(server, "GET", max_retries=2))
+    assert response.status_code == 503
+    assert server.calls == 3
+
+
+def test_retry_after_is_capped():
+    transport = RetryingTransport(retry_after_max=2.0)
+    response = httpx.Response(429, headers={"Retry-After": "120"})
+    assert transport._backoff(0, response) == 2.0
+
+
+def test_slot_is_released_once_headers_arrive():
+    """A long streamed body, e.g. an SSE stream, must not block the next request to its host"""
+
+    async def run():
+        stream_open = asyncio.Event()
+
+        async def endless():
+            stream_open.set()
+            await asyncio.sleep(3600)
+            yield b""
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/stream":
+                return httpx.Response(200, content=endless())
+            return httpx.Response(200)
+
+        transport = RetryingTransport(httpx.MockTransport(handler), max_per_host=1)
+        async with create_http_client(transport) as client:
+            async with client.stream("GET", "https://api.example.com/stream") as streaming:
+                reader = asyncio.create_task(streaming.aread())
+                await stream_open.wait()
+                response = await asyncio.wait_for(client.get("https://api.example.com/next"), timeout=1)
+                reader.cancel()
+        return response
+
+    assert asyncio.run(run()).status_code == 200
+
+
+def test_requests_waiting_on_headers_are_bounded_per_host():
+    async def run():
+        in_flight = peak = 0
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200)
+
+        transport = RetryingTransport(httpx.MockTransport(handler), max_per_host=2)
+        async with create_http_client(transport) as client:
+            await asyncio.gather(*[client.get("https://api.example.com/v1") for _ in range(8)])
+        return peak
+
+    assert asyncio.run(run()) == 2
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_call():
+    async def run():
+        flights, calls = SingleFlight(), 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*[flights.do("key", fn) for _ in range(5)])
+        return results, calls, "key" in flights
+
+    assert asyncio.run(run()) == ([1] * 5, 1, False)
+
+
+def test_followers_get_the_leaders_exception():
+    async def run():
+        flights = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        return await asyncio.gather(*[flights.do("key", fn) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def run():
+        flights, calls = SingleFlight(), 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return calls
+
+        leader = asyncio.create_task(flights.do("key", fn))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flights.do("key", fn)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers), calls
+
+    # One follower leads the call again and the others follow it
+    assert asyncio.run(run()) == ([2, 2, 2], 2)
+
+
+def test_cancelled_follower_does_not_cancel_leader():
+    async def run():
+        flights = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        leader = asyncio.create_task(flights.do("key", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("key", fn))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        return await leader, follower
+
+    result, follower = asyncio.run(run())
+    assert result == "done" and follower.cancelled()
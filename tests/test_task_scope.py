@@ -0,0 +1,53 @@
+import asyncio
+
+from utils.task_scope import TaskScope
+
+
+def test_callbacks_stay_registered_until_unregistered():
+    async def run():
+        scope, calls = TaskScope(), []
+        unregister = scope.on_cancel("stt_segment", lambda: calls.append(1) or 1)
+        first, second = await scope.cancel(), await scope.cancel()
+        unregister()
+        third = await scope.cancel()
+        return first, second, third, len(calls)
+
+    first, second, third, calls = asyncio.run(run())
+    assert first == second == {"stt_segment": 1}
+    assert not third and calls == 2
+
+
+def test_cancel_stops_running_turns_and_their_tasks():
+    async def run():
+        scope = TaskScope(cleanup_timeout=1)
+        spawned = []
+
+        async def turn():
+            with scope.guard("message"):
+                spawned.append(scope.spawn(asyncio.sleep(3600), "ingest"))
+                await asyncio.sleep(3600)
+
+        running = asyncio.create_task(turn())
+        await asyncio.sleep(0)
+        stopped = await scope.cancel()
+        return stopped, running.cancelled(), spawned[0].cancelled()
+
+    assert asyncio.run(run()) == ({"message": 1, "ingest": 1}, True, True)
+
+
+def test_cancel_leaves_tasks_of_finished_turns_running():
+    async def run():
+        scope = TaskScope(cleanup_timeout=1)
+
+        async def turn():
+            with scope.guard("message"):
+                return scope.spawn(asyncio.sleep(3600), "ingest")
+
+        background = await turn()
+        stopped = await scope.cancel()
+        still_running = not background.done()
+        background.cancel()
+        return stopped, still_running
+
+    stopped, still_running = asyncio.run(run())
+    assert not stopped and still_running
@@ -0,0 +1,273 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # Only needed for the Redis backend
+    redis = None
+
+_FIELDS = ("approval_id", "thread_id", "user", "waiter_id", "prefix", "user_name", "created", "expires")
+
+
+@dataclass
+class PendingApproval:
+    """A workflow suspended on a human, with the snapshot of its Context so any worker can resume it"""
+
+    thread_id: str
+    user: str
+    waiter_id: str
+    prefix: str  # The question asked to the human
+    user_name: str
+    snapshot: bytes  # ContextSnapshot.to_bytes()
+    created: float = field(default_factory=time.time)
+    expires: float = 0.0
+    approval_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires <= time.time()
+
+
+@dataclass
+class QueueDepth:
+    pending: int = 0
+    oldest_age: float = 0.0  # Seconds the oldest pending approval has been waiting
+    by_user: Dict[str, int] = field(default_factory=dict)
+    expired_total: int = 0  # Approvals this process dropped unanswered
+
+
+class ApprovalStore(ABC):
+    """Durable store of workflows waiting for a human approval.
+
+    Approvals are indexed by thread, user and waiter id. claim() removes an
+    approval atomically, so when several workers share the store exactly one
+    of them resumes it. Approvals not answered within ttl seconds expire.
+    """
+
+    def __init__(self, ttl: float = 24 * 3600.0):
+        self.ttl = ttl
+        self.expired_total = 0
+
+    def new(self, **kwargs) -> PendingApproval:
+        approval = PendingApproval(**kwargs)
+        approval.expires = approval.created + self.ttl
+        return approval
+
+    @abstractmethod
+    async def put(self, approval: PendingApproval): ...
+
+    @abstractmethod
+    async def get(self, approval_id: str) -> Optional[PendingApproval]:
+        """The approval if it is still pending, without claiming it"""
+
+    @abstractmethod
+    async def pending(
+        self, thread_id: Optional[str] = None, user: Optional[str] = None, waiter_id: Optional[str] = None
+    ) -> List[PendingApproval]:
+        """Pending approvals matching all the given filters, oldest first"""
+
+    @abstractmethod
+    async def claim(self, approval_id: str) -> Optional[PendingApproval]:
+        """Removes and returns a pending approval, None if it expired or another worker claimed it"""
+
+    @abstractmethod
+    async def expire(self) -> int:
+        """Drops the expired approvals and returns how many"""
+
+    async def close(self):
+        pass
+
+    async def depth(self) -> QueueDepth:
+        await self.expire()
+        approvals = await self.pending()
+        now = time.time()
+        return QueueDepth(
+            pending=len(approvals),
+            oldest_age=max((now - a.created for a in approvals), default=0.0),
+            by_user=dict(Counter(a.user for a in approvals)),
+            expired_total=self.expired_total,
+        )
+
+
+class SQLiteApprovalStore(ApprovalStore):
+    """Approval store in a local SQLite file, shared by the worker processes of one host"""
+
+    def __init__(self, path: str, ttl: float = 24 * 3600.0):
+        super().__init__(ttl)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")  # Other workers keep reading while one writes
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS approvals ("
+                "approval_id TEXT PRIMARY KEY, thread_id TEXT, user TEXT, waiter_id TEXT, prefix TEXT, "
+                "user_name TEXT, created REAL, expires REAL, snapshot BLOB)"
+            )
+            for column in ("thread_id", "user", "waiter_id", "expires"):
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS approvals_{column} ON approvals ({column})")
+
+    def _put(self, approval: PendingApproval):
+        with self._lock, self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO approvals ({', '.join(_FIELDS)}, snapshot) VALUES ({', '.join('?' * 9)})",
+                (*(getattr(approval, name) for name in _FIELDS), approval.snapshot),
+            )
+
+    def _select(self, where: str, params) -> List[PendingApproval]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_FIELDS)}, snapshot FROM approvals WHERE expires > ? {where} ORDER BY created",
+                (time.time(), *params),
+            ).fetchall()
+        return [PendingApproval(**dict(zip(_FIELDS, row[:-1])), snapshot=row[-1]) for row in rows]
+
+    def _claim(self, approval_id: str) -> Optional[PendingApproval]:
+        rows = self._select("AND approval_id = ?", (approval_id,))
+        if not rows:
+            return None
+        with self._lock, self._db:
+            # Another worker may have selected it too: only the one whose delete removes the row resumes it
+            deleted = self._db.execute("DELETE FROM approvals WHERE approval_id = ?", (approval_id,)).rowcount
+        return rows[0] if deleted else None
+
+    def _expire(self) -> int:
+        with self._lock, self._db:
+            return self._db.execute("DELETE FROM approvals WHERE expires <= ?", (time.time(),)).rowcount
+
+    async def put(self, approval: PendingApproval):
+        await asyncio.to_thread(self._put, approval)
+
+    async def get(self, approval_id: str) -> Optional[PendingApproval]:
+        rows = await asyncio.to_thread(self._select, "AND approval_id = ?", (approval_id,))
+        return rows[0] if rows else None
+
+    async def pending(
+        self, thread_id: Optional[str] = None, user: Optional[str] = None, waiter_id: Optional[str] = None
+    ) -> List[PendingApproval]:
+        filters = {"thread_id": thread_id, "user": user, "waiter_id": waiter_id}
+        filters = {column: value for column, value in filters.items() if value is not None}
+        where = "".join(f" AND {column} = ?" for column in filters)
+        return await asyncio.to_thread(self._select, where, tuple(filters.values()))
+
+    async def claim(self, approval_id: str) -> Optional[PendingApproval]:
+        return await asyncio.to_thread(self._claim, approval_id)
+
+    async def expire(self) -> int:
+        expired = await asyncio.to_thread(self._expire)
+        self.expired_total += expired
+        return expired
+
+    async def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RedisApprovalStore(ApprovalStore):
+    """Approval store in Redis, or anything speaking its protocol, shared by workers across hosts.
+
+    Each approval is a hash. A sorted set scored by expiry time holds the
+    pending ids, and removing an id from it is the atomic claim. Sets per
+    thread, user and waiter id index the approvals; stale members are pruned
+    on expiry.
+    """
+
+    def __init__(self, url: str, ttl: float = 24 * 3600.0, prefix: str = "hitl:"):
+        if redis is None:
+            raise ImportError("The Redis approval store needs the redis package: pip install redis")
+        super().__init__(ttl)
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    def _key(self, *parts: str) -> str:
+        return self.prefix + ":".join(parts)
+
+    def _index_keys(self, approval: PendingApproval) -> List[str]:
+        return [
+            self._key("thread", approval.thread_id),
+            self._key("user", approval.user),
+            self._key("waiter", approval.waiter_id),
+        ]
+
+    @staticmethod
+    def _decode(data: Dict[bytes, bytes]) -> Optional[PendingApproval]:
+        if not data:
+            return None
+        values = {name: data[name.encode()].decode() for name in _FIELDS}
+        values["created"], values["expires"] = float(values["created"]), float(values["expires"])
+        return PendingApproval(**values, snapshot=data[b"snapshot"])
+
+    async def put(self, approval: PendingApproval):
+        key = self._key("approval", approval.approval_id)
+        mapping = {name: str(getattr(approval, name)) for name in _FIELDS}
+        mapping["snapshot"] = approval.snapshot
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=mapping)
+            pipe.expireat(key, int(approval.expires) + 1)
+            pipe.zadd(self._key("pending"), {approval.approval_id: approval.expires})
+            for index in self._index_keys(approval):
+                pipe.sadd(index, approval.approval_id)
+            await pipe.execute()
+
+    async def get(self, approval_id: str) -> Optional[PendingApproval]:
+        approval = self._decode(await self._redis.hgetall(self._key("approval", approval_id)))
+        return approval if approval is not None and not approval.expired else None
+
+    async def pending(
+        self, thread_id: Optional[str] = None, user: Optional[str] = None, waiter_id: Optional[str] = None
+    ) -> List[PendingApproval]:
+        filters = {"thread": thread_id, "user": user, "waiter": waiter_id}
+        indexes = [self._key(name, value) for name, value in filters.items() if value is not None]
+        if indexes:
+            ids = await self._redis.sinter(indexes)
+        else:
+            ids = await self._redis.zrangebyscore(self._key("pending"), time.time(), "+inf")
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for approval_id in ids:
+                pipe.hgetall(self._key("approval", approval_id.decode()))
+            approvals = [self._decode(data) for data in await pipe.execute()]
+        return sorted((a for a in approvals if a is not None and not a.expired), key=lambda a: a.created)
+
+    async def _remove(self, approval_id: str) -> Optional[PendingApproval]:
+        key = self._key("approval", approval_id)
+        approval = self._decode(await self._redis.hgetall(key))
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            for index in self._index_keys(approval) if approval is not None else []:
+                pipe.srem(index, approval_id)
+            await pipe.execute()
+        return approval
+
+    async def claim(self, approval_id: str) -> Optional[PendingApproval]:
+        if not await self._redis.zrem(self._key("pending"), approval_id):
+            return None  # Claimed by another worker, or expired
+        approval = await self._remove(approval_id)
+        return approval if approval is not None and not approval.expired else None
+
+    async def expire(self) -> int:
+        expired = 0
+        for approval_id in await self._redis.zrangebyscore(self._key("pending"), "-inf", time.time()):
+            if await self._redis.zrem(self._key("pending"), approval_id):
+                await self._remove(approval_id.decode())
+                expired += 1
+        self.expired_total += expired
+        return expired
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_approval_store(url: str, ttl: float = 24 * 3600.0) -> ApprovalStore:
+    """A Redis store for redis://, rediss:// and unix:// URLs, otherwise a SQLite file at the path"""
+
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisApprovalStore(url, ttl)
+    return SQLiteApprovalStore(url.removeprefix("sqlite:///"), ttl)
@@ -0,0 +1,92 @@
+import struct
+from typing import List, Optional
+
+import numpy as np
+
+SAMPLE_WIDTH = 2  # 16-bit PCM
+
+
+def wav_header(num_samples: int, sample_rate: int, channels: int = 1) -> bytes:
+    """44-byte RIFF/WAVE header for 16-bit PCM"""
+
+    data_size = num_samples * SAMPLE_WIDTH * channels
+    byte_rate = sample_rate * SAMPLE_WIDTH * channels
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, byte_rate, SAMPLE_WIDTH * channels, 8 * SAMPLE_WIDTH,
+        b"data", data_size,
+    )
+
+
+class PCMRingBuffer:
+    """Preallocated ring buffer of mono 16-bit PCM holding at most max_seconds of audio.
+
+    Chunks are written in place into one int16 array, so capture never grows
+    a list or concatenates. Once full, the oldest samples are overwritten.
+    Positions are absolute sample counts since the last clear(), which lets
+    readers such as a VAD keep a cursor into the stream.
+    """
+
+    def __init__(self, sample_rate: int = 24000, max_seconds: float = 120.0):
+        self.sample_rate = sample_rate
+        self.capacity = int(sample_rate * max_seconds)
+        self._samples = np.zeros(self.capacity, dtype=np.int16)
+        self._end = 0  # Absolute position one past the newest sample
+
+    def __len__(self) -> int:
+        return min(self._end, self.capacity)
+
+    @property
+    def start(self) -> int:
+        """Absolute position of the oldest sample still held"""
+
+        return self._end - len(self)
+
+    @property
+    def end(self) -> int:
+        return self._end
+
+    @property
+    def duration(self) -> float:
+        return len(self) / self.sample_rate
+
+    @property
+    def nbytes(self) -> int:
+        return self._samples.nbytes
+
+    def write(self, data: bytes):
+        """Copies a chunk of raw PCM into the buffer"""
+
+        samples = np.frombuffer(data, dtype=np.int16)
+        if len(samples) > self.capacity:
+            self._end += len(samples) - self.capacity
+            samples = samples[-self.capacity :]
+        offset = self._end % self.capacity
+        head = min(len(samples), self.capacity - offset)
+        self._samples[offset : offset + head] = samples[:head]
+        self._samples[: len(samples) - head] = samples[head:]
+        self._end += len(samples)
+
+    def views(self, start: Optional[int] = None, end: Optional[int] = None) -> List[np.ndarray]:
+        """Zero-copy views of the samples in [start, end), clamped to what is held.
+        One view, or two when the range wraps around the end of the array."""
+
+        start = self.start if start is None else max(start, self.start)
+        end = self._end if end is None else min(end, self._end)
+        if end <= start:
+            return []
+        first, last = start % self.capacity, end % self.capacity or self.capacity
+        if end - start <= self.capacity - first:
+            return [self._samples[first : first + end - start]]
+        return [self._samples[first:], self._samples[:last]]
+
+    def wav_bytes(self, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        """WAV file of the samples in [start, end): the header plus the sample memory, copied once"""
+
+        views = self.views(start, end)
+        num_samples = sum(len(v) for v in views)
+        return b"".join([wav_header(num_samples, self.sample_rate), *(memoryview(v) for v in views)])
+
+    def clear(self):
+        self._end = 0
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import struct
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from llama_index.core.workflow import Context, JsonSerializer, Workflow
+from llama_index.core.workflow.handler import WorkflowHandler
+
+_STATE_SECTION = "state"
+_STATE_KEY_PREFIX = "state:"
+# Snapshots are shared between workers through the approval store, so they hold
+# only JSON: loading one never runs code, unlike unpickling
+_MAGIC = b"CTXJ1"
+_SECTION_HEADER = struct.Struct("<H16sI")  # Name length, digest, blob length
+
+
+def _split(ctx_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Splits Context.to_dict() into sections that change independently: one per state key plus the run's queues and buffers"""
+
+    sections = {key: value for key, value in ctx_dict.items() if key != _STATE_SECTION}
+    state = ctx_dict.get(_STATE_SECTION) or {}
+    data = (state.get("state_data") or {}).get("_data")
+    if isinstance(data, dict):
+        sections[_STATE_SECTION] = {**state, "state_data": {**state["state_data"], "_data": None}}
+        for key, value in data.items():
+            sections[f"{_STATE_KEY_PREFIX}{key}"] = value
+    else:
+        sections[_STATE_SECTION] = state
+    return sections
+
+
+def _join(sections: Dict[str, Any]) -> Dict[str, Any]:
+    ctx_dict = {key: value for key, value in sections.items() if not key.startswith(_STATE_KEY_PREFIX)}
+    state = ctx_dict.get(_STATE_SECTION) or {}
+    if (state.get("state_data") or {}).get("_data", ...) is None:
+        data = {
+            key[len(_STATE_KEY_PREFIX) :]: value
+            for key, value in sections.items()
+            if key.startswith(_STATE_KEY_PREFIX)
+        }
+        ctx_dict[_STATE_SECTION] = {**state, "state_data": {**state["state_data"], "_data": data}}
+    return ctx_dict
+
+
+@dataclass
+class ContextSnapshot:
+    """Compact binary snapshot of a workflow Context: each section is JSON, zlib-compressed"""
+
+    sections: Dict[str, bytes] = field(default_factory=dict)
+    digests: Dict[str, bytes] = field(default_factory=dict)
+    reused: int = 0  # Sections carried over unchanged from the previous snapshot
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(blob) for blob in self.sections.values())
+
+    def to_bytes(self) -> bytes:
+        parts = [_MAGIC]
+        for key, blob in self.sections.items():
+            name = key.encode()
+            parts += [_SECTION_HEADER.pack(len(name), self.digests[key], len(blob)), name, blob]
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ContextSnapshot":
+        if not data.startswith(_MAGIC):
+            raise ValueError("Not a context snapshot")
+        snapshot, offset = cls(), len(_MAGIC)
+        while offset < len(data):
+            name_len, digest, blob_len = _SECTION_HEADER.unpack_from(data, offset)
+            offset += _SECTION_HEADER.size
+            key = data[offset : offset + name_len].decode()
+            offset += name_len
+            snapshot.sections[key] = data[offset : offset + blob_len]
+            snapshot.digests[key] = digest
+            offset += blob_len
+        return snapshot
+
+
+def snapshot_context(
+    ctx: Context, previous: Optional[ContextSnapshot] = None, level: int = 6
+) -> ContextSnapshot:
+    """Snapshots a context, only compressing the sections that changed since the previous snapshot"""
+
+    snapshot = ContextSnapshot()
+    for key, value in _split(ctx.to_dict(serializer=JsonSerializer())).items():
+        raw = json.dumps(value, separators=(",", ":")).encode()
+        digest = hashlib.blake2b(raw, digest_size=16).digest()
+        if previous is not None and previous.digests.get(key) == digest:
+            snapshot.sections[key] = previous.sections[key]
+            snapshot.reused += 1
+        else:
+            snapshot.sections[key] = zlib.compress(raw, level)
+        snapshot.digests[key] = digest
+    return snapshot
+
+
+def restore_context(workflow: Workflow, snapshot: ContextSnapshot) -> Context:
+    sections = {key: json.loads(zlib.decompress(blob)) for key, blob in snapshot.sections.items()}
+    return Context.from_dict(workflow, _join(sections), serializer=JsonSerializer())
+
+
+class ContextStore:
+    """Holds the workflow Context of one chat session.
+
+    While the process runs, the live Context is reused from turn to turn,
+    and a run suspended on a human is kept as its live handler, so there is
+    no serialization per turn. Only when the workflow suspends waiting for a
+    human is a snapshot taken, incrementally from the previous one, so the
+    run can be restored if the live handler is lost, e.g. after a restart.
+    """
+
+    def __init__(self, workflow: Workflow):
+        self.workflow = workflow
+        self.ctx = Context(workflow)
+        self.handler: Optional[WorkflowHandler] = None
+        self.snapshot: Optional[ContextSnapshot] = None
+
+    def suspend(self, handler: WorkflowHandler):
+        """Keeps a run that is waiting for a human, and snapshots it"""
+
+        self.handler = handler
+        self.snapshot = snapshot_context(handler.ctx, self.snapshot)
+
+    def resume(self) -> WorkflowHandler:
+        """The suspended run, or a new run restored from its snapshot when the live one is gone"""
+
+        if self.handler is not None and not self.handler.done():
+            return self.handler
+        if self.snapshot is None:
+            raise RuntimeError("No suspended workflow to resume")
+        self.ctx = restore_context(self.workflow, self.snapshot)
+        self.handler = self.workflow.run(ctx=self.ctx)
+        return self.handler
+
+    def finish(self):
+        """Forgets the run once it completed. The live context carries over to the next turn."""
+
+        self.handler = None
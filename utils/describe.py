@@ -0,0 +1,49 @@
+import os
+import re
+from typing import Sequence, Tuple
+
+from llama_index.core.llms import LLM
+from llama_index.core.prompts import PromptTemplate
+from pydantic import BaseModel, Field
+
+DESCRIBE_PROMPT = PromptTemplate(
+    "Based on these filenames, come up with a short, concise name that describes these documents, "
+    "for example 'MBA Value Analysis', without any '.pdf' or file extensions. Also come up with a "
+    "consolidated description that describes these documents, for example "
+    "'Answers questions about animals'. Filenames: {filenames}"
+)
+
+
+class DocumentToolSpec(BaseModel):
+    """Name and description of a set of uploaded documents"""
+
+    name: str = Field(description="Short, concise name of the documents without file extensions")
+    description: str = Field(description="Consolidated description of what the documents answer")
+
+
+def tool_name(name: str) -> str:
+    """Turns a free-text name into a valid tool (function) name"""
+
+    name = re.sub(r"[^A-Za-z0-9_-]+", "_", name.strip()).strip("_")
+    return name[:64] or "Uploaded_documents"
+
+
+def describe_filenames(filenames: Sequence[str]) -> Tuple[str, str]:
+    """Deterministic local name and description derived from the filenames alone"""
+
+    stems = [
+        re.sub(r"[_\-.]+", " ", os.path.splitext(os.path.basename(f))[0]).strip()
+        for f in filenames
+    ]
+    stems = [stem for stem in stems if stem] or ["uploaded documents"]
+    name = tool_name(stems[0] if len(stems) == 1 else f"{stems[0]} and others")
+    description = f"Answers questions about the uploaded documents: {', '.join(stems)}"
+    return name, description
+
+
+async def describe_documents(llm: LLM, filenames: Sequence[str]) -> DocumentToolSpec:
+    """Names and describes the documents with a single structured LLM call"""
+
+    return await llm.astructured_predict(
+        DocumentToolSpec, DESCRIBE_PROMPT, filenames=", ".join(filenames)
+    )
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import Field, PrivateAttr, SerializeAsAny
+
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_TEXT, _QUERY = "text", "query"
+
+
+@dataclass
+class EmbeddingBatchStats:
+    requests: int = 0  # Texts and queries submitted
+    batches: int = 0
+    embedded: int = 0  # Texts sent to the wrapped model, after deduplication
+    max_batch: int = 0
+    query_cache_hits: int = 0
+    queue_seconds: float = 0.0  # Summed over requests, from submission to their batch being sent
+    max_queue_seconds: float = 0.0
+
+    @property
+    def mean_batch(self) -> float:
+        return self.embedded / self.batches if self.batches else 0.0
+
+    @property
+    def mean_queue_ms(self) -> float:
+        queued = self.requests - self.query_cache_hits
+        return 1000.0 * self.queue_seconds / queued if queued else 0.0
+
+
+@dataclass
+class _Request:
+    kind: str
+    text: str
+    future: asyncio.Future
+    enqueued: float
+
+
+class BatchingEmbedding(BaseEmbedding):
+    """Drop-in embedding model that merges the requests of every session into micro-batches.
+
+    Each text or query is queued; a dispatcher task sends a batch once it
+    holds max_batch_size texts or the oldest has waited max_wait_ms, with at
+    most max_concurrency batches in flight. Identical texts in a batch are
+    embedded once. Query embeddings are kept in an LRU of query_cache_size.
+
+    Queries go in their own batches, embedded one by one, unless
+    batch_queries is set for a model that embeds queries like documents
+    (no query instruction). Sync calls from worker threads join the
+    batches of the event loop; sync calls on the loop's own thread go to the
+    wrapped model directly.
+    """
+
+    model: SerializeAsAny[BaseEmbedding] = Field(description="The wrapped embedding model")
+    max_wait_ms: float = Field(default=5.0, description="Longest a request waits for its batch to fill")
+    max_concurrency: int = Field(default=4, description="Batches in flight")
+    query_cache_size: int = Field(default=1024, description="Query embeddings kept, least recently used evicted")
+    batch_queries: bool = Field(default=False, description="Embed queries in batches, as texts")
+
+    _stats: EmbeddingBatchStats = PrivateAttr(default_factory=EmbeddingBatchStats)
+    _on_batch: Optional[Callable[[int, float], None]] = PrivateAttr(default=None)
+    _query_cache: "OrderedDict[str, Embedding]" = PrivateAttr(default_factory=OrderedDict)
+    _query_flights: SingleFlight = PrivateAttr(default_factory=SingleFlight)
+    _cache_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _loop: Optional[asyncio.AbstractEventLoop] = PrivateAttr(default=None)
+    _queue: Optional[asyncio.Queue] = PrivateAttr(default=None)
+    _semaphore: Optional[asyncio.Semaphore] = PrivateAttr(default=None)
+    _dispatcher: Optional[asyncio.Task] = PrivateAttr(default=None)
+    _senders: Set[asyncio.Task] = PrivateAttr(default_factory=set)  # Referenced so they are not garbage-collected mid-run
+
+    def __init__(
+        self,
+        model: BaseEmbedding,
+        max_batch_size: int = 64,
+        on_batch: Optional[Callable[[int, float], None]] = None,
+        **kwargs,
+    ):
+        super().__init__(
+            model=model,
+            model_name=model.model_name,
+            embed_batch_size=max_batch_size,
+            **kwargs,
+        )
+        self._on_batch = on_batch  # Called with the size and the longest queue wait of each batch
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchingEmbedding"
+
+    @property
+    def stats(self) -> EmbeddingBatchStats:
+        return self._stats
+
+    ## Query cache
+    def _cached_query(self, query: str) -> Optional[Embedding]:
+        with self._cache_lock:
+            embedding = self._query_cache.get(query)
+            if embedding is not None:
+                self._query_cache.move_to_end(query)
+                self._stats.requests += 1
+                self._stats.query_cache_hits += 1
+            return embedding
+
+    def _cache_query(self, query: str, embedding: Embedding):
+        with self._cache_lock:
+            self._query_cache[query] = embedding
+            self._query_cache.move_to_end(query)
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+
+    ## Dispatcher
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._dispatcher is None or self._dispatcher.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    async def _submit(self, kind: str, texts: List[str]) -> List[Embedding]:
+        self._ensure_dispatcher()
+        now = time.perf_counter()
+        futures = []
+        for text in texts:
+            future = self._loop.create_future()
+            self._queue.put_nowait(_Request(kind, text, future, now))
+            futures.append(future)
+        self._stats.requests += len(texts)
+        return list(await asyncio.gather(*futures))
+
+    async def _dispatch(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = batch[0].enqueued + self.max_wait_ms / 1000.0
+            while len(batch) < self.embed_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._semaphore.acquire()
+            sender = asyncio.create_task(self._send(batch))
+            self._senders.add(sender)
+            sender.add_done_callback(self._senders.discard)
+
+    async def _send(self, batch: List[_Request]):
+        try:
+            batch = [request for request in batch if not request.future.done()]  # Callers that gave up
+            if not batch:
+                return
+            sent = time.perf_counter()
+            waited = max(sent - request.enqueued for request in batch)
+            self._stats.queue_seconds += sum(sent - request.enqueued for request in batch)
+            self._stats.max_queue_seconds = max(self._stats.max_queue_seconds, waited)
+
+            texts: Dict[Tuple[str, str], List[_Request]] = {}
+            for request in batch:
+                kind = _TEXT if self.batch_queries else request.kind
+                texts.setdefault((kind, request.text), []).append(request)
+            batched = [text for kind, text in texts if kind == _TEXT]
+            queries = [text for kind, text in texts if kind == _QUERY]
+            calls = [self.model._aget_query_embedding(query) for query in queries]
+            if batched:
+                calls.insert(0, self.model._aget_text_embeddings(batched))
+            try:
+                results = await asyncio.gather(*calls)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                return
+
+            embeddings = {
+                **{(_TEXT, text): embedding for text, embedding in zip(batched, results[0] if batched else [])},
+                **{(_QUERY, query): embedding for query, embedding in zip(queries, results[1 if batched else 0 :])},
+            }
+            for key, requests in texts.items():
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_result(embeddings[key])
+
+            self._stats.batches += 1
+            self._stats.embedded += len(texts)
+            self._stats.max_batch = max(self._stats.max_batch, len(texts))
+            if self._on_batch is not None:
+                self._on_batch(len(texts), waited)
+        finally:
+            self._semaphore.release()
+
+    def _from_thread(self, kind: str, texts: List[str]) -> Optional[List[Embedding]]:
+        """Batches a sync call made from a worker thread on the dispatcher's loop, None on the loop's own thread"""
+
+        loop = self._loop
+        if loop is None or not loop.is_running() or loop.is_closed():
+            return None
+        try:
+            if asyncio.get_running_loop() is loop:
+                return None
+        except RuntimeError:
+            pass
+        return asyncio.run_coroutine_threadsafe(self._submit(kind, texts), loop).result()
+
+    ## BaseEmbedding
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        embedding = self._cached_query(query)
+        if embedding is not None:
+            return embedding
+        if query in self._query_flights:
+            # The same question asked in several sessions at once is embedded once
+            self._stats.requests += 1
+            self._stats.query_cache_hits += 1
+        found, embedding = await self._query_flights.wait(query)
+        if found:
+            return embedding
+
+        async with self._query_flights.lead(query) as future:
+            [embedding] = await self._submit(_QUERY, [query])
+            self._cache_query(query, embedding)
+            future.set_result(embedding)
+            return embedding
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._submit(_TEXT, [text]))[0]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self._submit(_TEXT, texts)
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        embedding = self._cached_query(query)
+        if embedding is not None:
+            return embedding
+        batched = self._from_thread(_QUERY, [query])
+        embedding = batched[0] if batched is not None else self.model._get_query_embedding(query)
+        self._cache_query(query, embedding)
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        batched = self._from_thread(_TEXT, texts)
+        return batched if batched is not None else self.model._get_text_embeddings(texts)
@@ -0,0 +1,144 @@
+import bisect
+import csv
+import difflib
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_PLACES_PATH = os.path.join(os.path.dirname(__file__), "data", "places.csv")
+
+# "Show me Paris.", "Take me to the Eiffel Tower!", "Where is Kyoto?"
+_SHOW_REQUEST = re.compile(
+    r"^\s*(?:please\s+)?(?:show\s+me|take\s+me\s+to|go\s+to|where\s+is|move\s+the\s+map\s+to|zoom\s+(?:in\s+)?to)"
+    r"\s+(?P<place>[^.!?]+?)\s*(?:please)?[.!?]*\s*$",
+    re.IGNORECASE,
+)
+
+
+@dataclass(frozen=True)
+class Place:
+    name: str
+    country: str
+    latitude: float
+    longitude: float
+    kind: str = "city"
+    population: int = 0
+
+    @property
+    def zoom(self) -> int:
+        """Map zoom that frames the place: closer for landmarks than for cities"""
+
+        return 16 if self.kind == "landmark" else 12
+
+    def describe(self) -> str:
+        return f"{self.name}, {self.country} ({self.latitude:.4f}, {self.longitude:.4f})"
+
+
+@dataclass(frozen=True)
+class Match:
+    place: Place
+    score: float  # 1.0 for an exact name or alias, lower for prefix and fuzzy matches
+    how: str  # "exact", "prefix" or "fuzzy"
+
+
+def normalize(name: str) -> str:
+    """Case, accent and punctuation insensitive form of a place name"""
+
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c)).casefold()
+    name = re.sub(r"[^\w\s]", " ", name)
+    name = re.sub(r"^the\s+", "", " ".join(name.split()))
+    return name
+
+
+def parse_show_request(text: str) -> Optional[str]:
+    """Place name of a "Show me X" style request, None for anything else"""
+
+    match = _SHOW_REQUEST.match(text)
+    return match.group("place") if match else None
+
+
+class Gazetteer:
+    """Offline index of cities and landmarks for geocoding without the LLM.
+
+    Names and aliases are normalized and kept in one sorted list, so exact
+    and prefix lookups are binary searches. Misspellings fall back to
+    difflib over the names sharing the query's first letter. Ambiguous
+    names resolve to the most populous place. Lookups are memoized.
+
+    The table is a CSV with name, aliases (|-separated), country, latitude,
+    longitude, kind and population columns, e.g. an export of GeoNames.
+    """
+
+    def __init__(self, places: Sequence[Place], aliases: Optional[Dict[int, List[str]]] = None):
+        self.places = list(places)
+        keys: Dict[str, int] = {}
+        for i, place in enumerate(self.places):
+            for name in [place.name, *(aliases or {}).get(i, [])]:
+                key = normalize(name)
+                if key and (key not in keys or self.places[keys[key]].population < place.population):
+                    keys[key] = i
+        self._keys: List[str] = sorted(keys)
+        self._ids: List[int] = [keys[key] for key in self._keys]
+        self.lookup = lru_cache(maxsize=4096)(self._lookup)
+
+    @classmethod
+    def from_csv(cls, path: str = DEFAULT_PLACES_PATH) -> "Gazetteer":
+        places, aliases = [], {}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                aliases[len(places)] = [a for a in (row.get("aliases") or "").split("|") if a]
+                places.append(
+                    Place(
+                        name=row["name"],
+                        country=row.get("country", ""),
+                        latitude=float(row["latitude"]),
+                        longitude=float(row["longitude"]),
+                        kind=row.get("kind") or "city",
+                        population=int(row.get("population") or 0),
+                    )
+                )
+        return cls(places, aliases)
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        lo = bisect.bisect_left(self._keys, prefix)
+        hi = bisect.bisect_left(self._keys, prefix + "\U0010ffff", lo)
+        return lo, hi
+
+    def _lookup(self, query: str) -> Optional[Match]:
+        key = normalize(query)
+        if not key:
+            return None
+
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return Match(self.places[self._ids[i]], 1.0, "exact")
+
+        # Unfinished names, e.g. "amster"
+        lo, hi = self._prefix_range(key)
+        if lo < hi:
+            best = max((self.places[self._ids[j]] for j in range(lo, hi)), key=lambda p: p.population)
+            return Match(best, len(key) / len(normalize(best.name)), "prefix")
+
+        # Misspelt names, e.g. "singapour"
+        lo, hi = self._prefix_range(key[0])
+        candidates = self._keys[lo:hi]
+        close = difflib.get_close_matches(key, candidates, n=1, cutoff=0.75)
+        if close:
+            j = lo + candidates.index(close[0])
+            score = difflib.SequenceMatcher(None, key, close[0]).ratio()
+            return Match(self.places[self._ids[j]], score, "fuzzy")
+        return None
+
+    def search(self, query: str, limit: int = 5) -> List[Place]:
+        """Places whose name or alias starts with the query, most populous first"""
+
+        lo, hi = self._prefix_range(normalize(query))
+        places = {self._ids[j] for j in range(lo, hi)}
+        return sorted((self.places[i] for i in places), key=lambda p: -p.population)[:limit]
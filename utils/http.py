@@ -0,0 +1,227 @@
+import asyncio
+import bisect
+import importlib.util
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None  # httpx needs the h2 package for HTTP/2
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"})
+# Failures before the request reached the server, safe to retry whatever the method
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Refused by the server, or by a gateway in front of it, before the origin processed the request
+UNPROCESSED_STATUSES = frozenset({429, 502, 503, 504})
+LATENCY_BUCKETS_MS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+
+@dataclass
+class LatencyHistogram:
+    """Fixed-bucket histogram of request latencies in milliseconds"""
+
+    buckets: List[float] = field(default_factory=lambda: list(LATENCY_BUCKETS_MS))
+    counts: List[int] = field(default_factory=list)
+    total_ms: float = 0.0
+
+    def __post_init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)  # The last bucket is +Inf
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.total_ms += ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th quantile"""
+
+        total = self.count
+        if total == 0:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return float("inf")
+
+
+@dataclass
+class HostStats:
+    requests: int = 0
+    retries: int = 0
+    errors: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """Seconds to wait according to the Retry-After header, in seconds or HTTP-date form"""
+
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryingTransport(httpx.AsyncBaseTransport):
+    """Pooled keep-alive transport shared by every outbound client.
+
+    Wraps an AsyncHTTPTransport (HTTP/2 when h2 is installed) and adds:
+    - at most max_per_host requests per host waiting on response headers.
+      The slot is given back once the headers arrive, so long streamed
+      bodies such as LLM generations or MCP SSE streams do not hold it
+    - retries with full-jitter exponential backoff, honouring Retry-After.
+      Idempotent methods are retried on transport errors and 429/5xx
+      responses. Others, e.g. POST, only when the request never reached the
+      server (connect errors) or was refused unprocessed (429, 502-504), so
+      a tool call or image generation is not run twice after a 500 or a
+      dropped response
+    - per-host request, retry and error counts and latency histograms
+
+    Any transport can be wrapped, e.g. httpx.MockTransport or one pointed
+    at a local stub server.
+    """
+
+    def __init__(
+        self,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        max_per_host: int = 8,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        retry_after_max: float = 30.0,
+        retry_statuses=RETRY_STATUSES,
+    ):
+        self._transport = transport or httpx.AsyncHTTPTransport(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+        )
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.retry_statuses = retry_statuses
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, HostStats] = {}
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        delay = retry_after(response) if response is not None else None
+        if delay is not None:
+            return min(delay, self.retry_after_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def _retries_error(self, request: httpx.Request, error: httpx.TransportError) -> bool:
+        if isinstance(error, httpx.UnsupportedProtocol):
+            return False
+        return request.method in IDEMPOTENT_METHODS or isinstance(error, UNSENT_ERRORS)
+
+    def _retries_status(self, request: httpx.Request, status_code: int) -> bool:
+        if status_code not in self.retry_statuses:
+            return False
+        return request.method in IDEMPOTENT_METHODS or status_code in UNPROCESSED_STATUSES
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.max_per_host))
+        stats = self._stats.setdefault(host, HostStats())
+
+        for attempt in range(self.max_retries + 1):
+            stats.requests += 1
+            started = time.perf_counter()
+            try:
+                async with semaphore:
+                    response = await self._transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                stats.errors += 1
+                if attempt == self.max_retries or not self._retries_error(request, e):
+                    raise
+                delay = self._backoff(attempt)
+                logger.info(f"Retrying {request.method} {host} in {delay:.2f}s after {type(e).__name__}")
+            else:
+                # Time to response headers, which is what callers wait on before streaming
+                stats.latency.observe(1000.0 * (time.perf_counter() - started))
+                if attempt == self.max_retries or not self._retries_status(request, response.status_code):
+                    return response
+                await response.aclose()
+                delay = self._backoff(attempt, response)
+                logger.info(f"Retrying {request.method} {host} in {delay:.2f}s after HTTP {response.status_code}")
+
+            stats.retries += 1
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+    def host_stats(self) -> Dict[str, HostStats]:
+        return dict(self._stats)
+
+    def stats(self) -> Dict[str, dict]:
+        """Per-host counts and latency percentiles"""
+
+        return {
+            host: {
+                "requests": s.requests,
+                "retries": s.retries,
+                "errors": s.errors,
+                "p50_ms": s.latency.quantile(0.5),
+                "p95_ms": s.latency.quantile(0.95),
+                "p99_ms": s.latency.quantile(0.99),
+            }
+            for host, s in self._stats.items()
+        }
+
+
+class _SharedTransport(httpx.AsyncBaseTransport):
+    """View of a shared transport that is not closed along with the client using it"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+
+def create_http_client(transport: RetryingTransport, timeout: float = 25.0) -> httpx.AsyncClient:
+    """Long-lived client over the shared transport"""
+
+    return httpx.AsyncClient(transport=_SharedTransport(transport), timeout=timeout, follow_redirects=True)
+
+
+def client_factory(transport: RetryingTransport) -> Callable[..., httpx.AsyncClient]:
+    """Factory for libraries that open and close their own clients, e.g. MCP's httpx_client_factory.
+    Each client gets its own headers, timeout and auth but shares the pooled connections."""
+
+    def factory(
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[httpx.Timeout] = None,
+        auth: Optional[httpx.Auth] = None,
+    ) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            transport=_SharedTransport(transport),
+            headers=headers,
+            timeout=timeout if timeout is not None else httpx.Timeout(30.0),
+            auth=auth,
+            follow_redirects=True,
+        )
+
+    return factory
@@ -0,0 +1,258 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from llama_index.core import (
+    SimpleDirectoryReader,
+    StorageContext,
+    VectorStoreIndex,
+    load_index_from_storage,
+)
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, Document, MetadataMode
+
+from utils.embedding_batcher import BatchingEmbedding
+from utils.vector_store import CompactVectorStore, has_compact_store
+
+logger = logging.getLogger(__name__)
+
+_HASH_BLOCK_SIZE = 1 << 20
+_CHUNK_EVICTION_BATCH = 256
+
+
+@dataclass
+class CacheStats:
+    """Hit/miss counters of the index cache"""
+
+    index_hits: int = 0
+    index_misses: int = 0
+    chunk_hits: int = 0
+    chunk_misses: int = 0
+    evictions: int = 0
+
+
+class IndexCache:
+    """Disk-backed, content-addressed cache for uploaded document indexes.
+
+    Whole indexes are keyed by the content hashes of the uploaded files, so a
+    repeat upload loads the persisted index instead of re-embedding it. Chunk
+    embeddings are keyed by chunk hash, so an upload that only partially
+    overlaps a previous one still reuses the embeddings it shares with it.
+    Both share one byte budget and are evicted least recently used first.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._index_dir = os.path.join(cache_dir, "indexes")
+        os.makedirs(self._index_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(cache_dir, "cache.sqlite"), check_same_thread=False
+        )
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS indexes "
+                "(key TEXT PRIMARY KEY, size_bytes INTEGER, last_used REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chunks "
+                "(key TEXT PRIMARY KEY, embedding BLOB, last_used REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS chunks_last_used ON chunks (last_used)"
+            )
+
+    ## Keys
+    @staticmethod
+    def file_hash(path: str) -> str:
+        """Hashes the content of a file"""
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while block := f.read(_HASH_BLOCK_SIZE):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _model_id(embed_model: BaseEmbedding) -> str:
+        if isinstance(embed_model, BatchingEmbedding):
+            embed_model = embed_model.model  # Batching does not change the embeddings
+        return f"{type(embed_model).__name__}:{embed_model.model_name}"
+
+    def index_key(self, filepaths: Sequence[str], embed_model: BaseEmbedding) -> str:
+        """Key of the index built from these files with this embedding model"""
+
+        digest = hashlib.sha256(self._model_id(embed_model).encode())
+        for file_hash in sorted(self.file_hash(path) for path in filepaths):
+            digest.update(file_hash.encode())
+        return digest.hexdigest()
+
+    def chunk_key(self, node: BaseNode, embed_model: BaseEmbedding) -> str:
+        """Key of a chunk's embedding: the embedded text and the embedding model"""
+
+        digest = hashlib.sha256(self._model_id(embed_model).encode())
+        digest.update(node.get_content(metadata_mode=MetadataMode.EMBED).encode())
+        return digest.hexdigest()
+
+    def index_path(self, key: str) -> str:
+        return os.path.join(self._index_dir, key)
+
+    ## Index tier
+    def has_index(self, key: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT key FROM indexes WHERE key = ?", (key,)).fetchone()
+        return row is not None and os.path.isdir(self.index_path(key))
+
+    def index_bytes(self, key: str) -> int:
+        """Size of a persisted index on disk, 0 if it is not cached"""
+
+        with self._lock:
+            row = self._db.execute("SELECT size_bytes FROM indexes WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def load_index(self, key: str, embed_model: BaseEmbedding) -> Optional[VectorStoreIndex]:
+        """Loads a persisted index, or returns None on a cache miss"""
+
+        with self._lock:
+            row = self._db.execute("SELECT key FROM indexes WHERE key = ?", (key,)).fetchone()
+            if row is None or not os.path.isdir(self.index_path(key)):
+                self.stats.index_misses += 1
+                return None
+            self.stats.index_hits += 1
+            with self._db:
+                self._db.execute(
+                    "UPDATE indexes SET last_used = ? WHERE key = ?", (time.time(), key)
+                )
+
+        path = self.index_path(key)
+        if has_compact_store(path):
+            # The vectors are memory-mapped, only the pages a search touches are read
+            vector_store = CompactVectorStore.from_persist_dir(path)
+            storage_context = StorageContext.from_defaults(persist_dir=path, vector_store=vector_store)
+        else:
+            storage_context = StorageContext.from_defaults(persist_dir=path)
+        return load_index_from_storage(storage_context, embed_model=embed_model)
+
+    def save_index(self, key: str, index: VectorStoreIndex):
+        """Persists an index to disk and evicts old entries if over budget"""
+
+        path = self.index_path(key)
+        index.storage_context.persist(persist_dir=path)
+        size_bytes = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO indexes VALUES (?, ?, ?)",
+                (key, size_bytes, time.time()),
+            )
+        self._evict()
+
+    ## Chunk tier
+    def get_embeddings(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """Returns the cached embeddings for the chunk keys that are present"""
+
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                row = self._db.execute(
+                    "SELECT embedding FROM chunks WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    found[key] = array("f", row[0]).tolist()
+            now = time.time()
+            with self._db:
+                self._db.executemany(
+                    "UPDATE chunks SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+            self.stats.chunk_hits += len(found)
+            self.stats.chunk_misses += len(keys) - len(found)
+        return found
+
+    def put_embeddings(self, embeddings: Dict[str, List[float]]):
+        """Stores chunk embeddings and evicts old entries if over budget"""
+
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?)",
+                [(key, array("f", emb).tobytes(), now) for key, emb in embeddings.items()],
+            )
+        self._evict()
+
+    ## Documents
+    @staticmethod
+    def load_documents(filepaths: Sequence[str]) -> List[Document]:
+        """Reads uploaded files, keeping their temporary paths out of the embedded text
+        so identical content always hashes to the same chunk keys."""
+
+        documents = SimpleDirectoryReader(input_files=list(filepaths)).load_data()
+        for doc in documents:
+            doc.excluded_embed_metadata_keys.append("file_path")
+        return documents
+
+    ## Eviction
+    def total_bytes(self) -> int:
+        index_bytes, chunk_bytes = self._db.execute(
+            "SELECT (SELECT COALESCE(SUM(size_bytes), 0) FROM indexes), "
+            "(SELECT COALESCE(SUM(LENGTH(embedding)), 0) FROM chunks)"
+        ).fetchone()
+        return index_bytes + chunk_bytes
+
+    def _evict(self):
+        """Evicts the least recently used indexes and chunks until under budget"""
+
+        with self._lock:
+            while self.total_bytes() > self.max_bytes:
+                oldest_index = self._db.execute(
+                    "SELECT key, last_used FROM indexes ORDER BY last_used LIMIT 1"
+                ).fetchone()
+                oldest_chunk = self._db.execute(
+                    "SELECT last_used FROM chunks ORDER BY last_used LIMIT 1"
+                ).fetchone()
+                if oldest_index is None and oldest_chunk is None:
+                    return
+                with self._db:
+                    if oldest_chunk is None or (
+                        oldest_index is not None and oldest_index[1] <= oldest_chunk[0]
+                    ):
+                        self._db.execute("DELETE FROM indexes WHERE key = ?", (oldest_index[0],))
+                        shutil.rmtree(self.index_path(oldest_index[0]), ignore_errors=True)
+                    else:
+                        self._db.execute(
+                            "DELETE FROM chunks WHERE key IN "
+                            "(SELECT key FROM chunks ORDER BY last_used LIMIT ?)",
+                            (_CHUNK_EVICTION_BATCH,),
+                        )
+                self.stats.evictions += 1
+
+    ## Reporting
+    def collect(self) -> Iterable[str]:
+        """Metrics collector with the hit/miss counters and the bytes cached"""
+
+        with self._lock:
+            total_bytes = self.total_bytes()
+        for name, kind, value, help in (
+            ("index_cache_index_hits_total", "counter", self.stats.index_hits, "Uploads loaded from a cached index"),
+            ("index_cache_index_misses_total", "counter", self.stats.index_misses, "Index lookups not in the cache"),
+            ("index_cache_chunk_hits_total", "counter", self.stats.chunk_hits, "Chunk embeddings found in the cache"),
+            ("index_cache_chunk_misses_total", "counter", self.stats.chunk_misses, "Chunk embeddings not in the cache"),
+            ("index_cache_evictions_total", "counter", self.stats.evictions, "Indexes and chunk batches evicted"),
+            ("index_cache_bytes", "gauge", total_bytes, "Bytes of indexes and chunk embeddings cached"),
+        ):
+            yield f"# HELP {name} {help}"
+            yield f"# TYPE {name} {kind}"
+            yield f"{name} {value}"
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, MetadataMode
+
+from utils.index_cache import IndexCache
+
+logger = logging.getLogger(__name__)
+
+
+def parse_file(path: str) -> List[BaseNode]:
+    """Reads and chunks a single file. Runs inside a worker process."""
+
+    documents = IndexCache.load_documents([path])
+    return run_transformations(documents, Settings.transformations)
+
+
+class StreamingIngestor:
+    """Streams uploaded files through parsing, embedding and into an index.
+
+    Files are parsed concurrently in a process pool, and each file's chunks
+    are embedded in batches as soon as it is parsed. A semaphore shared by all
+    files bounds the number of embedding batches in flight, so one large file
+    cannot starve the embedding backend. Chunk embeddings already in the index
+    cache are reused instead of recomputed.
+    """
+
+    def __init__(
+        self,
+        cache: IndexCache,
+        embed_model: BaseEmbedding,
+        max_workers: Optional[int] = None,
+        batch_size: int = 32,
+        max_concurrency: int = 4,
+    ):
+        self.cache = cache
+        self.embed_model = embed_model
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Created on first use; spawn keeps the workers clear of the server's threads
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        async with self._semaphore:
+            return await self.embed_model.aget_text_embedding_batch(texts)
+
+    async def embed_nodes(self, nodes: Sequence[BaseNode]):
+        """Sets the embedding of every node, embedding only the chunks not in the cache"""
+
+        keys = [self.cache.chunk_key(node, self.embed_model) for node in nodes]
+        cached = await asyncio.to_thread(self.cache.get_embeddings, keys)
+        missing = [(key, node) for key, node in zip(keys, nodes) if key not in cached]
+
+        batches = [
+            missing[i : i + self.batch_size] for i in range(0, len(missing), self.batch_size)
+        ]
+        results = await asyncio.gather(
+            *(
+                self._embed_batch(
+                    [node.get_content(metadata_mode=MetadataMode.EMBED) for _, node in batch]
+                )
+                for batch in batches
+            )
+        )
+        computed = {
+            key: embedding
+            for batch, embeddings in zip(batches, results)
+            for (key, _), embedding in zip(batch, embeddings)
+        }
+        if computed:
+            await asyncio.to_thread(self.cache.put_embeddings, computed)
+            cached.update(computed)
+
+        for key, node in zip(keys, nodes):
+            node.embedding = cached[key]
+
+    async def _ingest_file(self, path: str) -> Tuple[str, List[BaseNode]]:
+        loop = asyncio.get_running_loop()
+        nodes = await loop.run_in_executor(self.executor, parse_file, path)
+        await self.embed_nodes(nodes)
+        return path, nodes
+
+    async def ingest(self, filepaths: Sequence[str]) -> AsyncIterator[Tuple[str, List[BaseNode]]]:
+        """Yields (filepath, embedded nodes) for each file as soon as it is ready"""
+
+        tasks = [asyncio.create_task(self._ingest_file(path)) for path in filepaths]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
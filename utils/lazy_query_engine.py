@@ -0,0 +1,61 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.response.schema import RESPONSE_TYPE
+from llama_index.core.prompts.mixin import PromptMixinType
+from llama_index.core.schema import QueryBundle
+
+
+class LazyQueryEngine(BaseQueryEngine):
+    """Query engine that only builds its underlying engine on the first query.
+
+    Used to rehydrate persisted document indexes on chat resume without paying
+    for loading them until the agent actually calls the tool. An engine that
+    is already built can be passed in and later unloaded to free its memory,
+    the next query loads it again.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], BaseQueryEngine],
+        engine: Optional[BaseQueryEngine] = None,
+        key: Optional[str] = None,
+    ):
+        super().__init__(callback_manager=None)
+        self._loader = loader
+        self._engine: Optional[BaseQueryEngine] = engine
+        self._lock = threading.Lock()
+        self.key = key  # What the loader loads, e.g. an index cache key
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._engine is not None
+
+    def unload(self) -> bool:
+        """Drops the built engine. Returns whether one was loaded."""
+
+        with self._lock:
+            loaded, self._engine = self._engine is not None, None
+            return loaded
+
+    def _get_engine(self) -> BaseQueryEngine:
+        with self._lock:
+            if self._engine is None:
+                self._engine = self._loader()
+            return self._engine
+
+    def _get_prompt_modules(self) -> PromptMixinType:
+        return {}
+
+    def _get_prompts(self) -> Dict[str, Any]:
+        return {}
+
+    def _query(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        return self._get_engine().query(query_bundle)
+
+    async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        # Loading reads the index from disk, so keep it off the event loop
+        engine = self._engine or await asyncio.to_thread(self._get_engine)
+        return await engine.aquery(query_bundle)
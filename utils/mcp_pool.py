@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+from llama_index.core.tools import FunctionTool
+from llama_index.tools.mcp import BasicMCPClient, McpToolSpec
+from llama_index.tools.mcp.client import enable_sse
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from utils.tool_registry import cache_tool_schema
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentMCPClient:
+    """MCP client that keeps one session open instead of one per call.
+
+    BasicMCPClient opens a fresh transport (e.g. an SSE connection) for every
+    list_tools and call_tool. This keeps a single initialized session alive in
+    a background task and multiplexes every request over it, reconnecting
+    lazily if the session drops. HTTP transports get their clients from
+    httpx_client_factory when one is given, e.g. to share pooled connections.
+    Once closed by aclose() it stays closed: calls fail instead of opening a
+    connection that nobody would close.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout: int = 30,
+        httpx_client_factory: Optional[Callable[..., httpx.AsyncClient]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.httpx_client_factory = httpx_client_factory
+        self.headers = headers
+        self._client = BasicMCPClient(url, timeout=timeout, headers=headers)
+        self._session: Optional[ClientSession] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._closed = asyncio.Event()
+        self._released = False
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def _open_session(self) -> AsyncIterator[ClientSession]:
+        if self.httpx_client_factory is None or urlparse(self.url).scheme not in ("http", "https"):
+            async with self._client._run_session() as session:
+                yield session
+            return
+
+        # Same transports as BasicMCPClient._run_session, with our own httpx clients
+        if enable_sse(self.url):
+            transport = sse_client(self.url, headers=self.headers, httpx_client_factory=self.httpx_client_factory)
+        else:
+            transport = streamablehttp_client(
+                self.url, headers=self.headers, httpx_client_factory=self.httpx_client_factory
+            )
+        async with transport as streams:
+            async with ClientSession(
+                streams[0], streams[1], read_timeout_seconds=timedelta(seconds=self.timeout)
+            ) as session:
+                await session.initialize()
+                yield session
+
+    async def _run(self, ready: asyncio.Future):
+        # The transport's cancel scopes must be entered and exited in the same task
+        try:
+            async with self._open_session() as session:
+                self._session = session
+                ready.set_result(None)
+                await self._closed.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.warning(f"MCP session to {self.url} dropped: {e}")
+        finally:
+            self._session = None
+
+    async def _get_session(self) -> ClientSession:
+        async with self._lock:
+            if self._released:
+                raise RuntimeError(f"The MCP connection to {self.url} was closed, reconnect the server to use its tools")
+            if self._session is None or self._runner is None or self._runner.done():
+                self._closed.clear()
+                ready = asyncio.get_running_loop().create_future()
+                self._runner = asyncio.create_task(self._run(ready))
+                await ready
+            return self._session
+
+    async def list_tools(self):
+        return await (await self._get_session()).list_tools()
+
+    async def call_tool(self, tool_name: str, arguments: Optional[dict] = None, **kwargs):
+        return await (await self._get_session()).call_tool(tool_name, arguments=arguments, **kwargs)
+
+    async def list_resources(self):
+        return await (await self._get_session()).list_resources()
+
+    async def read_resource(self, uri):
+        return await (await self._get_session()).read_resource(uri)
+
+    async def aclose(self):
+        self._released = True
+        self._closed.set()
+        if self._runner is not None:
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+
+
+@dataclass
+class _PooledConnection:
+    client: PersistentMCPClient
+    refs: int = 0
+    tools: List[FunctionTool] = field(default_factory=list)
+    listed_at: float = 0.0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class MCPConnectionPool:
+    """Process-wide MCP connections shared by every chat session, keyed by server URL and headers.
+
+    Sessions connecting with different headers, e.g. their own credentials,
+    get connections of their own. Connections are reference counted: the first acquire opens the session and
+    lists the tools, later acquires reuse both until the tool list is older
+    than tools_ttl seconds, and the last release closes the session.
+    """
+
+    def __init__(
+        self,
+        tools_ttl: float = 300.0,
+        httpx_client_factory: Optional[Callable[..., httpx.AsyncClient]] = None,
+    ):
+        self.tools_ttl = tools_ttl
+        self.httpx_client_factory = httpx_client_factory
+        self._connections: Dict[str, _PooledConnection] = {}
+
+    @staticmethod
+    def _key(url: str, headers: Optional[Dict[str, str]]) -> str:
+        if not headers:
+            return url
+        # Hashed, the headers may hold credentials and the key shows up in stats()
+        digest = hashlib.sha256(json.dumps(headers, sort_keys=True).encode()).hexdigest()[:12]
+        return f"{url}#{digest}"
+
+    async def acquire(self, url: str, headers: Optional[Dict[str, str]] = None) -> List[FunctionTool]:
+        """Takes a reference on the server's connection and returns its tools"""
+
+        key = self._key(url, headers)
+        connection = self._connections.get(key)
+        if connection is None:
+            connection = self._connections[key] = _PooledConnection(
+                PersistentMCPClient(url, httpx_client_factory=self.httpx_client_factory, headers=headers)
+            )
+        connection.refs += 1
+        try:
+            async with connection.lock:
+                if not connection.tools or time.monotonic() - connection.listed_at > self.tools_ttl:
+                    logger.info(f"Listing tools of MCP server {url}")
+                    tools = await McpToolSpec(client=connection.client).to_tool_list_async()
+                    connection.tools = [cache_tool_schema(tool) for tool in tools]
+                    connection.listed_at = time.monotonic()
+            return connection.tools
+        except BaseException:
+            await self.release(url, headers)
+            raise
+
+    async def release(self, url: str, headers: Optional[Dict[str, str]] = None):
+        """Drops a reference, closing the connection when nobody uses it any more.
+        Its tools then fail until they are acquired again."""
+
+        key = self._key(url, headers)
+        connection = self._connections.get(key)
+        if connection is None:
+            return
+        connection.refs -= 1
+        if connection.refs <= 0:
+            del self._connections[key]
+            await connection.client.aclose()
+            logger.info(f"Closed MCP connection to {url}")
+
+    def invalidate(self, url: str, headers: Optional[Dict[str, str]] = None):
+        """Forces the next acquire to list the server's tools again"""
+
+        key = self._key(url, headers)
+        if key in self._connections:
+            self._connections[key].listed_at = 0.0
+
+    def stats(self) -> Dict[str, int]:
+        """Reference counts of the open connections"""
+
+        return {key: connection.refs for key, connection in self._connections.items()}
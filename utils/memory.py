@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.llms import LLM
+from llama_index.core.utils import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "Progressively summarize the conversation below, adding onto the previous summary. "
+    "Keep names, numbers, decisions and open questions. Return only the new summary.\n\n"
+    "Previous summary:\n{summary}\n\nNew lines of conversation:\n{lines}\n\nNew summary:"
+)
+
+
+class SummarizingMemory:
+    """Token-budgeted chat memory that summarizes older turns in the background.
+
+    Messages are kept verbatim while they fit in token_limit. Older messages
+    are moved out of the window and folded into a running summary by the LLM
+    in a background task, so put() never waits on the summarizer. Token counts
+    are computed once per message. get() returns the system prompt with the
+    summary appended, then the recent window, in the shape
+    ChatMemoryBuffer.get() does. summarized counts the messages, from the
+    start of the conversation, that the summary covers.
+    """
+
+    def __init__(
+        self,
+        llm: LLM,
+        token_limit: int = 3000,
+        summary: str = "",
+        summarized: int = 0,
+        on_summary: Optional[Callable[[str, int], None]] = None,
+        tokenizer: Optional[Callable[[str], List]] = None,
+    ):
+        self.llm = llm
+        self.token_limit = token_limit
+        self.summary = summary
+        self.summarized = summarized
+        self.on_summary = on_summary
+        self._tokenizer = tokenizer or get_tokenizer()
+        self._system: Optional[ChatMessage] = None
+        self._window: List[Tuple[ChatMessage, int]] = []
+        self._window_tokens = 0
+        self._pending: List[ChatMessage] = []
+        self._summarizer: Optional[asyncio.Task] = None
+
+    def _count(self, message: ChatMessage) -> int:
+        return len(self._tokenizer(message.content or "")) + 4  # role and separators
+
+    def put(self, message: ChatMessage):
+        if message.role == MessageRole.SYSTEM:
+            self._system = message
+            return
+
+        tokens = self._count(message)
+        self._window.append((message, tokens))
+        self._window_tokens += tokens
+
+        # Always keep the latest message, even if it alone is over budget
+        while self._window_tokens > self.token_limit and len(self._window) > 1:
+            evicted, evicted_tokens = self._window.pop(0)
+            self._window_tokens -= evicted_tokens
+            self._pending.append(evicted)
+
+        if self._pending:
+            self._schedule_summary()
+
+    def restore(self, messages: List[ChatMessage]):
+        """Rebuilds the window from the tail of a past conversation.
+        Older messages are dropped only if the summary covers them, the others are
+        kept over budget and summarized once the next put() evicts them."""
+
+        window = []
+        self._window_tokens = 0
+        uncovered = len(messages) - min(self.summarized, len(messages))
+        for message in reversed(messages):
+            tokens = self._count(message)
+            if len(window) >= max(uncovered, 1) and self._window_tokens + tokens > self.token_limit:
+                break
+            window.append((message, tokens))
+            self._window_tokens += tokens
+        self._window = window[::-1]
+
+    def get(self) -> List[ChatMessage]:
+        messages = [self._system] if self._system is not None else []
+        if self.summary:
+            # Merged into the system prompt, some models only honour a single leading system message
+            summary = f"Summary of the earlier conversation: {self.summary}"
+            if messages:
+                summary = f"{messages[0].content}\n\n{summary}"
+            messages = [ChatMessage(role=MessageRole.SYSTEM, content=summary)]
+        return messages + [message for message, _ in self._window]
+
+    def get_all(self) -> List[ChatMessage]:
+        return self.get()
+
+    def reset(self):
+        self.summary = ""
+        self.summarized = 0
+        self._window.clear()
+        self._window_tokens = 0
+        self._pending.clear()
+
+    def _schedule_summary(self):
+        if self._summarizer is not None and not self._summarizer.done():
+            return
+        try:
+            self._summarizer = asyncio.get_running_loop().create_task(self._summarize())
+        except RuntimeError:
+            # No event loop, summarize on the next put from async code
+            self._summarizer = None
+
+    async def _summarize(self):
+        while self._pending:
+            batch, self._pending = self._pending, []
+            lines = "\n".join(f"{m.role.value}: {m.content}" for m in batch)
+            try:
+                response = await self.llm.acomplete(
+                    SUMMARY_PROMPT.format(summary=self.summary or "(none)", lines=lines)
+                )
+            except Exception as e:
+                logger.warning(f"Could not summarize {len(batch)} messages: {e}")
+                self._pending = batch + self._pending
+                return
+            self.summary = str(response).strip()
+            self.summarized += len(batch)
+            if self.on_summary is not None:
+                self.on_summary(self.summary, self.summarized)
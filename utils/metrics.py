@@ -0,0 +1,251 @@
+import bisect
+import functools
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format(key: LabelKey, extra: LabelKey = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render_histogram(
+    name: str, key: LabelKey, bounds: Sequence[float], counts: Sequence[int], total: float
+) -> Iterable[str]:
+    """Prometheus lines of one histogram series, from per-bucket (not cumulative) counts"""
+
+    cumulative = 0
+    for bound, count in zip([*bounds, float("inf")], counts):
+        cumulative += count
+        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+        yield f"{name}_bucket{_format(key, (('le', le),))} {cumulative}"
+    yield f"{name}_sum{_format(key)} {total:g}"
+    yield f"{name}_count{_format(key)} {cumulative}"
+
+
+class Counter:
+    def __init__(self, registry: "Metrics", name: str, help: str):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not self._registry.enabled:
+            return
+        key = _key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self._values.items():
+            yield f"{self.name}{_format(key)} {value:g}"
+
+
+class Gauge:
+    def __init__(self, registry: "Metrics", name: str, help: str):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels):
+        if not self._registry.enabled:
+            return
+        self._values[_key(labels)] = value
+
+    def clear(self):
+        """Drops every series, e.g. before setting per-user values that may have gone away"""
+
+        self._values.clear()
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for key, value in self._values.items():
+            yield f"{self.name}{_format(key)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, registry: "Metrics", name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self._counts: Dict[LabelKey, List[int]] = {}
+        self._sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels):
+        if not self._registry.enabled:
+            return
+        key = _key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)  # The last bucket is +Inf
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, counts in self._counts.items():
+            yield from render_histogram(self.name, key, self.buckets, counts, self._sums[key])
+
+
+class Span:
+    """Times a block into the stage histogram, counting the blocks that raised"""
+
+    __slots__ = ("_metrics", "_labels", "started", "elapsed")
+
+    def __init__(self, metrics: "Metrics", labels: Dict[str, object]):
+        self._metrics = metrics
+        self._labels = labels
+        self.elapsed = 0.0
+
+    def __enter__(self) -> "Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.started
+        self._metrics.stage_seconds.observe(self.elapsed, **self._labels)
+        if exc_type is not None:
+            self._metrics.stage_errors.inc(**self._labels, error=exc_type.__name__)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+    elapsed = 0.0
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Metrics:
+    """In-process registry of counters, gauges and histograms, rendered in the Prometheus text format.
+
+    When disabled, observations return on their first line and span()
+    hands out a shared no-op context manager, so instrumented code costs
+    next to nothing. Collectors add series kept elsewhere, e.g. the
+    per-host stats of the HTTP transport, at render time.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+        self.stage_seconds = self.histogram("chat_stage_seconds", "Duration of each stage of the chat pipeline")
+        self.stage_errors = self.counter("chat_stage_errors_total", "Stages that raised, by exception type")
+
+    def counter(self, name: str, help: str) -> Counter:
+        if name not in self._metrics:
+            self._metrics[name] = Counter(self, name, help)
+        return self._metrics[name]
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        if name not in self._metrics:
+            self._metrics[name] = Gauge(self, name, help)
+        return self._metrics[name]
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(self, name, help, buckets)
+        return self._metrics[name]
+
+    def collect(self, collector: Callable[[], Iterable[str]]):
+        self._collectors.append(collector)
+
+    def span(self, stage: str, **labels):
+        """with metrics.span("text_to_speech"): ... records the block's duration under the stage"""
+
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, {"stage": stage, **labels})
+
+    def timed(self, stage: str):
+        """Decorator recording every call of a coroutine function under the stage. A no-op when disabled."""
+
+        def decorator(fn):
+            if not self.enabled:
+                return fn
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return await fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def render(self) -> str:
+        lines = [line for metric in self._metrics.values() for line in metric.render()]
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+    def mount(self, app: FastAPI, path: str = "/metrics"):
+        """Serves the metrics on the app. The route goes first, ahead of catch-all routes such as Chainlit's UI."""
+
+        async def endpoint():
+            return PlainTextResponse(self.render(), media_type=CONTENT_TYPE)
+
+        app.add_api_route(path, endpoint, methods=["GET"], include_in_schema=False)
+        app.router.routes.insert(0, app.router.routes.pop())
+
+
+def transport_collector(transport) -> Callable[[], Iterable[str]]:
+    """Exposes the per-host counts and latency histograms a RetryingTransport keeps"""
+
+    def collect() -> Iterable[str]:
+        hosts = list(transport.host_stats().items())
+        for name, attribute, help in (
+            ("http_client_requests_total", "requests", "Outbound HTTP attempts per host"),
+            ("http_client_retries_total", "retries", "Outbound HTTP retries per host"),
+            ("http_client_errors_total", "errors", "Outbound HTTP connection errors per host"),
+        ):
+            yield f"# HELP {name} {help}"
+            yield f"# TYPE {name} counter"
+            for host, stats in hosts:
+                yield f"{name}{_format(_key({'host': host}))} {getattr(stats, attribute)}"
+
+        name = "http_client_response_seconds"
+        yield f"# HELP {name} Time to response headers per host"
+        yield f"# TYPE {name} histogram"
+        for host, stats in hosts:
+            latency = stats.latency
+            bounds = [ms / 1000.0 for ms in latency.buckets]
+            yield from render_histogram(name, _key({"host": host}), bounds, latency.counts, latency.total_ms / 1000.0)
+
+    return collect
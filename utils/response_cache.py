@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation insensitive form of a query"""
+
+    return " ".join(query.casefold().split()).rstrip(" .!?")
+
+
+def stream_chunks(text: str) -> List[str]:
+    """Splits a cached answer into word-sized tokens for streaming"""
+
+    return re.findall(r"\s*\S+", text) or [text]
+
+
+@dataclass
+class ResponseCacheStats:
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    bypassed: int = 0  # Answers not stored because a tool with side effects was called
+
+
+@dataclass
+class _Entry:
+    scope: str
+    text: str
+    expires: float
+    embedding: Optional[np.ndarray]
+
+
+@dataclass
+class CacheLookup:
+    """Result of a lookup, passed back to store() on a miss so the query is not embedded twice"""
+
+    key: str
+    scope: str
+    embedding: Optional[np.ndarray] = None
+    text: Optional[str] = None
+    how: Optional[str] = None  # "exact" or "semantic"
+
+
+class ResponseCache:
+    """Two-tier cache of final agent answers.
+
+    Entries live in a scope, a hash of everything besides the query that
+    shapes the answer: system prompt, model, temperature and tool set
+    version. The exact tier matches normalized queries. The semantic tier
+    matches paraphrases whose embedding has a cosine similarity of at least
+    similarity_threshold with a cached query in the same scope. Entries
+    expire after ttl seconds and the least recently used are evicted beyond
+    max_entries. Set similarity_threshold above 1 to disable the semantic tier.
+    """
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        ttl: float = 3600.0,
+        similarity_threshold: float = 0.95,
+        max_entries: int = 512,
+    ):
+        self.embed_model = embed_model
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.stats = ResponseCacheStats()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    @staticmethod
+    def scope(*parts) -> str:
+        return hashlib.sha256("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry.expires <= now]:
+            del self._entries[key]
+
+    async def lookup(self, query: str, scope: str) -> CacheLookup:
+        self._expire()
+        key = f"{scope}:{normalize_query(query)}"
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.stats.exact_hits += 1
+            return CacheLookup(key, scope, entry.embedding, entry.text, "exact")
+
+        result = CacheLookup(key, scope)
+        if self.similarity_threshold > 1:
+            self.stats.misses += 1
+            return result
+        try:
+            vector = np.asarray(await self.embed_model.aget_query_embedding(query), dtype=np.float32)
+            result.embedding = vector / (np.linalg.norm(vector) or 1.0)
+        except Exception as e:
+            logger.warning(f"Could not embed the query for the response cache: {e}")
+            self.stats.misses += 1
+            return result
+
+        candidates = [
+            (k, e) for k, e in self._entries.items() if e.scope == scope and e.embedding is not None
+        ]
+        if candidates:
+            scores = np.stack([e.embedding for _, e in candidates]) @ result.embedding
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                best_key, best_entry = candidates[best]
+                self._entries.move_to_end(best_key)
+                self.stats.semantic_hits += 1
+                result.text, result.how = best_entry.text, "semantic"
+                return result
+        self.stats.misses += 1
+        return result
+
+    def store(self, lookup: CacheLookup, text: str):
+        if not text:
+            return
+        self._entries[lookup.key] = _Entry(lookup.scope, text, time.monotonic() + self.ttl, lookup.embedding)
+        self._entries.move_to_end(lookup.key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.stats.stores += 1
+
+    def bypass(self, tools: Sequence[str]):
+        """Records an answer that is not stored because it involved tools with side effects"""
+
+        self.stats.bypassed += 1
+        logger.info(f"Not caching an answer that called {', '.join(tools)}")
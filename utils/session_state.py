@@ -0,0 +1,346 @@
+import asyncio
+import atexit
+import functools
+import hmac
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, MutableMapping, Optional
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SessionSlot:
+    """How the manager measures and frees one key of the user session.
+
+    spill is one of:
+    - "disk": dump() the value to the spill directory, load() it back on the next activity
+    - "drop": remove the value, the app recreates it when it needs it again
+    - "shrink": call shrink() on the value, which stays in the session and reloads lazily
+    - "keep": only count its bytes
+
+    size() measures the value on every sweep after the session was active, so
+    it must be cheap. A "disk" slot without size is counted at the length of
+    its last dump instead: 0 until it is first spilled, which idle spilling
+    does regardless of the session's measured bytes.
+
+    A "disk" value that cannot be read back is replaced with rebuild(session),
+    or left out of the session when there is no rebuild.
+
+    close() is awaited with the last value of the key once the session is gone
+    for good, e.g. to release shared connections it holds.
+    """
+
+    key: str
+    size: Optional[Callable[[Any], int]] = None
+    spill: str = "drop"
+    dump: Optional[Callable[[Any], bytes]] = None
+    load: Optional[Callable[[bytes, Dict[str, Any]], Any]] = None  # Gets the session, e.g. to reach its agent
+    shrink: Optional[Callable[[Any], None]] = None
+    rebuild: Optional[Callable[[Dict[str, Any]], Any]] = None  # Fresh value when the spilled one cannot be loaded
+    close: Optional[Callable[[Any], Awaitable[None]]] = None
+
+
+@dataclass
+class SessionRecord:
+    user: Optional[str] = None
+    last_active: float = field(default_factory=time.monotonic)
+    busy: int = 0  # Handlers of the session running right now
+    sizes: Dict[str, int] = field(default_factory=dict)
+    measured: float = 0.0
+    spilled: Dict[str, int] = field(default_factory=dict)  # Bytes of each key written to disk
+    dumped: Dict[str, int] = field(default_factory=dict)  # Bytes of each key's last dump, its size for slots without size()
+    closing: Dict[str, Any] = field(default_factory=dict)  # Values to close() once the session is cleared
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self.sizes.values())
+
+
+class SessionStateManager:
+    """Memory accounting and spill-to-disk of per-session state.
+
+    Every handler wrapped with tracked() marks its session active and first
+    brings back whatever was spilled from it. A background sweep measures
+    the sessions that were active since the last sweep and frees the heavy
+    keys of sessions idle for idle_seconds, then of the least recently active
+    ones while the total is over max_bytes. Sessions with a handler running
+    are never spilled.
+    """
+
+    def __init__(
+        self,
+        sessions: MutableMapping[str, Dict[str, Any]],
+        current_session: Callable[[], str],
+        spill_dir: str,
+        max_bytes: int,
+        idle_seconds: float = 600.0,
+        sweep_interval: float = 60.0,
+    ):
+        self.sessions = sessions
+        self.current_session = current_session
+        # Each process spills into its own directory, so workers sharing spill_dir
+        # (or a restart) never remove the spilled state of another process
+        self.spill_dir = os.path.join(spill_dir, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        self.spills = 0
+        self.rehydrations = 0
+        self._slots: Dict[str, SessionSlot] = {}
+        self._records: "OrderedDict[str, SessionRecord]" = OrderedDict()  # Least recently active first
+        self._sweeper: Optional[asyncio.Task] = None
+        os.makedirs(self.spill_dir, exist_ok=True)
+        # Spilled state does not outlive the process that owned the sessions
+        atexit.register(shutil.rmtree, self.spill_dir, ignore_errors=True)
+
+    def register(self, slot: SessionSlot):
+        if slot.spill == "disk" and (slot.dump is None or slot.load is None):
+            raise ValueError(f"Slot '{slot.key}' spills to disk but has no dump or load")
+        if slot.size is None and slot.spill != "disk":
+            raise ValueError(f"Slot '{slot.key}' has no size, only disk slots are measured from their dumps")
+        if slot.spill == "shrink" and slot.shrink is None:
+            raise ValueError(f"Slot '{slot.key}' shrinks but has no shrink function")
+        self._slots[slot.key] = slot
+
+    def _path(self, session_id: str, key: str) -> str:
+        return os.path.join(self.spill_dir, session_id, f"{key}.bin")
+
+    ## Activity
+    def _touch(self, session_id: str) -> SessionRecord:
+        record = self._records.pop(session_id, None) or SessionRecord()
+        self._records[session_id] = record
+        record.last_active = time.monotonic()
+        user = (self.sessions.get(session_id) or {}).get("user")
+        record.user = getattr(user, "identifier", None) or record.user
+        self._start_sweeper()
+        return record
+
+    async def _rehydrate(self, session_id: str, record: SessionRecord):
+        session = self.sessions.get(session_id)
+        if not record.spilled or session is None:
+            return
+        for key in list(record.spilled):
+            slot, path = self._slots[key], self._path(session_id, key)
+            try:
+                data = await asyncio.to_thread(self._read, path)
+                session[key] = slot.load(data, session)
+            except Exception as e:
+                logger.warning(f"Could not load spilled '{key}' of session {session_id}, rebuilding it: {e}")
+                if slot.rebuild is not None:
+                    session[key] = slot.rebuild(session)
+            del record.spilled[key]
+            await asyncio.to_thread(self._remove, path)
+        self.rehydrations += 1
+
+    def tracked(self, handler):
+        """Decorator for Chainlit handlers: the session's state is in memory while they run"""
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            session_id = self.current_session()
+            record = self._touch(session_id)
+            record.busy += 1
+            try:
+                await self._rehydrate(session_id, record)
+                return await handler(*args, **kwargs)
+            finally:
+                record.busy -= 1
+                record.last_active = time.monotonic()
+                self._hold_closing(session_id, record)
+
+        return wrapper
+
+    def _hold_closing(self, session_id: str, record: SessionRecord):
+        # Kept on the record, the session's values are gone by the time it is cleared
+        session = self.sessions.get(session_id) or {}
+        for key, slot in self._slots.items():
+            if slot.close is not None and session.get(key) is not None:
+                record.closing[key] = session[key]
+
+    async def end(self, session_id: str):
+        """Closes the held values of a session that is gone for good, then forgets it"""
+
+        record = self._records.get(session_id)
+        for key, value in (record.closing if record is not None else {}).items():
+            try:
+                await self._slots[key].close(value)
+            except Exception as e:
+                logger.warning(f"Could not close '{key}' of session {session_id}: {e}")
+        self.forget(session_id)
+
+    def forget(self, session_id: str):
+        """Drops the accounting and spill files of a session that is gone for good.
+        Not for on_chat_end: a disconnected session can still reconnect and resume."""
+
+        self._records.pop(session_id, None)
+        shutil.rmtree(os.path.join(self.spill_dir, session_id), ignore_errors=True)
+
+    ## Accounting
+    def _measure(self, session_id: str, record: SessionRecord):
+        session = self.sessions.get(session_id) or {}
+        for key, slot in self._slots.items():
+            if key in record.spilled:
+                record.sizes[key] = 0
+                continue
+            value = session.get(key)
+            if value is not None and slot.size is None:
+                record.sizes[key] = record.dumped.get(key, 0)
+                continue
+            try:
+                record.sizes[key] = slot.size(value) if value is not None else 0
+            except Exception as e:
+                logger.warning(f"Could not measure '{key}' of session {session_id}: {e}")
+        record.measured = time.monotonic()
+
+    def _unmeasured(self, session_id: str) -> bool:
+        """Whether the session holds a value of a slot only measured when it is spilled"""
+
+        session = self.sessions.get(session_id) or {}
+        return any(slot.size is None and session.get(key) is not None for key, slot in self._slots.items())
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(record.nbytes for record in self._records.values())
+
+    ## Spilling
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    async def spill(self, session_id: str) -> int:
+        """Frees the heavy keys of a session and returns the bytes released"""
+
+        record = self._records.get(session_id)
+        session = self.sessions.get(session_id)
+        if record is None or session is None or record.busy:
+            return 0
+        released = 0
+        for key, slot in self._slots.items():
+            value = session.get(key)
+            if value is None or slot.spill == "keep":
+                continue
+            try:
+                if slot.spill == "disk":
+                    data = slot.dump(value)
+                    await asyncio.to_thread(self._write, self._path(session_id, key), data)
+                    if record.busy or session.get(key) is not value:
+                        continue  # The session woke up while writing, keep what it is using
+                    del session[key]
+                    record.spilled[key] = record.dumped[key] = len(data)
+                    if slot.size is None:
+                        record.sizes[key] = len(data)
+                elif slot.spill == "drop":
+                    del session[key]
+                else:
+                    slot.shrink(value)
+            except Exception as e:
+                logger.warning(f"Could not spill '{key}' of session {session_id}: {e}")
+                continue
+            released += record.sizes.get(key, 0)
+        self._measure(session_id, record)
+        if released:
+            self.spills += 1
+            logger.info(f"Spilled {released / 1024:.0f}KB of idle session {session_id}")
+        return released
+
+    async def sweep(self):
+        """Measures recently active sessions, then spills the idle ones and the least recent over the ceiling"""
+
+        for session_id in [s for s in self._records if s not in self.sessions]:
+            await self.end(session_id)  # Cleared by Chainlit, e.g. after session_timeout
+        for session_id, record in list(self._records.items()):
+            if record.measured <= record.last_active:
+                self._measure(session_id, record)
+
+        now = time.monotonic()
+        for session_id, record in list(self._records.items()):
+            if now - record.last_active >= self.idle_seconds and (record.nbytes or self._unmeasured(session_id)):
+                await self.spill(session_id)
+        for session_id, record in list(self._records.items()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            # Sessions active since the last sweep are mid-conversation, e.g. between audio chunks
+            if record.nbytes and now - record.last_active >= self.sweep_interval:
+                await self.spill(session_id)
+
+    def _start_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_forever())
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Session sweep failed")
+
+    ## Reporting
+    def report(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        sessions: List[Dict[str, Any]] = [
+            {
+                "session_id": session_id,
+                "user": record.user,
+                "bytes": record.nbytes,
+                "keys": dict(record.sizes),
+                "spilled_bytes": sum(record.spilled.values()),
+                "idle_seconds": round(now - record.last_active, 1),
+                "busy": record.busy > 0,
+            }
+            for session_id, record in reversed(self._records.items())
+        ]
+        return {
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "sessions": sessions,
+            "spills": self.spills,
+            "rehydrations": self.rehydrations,
+        }
+
+    def collect(self) -> Iterable[str]:
+        """Metrics collector with the totals of report()"""
+
+        for name, kind, value, help in (
+            ("session_state_bytes", "gauge", self.total_bytes, "Approximate bytes held by all sessions"),
+            ("session_state_sessions", "gauge", len(self._records), "Sessions tracked"),
+            ("session_state_spills_total", "counter", self.spills, "Idle sessions spilled"),
+            ("session_state_rehydrations_total", "counter", self.rehydrations, "Spilled sessions brought back"),
+        ):
+            yield f"# HELP {name} {help}"
+            yield f"# TYPE {name} {kind}"
+            yield f"{name} {value}"
+
+    def mount(self, app: FastAPI, token: str, path: str = "/admin/sessions"):
+        """Serves report() as JSON to requests bearing the admin token. The route goes first, like the metrics."""
+
+        async def endpoint(authorization: Optional[str] = Header(default=None)):
+            if not authorization or not hmac.compare_digest(authorization, f"Bearer {token}"):
+                raise HTTPException(status_code=401, detail="Invalid admin token")
+            return JSONResponse(self.report())
+
+        app.add_api_route(path, endpoint, methods=["GET"], include_in_schema=False)
+        app.router.routes.insert(0, app.router.routes.pop())
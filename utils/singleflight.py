@@ -0,0 +1,67 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one call in flight.
+
+    The first caller leads the call and the others wait for its result or
+    exception. A leader that is cancelled, e.g. because its session was
+    stopped, does not cancel its followers: one of them leads the call again.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def wait(self, key: Hashable) -> Tuple[bool, Any]:
+        """Waits for the call in flight for key: (True, result), or (False, None) once the caller should lead it"""
+
+        while (future := self._inflight.get(key)) is not None:
+            try:
+                return True, await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # This caller was cancelled
+                # Its leader was stopped, which must not stop this caller
+        return False, None
+
+    @asynccontextmanager
+    async def lead(self, key: Hashable) -> AsyncIterator[asyncio.Future]:
+        """Leads the call for key; set the result on the future it yields.
+
+        Must be entered right after wait() returned False, with no await in
+        between, so that no other caller leads the same key.
+        """
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            yield future
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+                future.exception()  # Mark as retrieved when nobody else was waiting
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()  # Left without a result: followers lead it again
+            del self._inflight[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Returns the result of fn(), called once for all concurrent callers with the same key"""
+
+        found, result = await self.wait(key)
+        if found:
+            return result
+        async with self.lead(key) as future:
+            result = await fn()
+            future.set_result(result)
+            return result
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import re
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# End of a sentence: terminal punctuation, optional closing quotes/brackets, then whitespace. Or a line break.
+_SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s+|\n+")
+
+
+class SentenceSplitter:
+    """Splits streamed text deltas into sentences as soon as they are complete.
+
+    Sentences shorter than min_chars are joined with the next one, which
+    avoids splitting on abbreviations such as "e.g." and avoids sending tiny
+    synthesis requests.
+    """
+
+    def __init__(self, min_chars: int = 20):
+        self.min_chars = min_chars
+        self._text = ""
+
+    def feed(self, delta: str) -> List[str]:
+        """Adds a delta and returns the sentences it completed"""
+
+        self._text += delta
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._text):
+            sentence = self._text[start : match.end()].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = match.end()
+        self._text = self._text[start:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """Returns whatever text is left once the stream is over"""
+
+        text, self._text = self._text.strip(), ""
+        return text or None
+
+
+class SpeechPipeline:
+    """Synthesizes sentences concurrently and plays them back in order.
+
+    Each added sentence starts synthesizing right away, up to
+    max_concurrency at a time, while the LLM is still generating the next
+    ones. A single player forwards the audio chunks of each sentence to
+    send() as they arrive, in sentence order, so playback starts as soon as
+    the first sentence's first chunk is back.
+
+    synthesize(text) must be an async iterator of 16-bit PCM chunks.
+    """
+
+    def __init__(
+        self,
+        synthesize: Callable[[str], AsyncIterator[bytes]],
+        send: Callable[[bytes], Awaitable[None]],
+        max_concurrency: int = 3,
+    ):
+        self.synthesize = synthesize
+        self.send = send
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queue: asyncio.Queue = asyncio.Queue()  # Per-sentence chunk queues, in order
+        self._tasks: List[asyncio.Task] = []
+        self._player = asyncio.create_task(self._play())
+        self._started = time.perf_counter()
+        self._chunks: List[bytes] = []
+        self.time_to_first_audio: Optional[float] = None
+
+    def add(self, sentence: Optional[str]):
+        """Starts synthesizing a sentence"""
+
+        if not sentence:
+            return
+        chunks: asyncio.Queue = asyncio.Queue()
+        self._queue.put_nowait(chunks)
+        self._tasks.append(asyncio.create_task(self._synthesize(sentence, chunks)))
+
+    async def _synthesize(self, sentence: str, chunks: asyncio.Queue):
+        try:
+            async with self._semaphore:
+                async for chunk in self.synthesize(sentence):
+                    chunks.put_nowait(chunk)
+        except Exception as e:
+            logger.warning(f"Could not synthesize '{sentence[:40]}': {e}")
+        finally:
+            chunks.put_nowait(None)
+
+    async def _play(self):
+        carry = b""  # A chunk can end in the middle of a sample
+        while (chunks := await self._queue.get()) is not None:
+            while (chunk := await chunks.get()) is not None:
+                chunk, carry = carry + chunk, b""
+                if len(chunk) % 2:
+                    chunk, carry = chunk[:-1], chunk[-1:]
+                if not chunk:
+                    continue
+                if self.time_to_first_audio is None:
+                    self.time_to_first_audio = time.perf_counter() - self._started
+                self._chunks.append(chunk)
+                await self.send(chunk)
+            carry = b""
+
+    async def finish(self) -> bytes:
+        """Waits until every sentence has been played and returns the whole reply's PCM"""
+
+        self._queue.put_nowait(None)
+        await self._player
+        if self.time_to_first_audio is not None:
+            logger.info(f"First audio {self.time_to_first_audio:.2f}s after the reply started")
+        return b"".join(self._chunks)
+
+    def cancel(self) -> int:
+        """Stops synthesis and playback. Returns the number of sentences whose synthesis was cut short."""
+
+        unfinished = sum(not task.done() for task in self._tasks)
+        for task in [*self._tasks, self._player]:
+            task.cancel()
+        return unfinished
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCoalescer:
+    """Merges streamed deltas into fewer, larger emits to the client.
+
+    Deltas are buffered and sent as one token once the buffer holds
+    max_bytes, or delay seconds after its first delta. The delay adapts to
+    backpressure, between min_delay and max_delay: it follows
+    backpressure_factor times the moving average of how long an emit is
+    awaited, or of how late the flush timer fires when the event loop is
+    saturated, whichever is larger. A backed-up socket or an overloaded
+    worker thus gets fewer, bigger chunks. flush() sends the buffer at once, e.g.
+    before a tool call is shown or when the run stops. Used as an async
+    context manager, whatever is buffered is flushed on exit, including
+    when the stream is cancelled.
+
+        async with TokenCoalescer(msg.stream_token) as stream:
+            async for event in handler.stream_events():
+                await stream.add(event.delta)
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        min_delay: float = 0.05,
+        max_delay: float = 0.25,
+        max_bytes: int = 1024,
+        backpressure_factor: float = 4.0,
+    ):
+        self.send = send
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.backpressure_factor = backpressure_factor
+        self.delay = min_delay
+        self.deltas = 0
+        self.emits = 0
+        self._parts: List[str] = []
+        self._bytes = 0
+        self._emit_seconds = 0.0  # Moving averages of the time an emit is awaited
+        self._lag_seconds = 0.0  # and of the lateness of the flush timer
+        self._lock = asyncio.Lock()  # Keeps emits in order
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "TokenCoalescer":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.flush()
+        return False
+
+    async def add(self, delta: Optional[str]):
+        if not delta:
+            return
+        self.deltas += 1
+        self._parts.append(delta)
+        self._bytes += len(delta.encode())
+        if self._bytes >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.delay
+            self._timer = loop.call_at(deadline, self._on_timer, loop, deadline)
+
+    def _on_timer(self, loop: asyncio.AbstractEventLoop, deadline: float):
+        self._timer = None
+        self._lag_seconds += 0.2 * (loop.time() - deadline - self._lag_seconds)
+        self._flusher = asyncio.create_task(self.flush())
+        self._flusher.add_done_callback(self._flushed)
+
+    @staticmethod
+    def _flushed(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Could not stream tokens: {task.exception()}")
+
+    async def flush(self):
+        """Sends the buffered deltas now"""
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            if not self._parts:
+                return
+            text = "".join(self._parts)
+            self._parts, self._bytes = [], 0
+            started = time.perf_counter()
+            await self.send(text)
+            self.emits += 1
+            self._emit_seconds += 0.2 * (time.perf_counter() - started - self._emit_seconds)
+            # Slow emits or late timers mean the client or the worker is behind: wait longer, send bigger chunks
+            pressure = max(self._emit_seconds, self._lag_seconds)
+            self.delay = min(self.max_delay, max(self.min_delay, self.backpressure_factor * pressure))
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Coroutine, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# The turn, i.e. guarded handler run, that the current task belongs to. Tasks inherit it when spawned.
+_turn: ContextVar[Optional[object]] = ContextVar("task_scope_turn", default=None)
+
+
+class TaskScope:
+    """The in-flight work of one chat session's turns, stopped together.
+
+    A turn is a handler guarded while it runs, e.g. a message or a voice turn,
+    and background tasks belong to the turn that spawned them. cancel() cancels
+    the turns still running and their tasks, plus whatever the on_cancel
+    callbacks stop, e.g. the segments of a streaming transcription, and then
+    waits up to cleanup_timeout for the tasks to run their except and finally
+    blocks. Tasks that outlive their turn, e.g. the ingestion of an earlier
+    upload, are left running. Cancellation is cooperative: each task cleans
+    up after itself as the CancelledError unwinds it, e.g. by cancelling its
+    workflow run.
+    """
+
+    def __init__(self, cleanup_timeout: float = 5.0):
+        self.cleanup_timeout = cleanup_timeout
+        self._tasks: Dict[asyncio.Task, Tuple[str, Optional[object]]] = {}  # Kind and turn of each task
+        self._turns: Set[object] = set()  # Turns still running
+        self._callbacks: Dict[str, Callable[[], Optional[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def spawn(self, coro: Coroutine, kind: str) -> asyncio.Task:
+        """Starts a background task that is cancelled with the turn spawning it"""
+
+        task = asyncio.create_task(coro)
+        self._tasks[task] = (kind, _turn.get())
+        task.add_done_callback(lambda task: self._tasks.pop(task, None))
+        return task
+
+    @contextmanager
+    def guard(self, kind: str):
+        """Runs the block as a turn: the current task and the tasks it spawns are cancelled with the scope"""
+
+        turn = object()
+        token = _turn.set(turn)
+        task = asyncio.current_task()
+        self._tasks[task] = (kind, turn)
+        self._turns.add(turn)
+        try:
+            yield
+        finally:
+            self._turns.discard(turn)
+            self._tasks.pop(task, None)
+            _turn.reset(token)
+
+    def on_cancel(self, kind: str, callback: Callable[[], Optional[int]]) -> Callable[[], None]:
+        """Registers what to call on every cancel for work that is not a task, replacing the previous callback of
+        the kind. The callback returns how many units of work it stopped. Returns a function unregistering it."""
+
+        self._callbacks[kind] = callback
+
+        def unregister():
+            if self._callbacks.get(kind) is callback:
+                del self._callbacks[kind]
+
+        return unregister
+
+    async def cancel(self) -> Counter:
+        """Cancels the running turns and returns how much work of each kind was stopped"""
+
+        started = time.perf_counter()
+        stopped: Counter = Counter()
+        for kind, callback in list(self._callbacks.items()):
+            try:
+                stopped[kind] += callback() or 0
+            except Exception as e:
+                logger.warning(f"Could not cancel {kind}: {e}")
+
+        current = asyncio.current_task()
+        tasks = {
+            task: kind
+            for task, (kind, turn) in self._tasks.items()
+            if turn in self._turns and task is not current and not task.done()
+        }
+        for task in tasks:
+            if not task.cancelling():  # Chainlit cancels the message task itself before on_stop
+                task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.cleanup_timeout)
+            for task in pending:
+                logger.warning(f"{tasks[task]} still running {self.cleanup_timeout}s after being cancelled")
+        stopped.update(tasks.values())
+        stopped = +stopped  # Drops the kinds with nothing to stop
+        if stopped:
+            logger.info(f"Cancelled {dict(stopped)} in {time.perf_counter() - started:.2f}s")
+        return stopped
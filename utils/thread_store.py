@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Tuple
+
+
+@dataclass
+class DocumentToolRecord:
+    """What is needed to rebuild a document QueryEngineTool of a thread"""
+
+    index_key: str
+    name: str
+    description: str
+
+
+class ThreadStore:
+    """SQLite store of per-thread state that must survive a chat resume:
+    document tools and the conversation summary"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS thread_tools ("
+                "thread_id TEXT, name TEXT, index_key TEXT, description TEXT, created REAL, "
+                "PRIMARY KEY (thread_id, name))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS thread_summaries "
+                "(thread_id TEXT PRIMARY KEY, summary TEXT, updated REAL, summarized INTEGER DEFAULT 0)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(thread_summaries)")]
+            if "summarized" not in columns:
+                # Stores created before the count: their summaries are treated as covering nothing
+                self._db.execute("ALTER TABLE thread_summaries ADD COLUMN summarized INTEGER DEFAULT 0")
+
+    def save_tool(self, thread_id: str, record: DocumentToolRecord):
+        """Records a document tool against a thread, replacing one of the same name"""
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO thread_tools VALUES (?, ?, ?, ?, ?)",
+                (thread_id, record.name, record.index_key, record.description, time.time()),
+            )
+
+    def rename_tool(self, thread_id: str, old_name: str, record: DocumentToolRecord):
+        """Replaces a thread's document tool, keeping its original position"""
+
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE OR REPLACE thread_tools SET name = ?, index_key = ?, description = ? "
+                "WHERE thread_id = ? AND name = ?",
+                (record.name, record.index_key, record.description, thread_id, old_name),
+            )
+
+    def load_tools(self, thread_id: str) -> List[DocumentToolRecord]:
+        """Returns the document tools of a thread in the order they were created"""
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT index_key, name, description FROM thread_tools "
+                "WHERE thread_id = ? ORDER BY created",
+                (thread_id,),
+            ).fetchall()
+        return [DocumentToolRecord(*row) for row in rows]
+
+    def save_summary(self, thread_id: str, summary: str, summarized: int):
+        """Stores the running conversation summary of a thread and how many of its first messages it covers"""
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO thread_summaries (thread_id, summary, updated, summarized) "
+                "VALUES (?, ?, ?, ?)",
+                (thread_id, summary, time.time(), summarized),
+            )
+
+    def load_summary(self, thread_id: str) -> Tuple[str, int]:
+        """Returns the summary of a thread and how many of its first messages it covers"""
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT summary, summarized FROM thread_summaries WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+        return (row[0], row[1] or 0) if row else ("", 0)
+
+    def delete_thread(self, thread_id: str):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM thread_tools WHERE thread_id = ?", (thread_id,))
+            self._db.execute("DELETE FROM thread_summaries WHERE thread_id = ?", (thread_id,))
@@ -0,0 +1,133 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from llama_index.core.tools import BaseTool, ToolOutput
+from llama_index.core.tools.types import AsyncBaseTool, ToolMetadata, adapt_to_async_tool
+
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Name tokens of tools that change state. These are never cached, even if allowlisted.
+WRITE_VERBS = {
+    "add", "archive", "assign", "batch", "close", "comment", "create", "delete", "download",
+    "edit", "link", "move", "post", "put", "remove", "reopen", "set", "transition", "update",
+    "upload",
+}
+
+
+def is_write_tool(name: str) -> bool:
+    return any(token in WRITE_VERBS for token in name.lower().split("_"))
+
+
+def parse_ttls(spec: str) -> Dict[str, float]:
+    """Parses 'tool_a=60,tool_b=300' into per-tool TTLs in seconds"""
+
+    ttls = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, ttl = item.partition("=")
+        ttls[name.strip()] = float(ttl or 60)
+    return ttls
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+@dataclass
+class ToolCacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    bypassed: int = 0
+
+
+class ToolResponseCache:
+    """Process-wide cache of read-only tool results.
+
+    Only allowlisted tools are cached, each with its own TTL, and tools whose
+    name contains a write verb always bypass the cache. Keys are the tool name
+    plus the whitespace-normalized, key-sorted arguments. Concurrent identical
+    calls share a single in-flight request.
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int = 1024):
+        self.ttls = {name: ttl for name, ttl in ttls.items() if not is_write_tool(name)}
+        self.max_entries = max_entries
+        self.stats = ToolCacheStats()
+        self._entries: "OrderedDict[str, Tuple[float, ToolOutput]]" = OrderedDict()
+        self._flights = SingleFlight()
+
+    def is_cacheable(self, name: str) -> bool:
+        return name in self.ttls
+
+    @staticmethod
+    def key(name: str, arguments: Dict[str, Any]) -> str:
+        return f"{name}:{json.dumps(_normalize(arguments), sort_keys=True, default=str)}"
+
+    async def call(
+        self, name: str, arguments: Dict[str, Any], fn: Callable[[], Awaitable[ToolOutput]]
+    ) -> ToolOutput:
+        """Returns the cached result of a call, or makes it once for all concurrent callers"""
+
+        key = self.key(name, arguments)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[1]
+
+        if key in self._flights:
+            self.stats.coalesced += 1
+        else:
+            self.stats.misses += 1
+        return await self._flights.do(key, lambda: self._call(key, name, fn))
+
+    async def _call(self, key: str, name: str, fn: Callable[[], Awaitable[ToolOutput]]) -> ToolOutput:
+        output = await fn()
+        if not output.is_error:
+            self._entries[key] = (time.monotonic() + self.ttls[name], output)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return output
+
+    def wrap(self, tool: BaseTool) -> BaseTool:
+        """Wraps an allowlisted tool so its async calls go through the cache"""
+
+        if not self.is_cacheable(tool.metadata.name):
+            return tool
+        return CachedTool(tool, self)
+
+
+class CachedTool(AsyncBaseTool):
+    """Tool whose async calls are answered from a ToolResponseCache"""
+
+    def __init__(self, tool: BaseTool, cache: ToolResponseCache):
+        self._tool = adapt_to_async_tool(tool)
+        self._cache = cache
+
+    @property
+    def metadata(self) -> ToolMetadata:
+        return self._tool.metadata
+
+    def call(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        return self._tool.call(*args, **kwargs)
+
+    async def acall(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        if args:
+            self._cache.stats.bypassed += 1
+            return await self._tool.acall(*args, **kwargs)
+        return await self._cache.call(
+            self.metadata.name, kwargs, lambda: self._tool.acall(**kwargs)
+        )
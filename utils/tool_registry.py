@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+from dataclasses import dataclass, fields
+from typing import Dict, Iterable, List, Optional
+
+from llama_index.core.agent.workflow import FunctionAgent
+from llama_index.core.tools import BaseTool
+from llama_index.core.tools.types import ToolMetadata
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CachedToolMetadata(ToolMetadata):
+    """ToolMetadata that only derives its JSON schema from fn_schema once.
+
+    Name and description stay mutable, they are cheap and are read on every call.
+    """
+
+    def get_parameters_dict(self) -> dict:
+        parameters = self.__dict__.get("_parameters")
+        if parameters is None:
+            parameters = self.__dict__["_parameters"] = super().get_parameters_dict()
+        # Shallow copy, LLM integrations may add top-level keys such as additionalProperties
+        return dict(parameters)
+
+
+def cache_tool_schema(tool: BaseTool) -> BaseTool:
+    """Swaps a tool's metadata for one that caches its JSON schema"""
+
+    metadata = getattr(tool, "_metadata", None)
+    if isinstance(metadata, ToolMetadata) and not isinstance(metadata, CachedToolMetadata):
+        tool._metadata = CachedToolMetadata(
+            **{f.name: getattr(metadata, f.name) for f in fields(metadata)}
+        )
+    return tool
+
+
+class ToolRegistry:
+    """Versioned, per-session set of agent tools.
+
+    Tools are added and removed in named groups (e.g. one group per MCP server)
+    and applied to an existing FunctionAgent in place, so the agent's workflow
+    Context survives tool changes. Every change bumps the version.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._tools: Dict[str, BaseTool] = {}
+        self._groups: Dict[str, List[str]] = {}
+        self._fingerprint: Optional[str] = None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def _changed(self):
+        self.version += 1
+        self._fingerprint = None
+
+    def group_of(self, name: str) -> Optional[str]:
+        return next((group for group, names in self._groups.items() if name in names), None)
+
+    def add(self, tools: Iterable[BaseTool], group: str) -> List[BaseTool]:
+        """Adds tools to a group. A tool named like one of the same group replaces it in place,
+        names registered by another group are skipped. Returns the tools that were added."""
+
+        added = []
+        for tool in tools:
+            name = tool.metadata.name
+            if name in self._tools:
+                owner = self.group_of(name)
+                if owner != group:
+                    logger.warning(f"Tool '{name}' of group '{group}' is already registered by '{owner}', skipping it")
+                    continue
+                logger.info(f"Replacing tool '{name}' of group '{group}'")
+            else:
+                self._groups.setdefault(group, []).append(name)
+            self._tools[name] = cache_tool_schema(tool)
+            added.append(tool)
+        if added:
+            self._changed()
+        return added
+
+    def remove_group(self, group: str) -> List[BaseTool]:
+        """Removes every tool of a group and returns them"""
+
+        removed = [self._tools.pop(name) for name in self._groups.pop(group, []) if name in self._tools]
+        if removed:
+            self._changed()
+        return removed
+
+    def unique_name(self, name: str) -> str:
+        """The name, suffixed with _2, _3... while another tool is registered under it"""
+
+        candidate, n = name, 1
+        while candidate in self._tools:
+            n += 1
+            suffix = f"_{n}"
+            candidate = f"{name[:64 - len(suffix)]}{suffix}"  # Tool names are at most 64 characters
+        return candidate
+
+    def rename(self, old_name: str, tool: BaseTool) -> bool:
+        """Re-keys a tool whose metadata was changed in place. A new name that is already
+        taken is suffixed, and the tool's metadata updated with it.
+        Returns False if the tool is no longer registered, e.g. it was replaced."""
+
+        if self._tools.get(old_name) is not tool:
+            return False
+        del self._tools[old_name]
+        name = self.unique_name(tool.metadata.name)
+        if name != tool.metadata.name:
+            logger.info(f"Tool '{tool.metadata.name}' is already registered, renaming '{old_name}' to '{name}'")
+            tool.metadata.name = name
+        self._tools[name] = tool
+        for names in self._groups.values():
+            if old_name in names:
+                names[names.index(old_name)] = name
+        self._changed()
+        return True
+
+    def get(self, name: str) -> Optional[BaseTool]:
+        return self._tools.get(name)
+
+    def group(self, group: str) -> List[BaseTool]:
+        return [self._tools[name] for name in self._groups.get(group, [])]
+
+    def groups(self) -> Dict[str, List[str]]:
+        return {group: list(names) for group, names in self._groups.items()}
+
+    def tools(self) -> List[BaseTool]:
+        return list(self._tools.values())
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the registered tool schemas. Equal for equal tool sets across sessions."""
+
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for name in sorted(self._tools):
+                schema = self._tools[name].metadata.to_openai_tool(skip_length_check=True)
+                digest.update(json.dumps(schema, sort_keys=True).encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def apply(self, agent: FunctionAgent):
+        """Swaps the agent's tools for the registered ones without rebuilding it"""
+
+        agent.tools = self.tools()
@@ -0,0 +1,75 @@
+import hashlib
+import logging
+from typing import Dict, List, Sequence
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.tools import BaseTool
+
+logger = logging.getLogger(__name__)
+
+
+class ToolSelector:
+    """Picks the top-k tools most relevant to a query by embedding similarity.
+
+    Tool descriptions are embedded once and cached process-wide, keyed by the
+    tool's name and description, so sessions connected to the same MCP server
+    share them. With top_k <= 0, few enough tools, or a failing embedding
+    backend, every tool is exposed.
+    """
+
+    def __init__(self, embed_model: BaseEmbedding, top_k: int):
+        self.embed_model = embed_model
+        self.top_k = top_k
+        self._embeddings: Dict[str, np.ndarray] = {}
+
+    @staticmethod
+    def _tool_text(tool: BaseTool) -> str:
+        return f"{tool.metadata.name}: {tool.metadata.description}"
+
+    @classmethod
+    def _tool_key(cls, tool: BaseTool) -> str:
+        return hashlib.sha256(cls._tool_text(tool).encode()).hexdigest()
+
+    async def warm(self, tools: Sequence[BaseTool]):
+        """Embeds the descriptions of tools not seen before"""
+
+        missing = {self._tool_key(t): self._tool_text(t) for t in tools}
+        missing = {k: text for k, text in missing.items() if k not in self._embeddings}
+        if not missing:
+            return
+        try:
+            embeddings = await self.embed_model.aget_text_embedding_batch(list(missing.values()))
+        except Exception as e:
+            logger.warning(f"Could not embed {len(missing)} tool descriptions: {e}")
+            return
+        for key, embedding in zip(missing, embeddings):
+            vector = np.asarray(embedding, dtype=np.float32)
+            self._embeddings[key] = vector / (np.linalg.norm(vector) or 1.0)
+
+    async def select(
+        self, query: str, candidates: Sequence[BaseTool], pinned: Sequence[BaseTool] = ()
+    ) -> List[BaseTool]:
+        """Returns the pinned tools plus the top_k candidates most similar to the query"""
+
+        if self.top_k <= 0 or len(candidates) <= self.top_k:
+            return [*pinned, *candidates]
+        await self.warm(candidates)
+        vectors = [self._embeddings.get(self._tool_key(t)) for t in candidates]
+        try:
+            if any(vector is None for vector in vectors):
+                raise ValueError("tool descriptions are not embedded")
+            query_vector = np.asarray(
+                await self.embed_model.aget_query_embedding(query), dtype=np.float32
+            )
+        except Exception as e:
+            logger.warning(f"Tool selection failed, exposing all tools: {e}")
+            return [*pinned, *candidates]
+
+        matrix = np.stack(vectors)
+        scores = matrix @ query_vector
+        top = np.argpartition(-scores, self.top_k - 1)[: self.top_k]
+        top = top[np.argsort(-scores[top])]
+        selected = [candidates[i] for i in top]
+        logger.info(f"Selected tools: {[t.metadata.name for t in selected]}")
+        return [*pinned, *selected]
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional, Protocol, runtime_checkable
+
+from openai import AsyncOpenAI
+
+from utils.audio import PCMRingBuffer
+
+logger = logging.getLogger(__name__)
+
+
+@runtime_checkable
+class Transcriber(Protocol):
+    """Speech-to-text backend. Anything with this method can be plugged in, e.g. a local model or a fake in tests."""
+
+    async def transcribe(self, wav: bytes) -> str: ...
+
+
+class WhisperTranscriber:
+    """Transcribes WAV audio with the OpenAI transcription API"""
+
+    def __init__(self, client: AsyncOpenAI, model: str = "whisper-1", language: Optional[str] = "en"):
+        self.client = client
+        self.model = model
+        self.language = language
+
+    async def transcribe(self, wav: bytes) -> str:
+        kwargs = {"language": self.language} if self.language else {}
+        response = await self.client.audio.transcriptions.create(
+            model=self.model, file=("audio.wav", wav, "audio/wav"), **kwargs
+        )
+        return response.text
+
+
+def stitch(parts: List[str]) -> str:
+    """Joins segment transcripts into one text"""
+
+    return " ".join(part.strip() for part in parts if part and part.strip())
+
+
+class StreamingTranscription:
+    """Transcribes a turn segment by segment while the user is still talking.
+
+    The VAD reports each stretch of speech as it is closed by a pause.
+    Consecutive stretches are merged until they are at least
+    min_segment_seconds long, so that the model gets enough context, and the
+    segment is then cut out of the ring buffer with some padding and sent
+    to the transcriber in the background. finish() sends whatever is left
+    and stitches the texts together in order, so by the time the end of the
+    turn is detected most of it is already transcribed.
+    """
+
+    def __init__(
+        self,
+        transcriber: Transcriber,
+        buffer: PCMRingBuffer,
+        min_segment_seconds: float = 2.0,
+        padding_ms: float = 200.0,
+        max_concurrency: int = 3,
+    ):
+        self.transcriber = transcriber
+        self.buffer = buffer
+        self.min_segment_samples = int(buffer.sample_rate * min_segment_seconds)
+        self.padding = int(buffer.sample_rate * padding_ms / 1000)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: List[asyncio.Task] = []
+        self._pending: Optional[List[int]] = None  # [start, end] of speech not yet sent
+
+    def add_segment(self, start: int, end: int):
+        """Records a closed stretch of speech, sending it once it is long enough"""
+
+        if self._pending is None:
+            self._pending = [start, end]
+        else:
+            self._pending[1] = end
+        if self._pending[1] - self._pending[0] >= self.min_segment_samples:
+            self.flush()
+
+    def flush(self):
+        """Sends the speech not yet transcribed, copying it out of the ring buffer"""
+
+        if self._pending is None:
+            return
+        start, end = self._pending
+        self._pending = None
+        # The samples are copied now, before the ring buffer can overwrite them
+        wav = self.buffer.wav_bytes(start - self.padding, end + self.padding)
+        self._tasks.append(asyncio.create_task(self._transcribe(wav, (end - start) / self.buffer.sample_rate)))
+
+    async def _transcribe(self, wav: bytes, seconds: float) -> str:
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                text = await self.transcriber.transcribe(wav)
+            except Exception as e:
+                logger.warning(f"Could not transcribe a {seconds:.1f}s segment: {e}")
+                return ""
+            logger.info(f"Transcribed a {seconds:.1f}s segment in {time.perf_counter() - started:.2f}s")
+            return text
+
+    async def finish(self) -> str:
+        """Sends the remaining speech and returns the stitched text of the turn"""
+
+        self.flush()
+        tasks, self._tasks = self._tasks, []
+        return stitch(await asyncio.gather(*tasks))
+
+    def cancel(self) -> int:
+        """Drops the turn, cancelling transcriptions in flight. Returns the number of segments not transcribed."""
+
+        unfinished = sum(not task.done() for task in self._tasks) + (self._pending is not None)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._pending = None
+        return unfinished
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TTSCacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0  # Requests that waited on an identical synthesis in flight
+
+
+class TTSCache:
+    """Two-tier cache of synthesized speech with single-flight synthesis.
+
+    Audio is keyed on the normalized text and everything that changes how it
+    sounds: voice, model, voice settings and output format. Recent audio is
+    kept in an in-memory LRU bounded by memory_max_bytes and every synthesis
+    is also written to cache_dir, bounded by disk_max_bytes and evicted least
+    recently used first. Concurrent requests for the same key share one
+    synthesis.
+    """
+
+    def __init__(self, cache_dir: str, memory_max_bytes: int = 32 * 1024**2, disk_max_bytes: int = 512 * 1024**2):
+        self.cache_dir = cache_dir
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.stats = TTSCacheStats()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._flights = SingleFlight()
+
+        # Disk entries by least recently used, rebuilt from the file times that reads bump
+        os.makedirs(cache_dir, exist_ok=True)
+        entries = sorted(
+            (entry for entry in os.scandir(cache_dir) if entry.name.endswith(".audio")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self._disk: "OrderedDict[str, int]" = OrderedDict(
+            (entry.name[: -len(".audio")], entry.stat().st_size) for entry in entries
+        )
+        self._disk_bytes = sum(self._disk.values())
+
+    @staticmethod
+    def key(text: str, voice_id: str, model_id: str, voice_settings: Dict[str, Any], output_format: str) -> str:
+        payload = {
+            "text": " ".join(text.split()),
+            "voice_id": voice_id,
+            "model_id": model_id,
+            "voice_settings": voice_settings,
+            "output_format": output_format,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.audio")
+
+    def _remember(self, key: str, audio: bytes):
+        if len(audio) > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path)  # Marks it recently used for the eviction order after a restart
+            return audio
+        except OSError:
+            return None
+
+    def _write(self, key: str, audio: bytes):
+        path = self._path(key)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(audio)
+        os.replace(tmp, path)
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    async def _store(self, key: str, audio: bytes):
+        self._remember(key, audio)
+        try:
+            await asyncio.to_thread(self._write, key, audio)
+        except OSError as e:
+            logger.warning(f"Could not write synthesized audio to the cache: {e}")
+            return
+
+        self._disk_bytes += len(audio) - self._disk.pop(key, 0)
+        self._disk[key] = len(audio)
+        evicted = []
+        while self._disk_bytes > self.disk_max_bytes and len(self._disk) > 1:
+            evicted_key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(evicted_key)
+        if evicted:
+            await asyncio.to_thread(self._remove, evicted)
+
+    async def _lookup(self, key: str) -> Optional[bytes]:
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+            self.stats.memory_hits += 1
+            return audio
+        if key in self._disk:
+            audio = await asyncio.to_thread(self._read, key)
+            if audio is not None:
+                self._disk.move_to_end(key)
+                self._remember(key, audio)
+                self.stats.disk_hits += 1
+                return audio
+            self._disk_bytes -= self._disk.pop(key)
+        return None
+
+    async def stream(self, key: str, synthesize: Callable[[], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+        """Yields the cached audio in one chunk, or the synthesized chunks as they arrive while caching them"""
+
+        audio = await self._lookup(key)
+        if audio is not None:
+            yield audio
+            return
+
+        if key in self._flights:
+            self.stats.coalesced += 1
+        found, audio = await self._flights.wait(key)
+        if found:
+            yield audio
+            return
+
+        self.stats.misses += 1
+        async with self._flights.lead(key) as future:
+            # Cancelled, or the consumer stopping before the end, lets a follower synthesize it again
+            chunks = []
+            async for chunk in synthesize():
+                chunks.append(chunk)
+                yield chunk
+            audio = b"".join(chunks)
+            future.set_result(audio)
+            await self._store(key, audio)
+
+    async def get(self, key: str, synthesize: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Returns the cached audio, or synthesizes it once for all concurrent callers"""
+
+        async def whole():
+            yield await synthesize()
+
+        return b"".join([chunk async for chunk in self.stream(key, whole)])
@@ -0,0 +1,165 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils.audio import PCMRingBuffer
+
+logger = logging.getLogger(__name__)
+
+_EPS = 1e-10
+
+
+def frame_energies_db(samples: np.ndarray, frame_len: int) -> np.ndarray:
+    """RMS energy in dBFS of each complete frame of int16 samples"""
+
+    frames = samples[: len(samples) - len(samples) % frame_len].reshape(-1, frame_len)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1)) / 32768.0
+    return 20.0 * np.log10(rms + _EPS)
+
+
+@dataclass
+class VADDecision:
+    """State of the detector after processing the newest audio"""
+
+    is_speaking: bool
+    end_of_turn: bool
+    speech_start: Optional[int] = None  # Absolute sample position where the turn's speech began
+    speech_end: Optional[int] = None  # Absolute sample position just after the last speech frame
+    # Stretches of speech (start, end) that ended with a pause during this call
+    segments: List[Tuple[int, int]] = field(default_factory=list)
+
+
+class VoiceActivityDetector:
+    """Energy-based voice activity detector with an adaptive noise floor.
+
+    Frame energies are computed with NumPy over every complete frame written
+    to the PCM buffer since the last call. A frame is speech when it is
+    margin_db above the tracked noise floor (and above min_speech_db). The
+    floor is calibrated from the first frames of a turn, falls quickly to any
+    quieter frame and rises slowly with non-speech frames, so the gate adapts
+    to quiet and noisy rooms alike. Speech starts after
+    onset_ms of consecutive speech frames, stays on through hangover_ms of
+    silence, and the turn ends after end_of_turn_ms of silence, which is
+    clamped to at least hangover_ms so the last segment is closed first. Each
+    stretch of speech closed by the hangover is reported as a segment, so
+    callers can work on a turn while it is still being spoken.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 24000,
+        frame_ms: float = 20.0,
+        margin_db: float = 12.0,
+        min_speech_db: float = -50.0,
+        floor_fall: float = 0.5,
+        floor_rise: float = 0.02,
+        onset_ms: float = 60.0,
+        hangover_ms: float = 300.0,
+        end_of_turn_ms: float = 800.0,
+    ):
+        self.sample_rate = sample_rate
+        self.frame_len = int(sample_rate * frame_ms / 1000)
+        self.margin_db = margin_db
+        self.min_speech_db = min_speech_db
+        self.floor_fall = floor_fall
+        self.floor_rise = floor_rise
+        self.onset_frames = max(1, round(onset_ms / frame_ms))
+        self.hangover_frames = max(1, round(hangover_ms / frame_ms))
+        self.end_of_turn_frames = max(1, round(end_of_turn_ms / frame_ms))
+        if self.end_of_turn_frames < self.hangover_frames:
+            logger.warning(
+                f"end_of_turn_ms {end_of_turn_ms:.0f} is below the {hangover_ms:.0f}ms hangover, "
+                f"using {hangover_ms:.0f}ms so the last segment is reported"
+            )
+            self.end_of_turn_frames = self.hangover_frames
+        # Audio received after the last speech frame when the turn was ended, for monitoring
+        self.last_decision_latency_ms: Optional[float] = None
+        self.last_processing_ms: float = 0.0
+        self.reset()
+
+    def reset(self, position: int = 0):
+        """Starts a new turn, reading the buffer from an absolute position"""
+
+        self.cursor = position
+        self.noise_floor_db: Optional[float] = None
+        self.is_speaking = False
+        self.speech_start: Optional[int] = None
+        self.speech_end: Optional[int] = None
+        self._segment_start: Optional[int] = None
+        self._speech_run = 0
+        self._silence_run = 0
+
+    def _calibrate(self, energies: np.ndarray):
+        self.noise_floor_db = float(np.min(energies))
+
+    def _update_floor(self, energies: np.ndarray, is_speech: np.ndarray):
+        quietest = float(np.min(energies))
+        if quietest < self.noise_floor_db:
+            target, rate, frames = quietest, self.floor_fall, len(energies)
+        elif not is_speech.all():
+            target, rate, frames = float(np.mean(energies[~is_speech])), self.floor_rise, int((~is_speech).sum())
+        else:
+            # Creep up under continuous "speech" so a sudden rise in room noise is eventually learned
+            target, rate, frames = quietest, self.floor_rise / 10, len(energies)
+        # Closed form of applying the per-frame exponential update once per frame
+        self.noise_floor_db += (1.0 - (1.0 - rate) ** frames) * (target - self.noise_floor_db)
+
+    def process(self, buffer: PCMRingBuffer) -> VADDecision:
+        """Classifies every complete frame written since the last call"""
+
+        started = time.perf_counter()
+        self.cursor = max(self.cursor, buffer.start)
+        available = (buffer.end - self.cursor) // self.frame_len * self.frame_len
+        views = buffer.views(self.cursor, self.cursor + available)
+        end_of_turn = False
+        segments = []
+        if available > 0:
+            samples = views[0] if len(views) == 1 else np.concatenate(views)
+            energies = frame_energies_db(samples, self.frame_len)
+            if self.noise_floor_db is None:
+                self._calibrate(energies)
+            threshold = max(self.noise_floor_db + self.margin_db, self.min_speech_db)
+            is_speech = energies > threshold
+            self._update_floor(energies, is_speech)
+
+            for i, speech in enumerate(is_speech.tolist()):
+                frame_end = self.cursor + (i + 1) * self.frame_len
+                if speech:
+                    self._speech_run += 1
+                    self._silence_run = 0
+                    if not self.is_speaking and self._speech_run >= self.onset_frames:
+                        self.is_speaking = True
+                        self._segment_start = frame_end - self._speech_run * self.frame_len
+                        if self.speech_start is None:
+                            self.speech_start = self._segment_start
+                    if self.is_speaking:
+                        self.speech_end = frame_end
+                else:
+                    self._speech_run = 0
+                    self._silence_run += 1
+                    if self.is_speaking and self._silence_run >= self.hangover_frames:
+                        self.is_speaking = False
+                        segments.append((self._segment_start, self.speech_end))
+                    if (
+                        self.speech_start is not None
+                        and not end_of_turn
+                        and self._silence_run >= self.end_of_turn_frames
+                    ):
+                        end_of_turn = True
+                        # Up to the end of the buffer, the frame that decided it may be mid-chunk
+                        self.last_decision_latency_ms = (
+                            1000.0 * (buffer.end - self.speech_end) / self.sample_rate
+                        )
+            self.cursor += available
+
+        self.last_processing_ms = 1000.0 * (time.perf_counter() - started)
+        return VADDecision(
+            is_speaking=self.is_speaking,
+            end_of_turn=end_of_turn,
+            speech_start=self.speech_start,
+            speech_end=self.speech_end,
+            segments=segments,
+        )
@@ -0,0 +1,288 @@
+import json
+import math
+import os
+import re
+import threading
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from pydantic import PrivateAttr
+
+VECTORS_FNAME = "compact_vectors.npy"
+KEYWORDS_FNAME = "compact_keywords.npz"
+META_FNAME = "compact_meta.json"
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+_INT8_SCALE = 127.0
+_SEARCH_BLOCK_ROWS = 256  # Rows dequantized at a time, small enough for the float32 copy to stay in cache
+_TOKEN = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what when "
+    "where which who why will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.casefold()) if token not in _STOPWORDS]
+
+
+def has_compact_store(persist_dir: str) -> bool:
+    return os.path.exists(os.path.join(persist_dir, META_FNAME))
+
+
+def _replace(path: str, write):
+    """Writes through a temporary file, so a memory-mapped copy of the old file stays valid"""
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+class CompactVectorStore(BasePydanticVectorStore):
+    """Vector store keeping a session's embeddings in one contiguous NumPy array.
+
+    Vectors are normalized and stored as float32, float16 or int8, so a
+    768-dimension chunk takes 3KB, 1.5KB or 768 bytes instead of the tens of
+    kilobytes of a list of Python floats. Search is a blocked matrix product
+    followed by argpartition. A BM25 index of the chunk text, kept in
+    compact per-term arrays, is fused with the cosine scores:
+    alpha * cosine + (1 - alpha) * normalized BM25. alpha=1 is pure vector
+    search. Node text stays in the index's docstore.
+
+    Persisted vectors are memory-mapped on load, so resuming a chat does not
+    read them into memory until they are searched.
+    """
+
+    stores_text: bool = False
+    dtype: str = "float16"
+    alpha: float = 0.7
+    k1: float = 1.5
+    b: float = 0.75
+
+    _vectors: Optional[np.ndarray] = PrivateAttr(default=None)  # Rows beyond _size are spare capacity
+    _size: int = PrivateAttr(default=0)
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[str] = PrivateAttr(default_factory=list)
+    _rows: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _alive: array = PrivateAttr(default_factory=lambda: array("b"))
+    _doc_lengths: array = PrivateAttr(default_factory=lambda: array("i"))
+    _postings: Dict[str, Tuple[array, array]] = PrivateAttr(default_factory=dict)  # term -> (rows, counts)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, dtype: str = "float16", alpha: float = 0.7, **kwargs):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', use one of {', '.join(DTYPES)}")
+        super().__init__(dtype=dtype, alpha=alpha, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CompactVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def size(self) -> int:
+        """Rows stored, hidden ones included. Not __len__: an empty store must stay truthy for StorageContext."""
+
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the vectors and the keyword index"""
+
+        vectors = 0 if self._vectors is None else self._vectors.itemsize * self._vectors.shape[1] * self._size
+        postings = sum(rows.itemsize * len(rows) * 2 for rows, _ in self._postings.values())
+        return vectors + postings + self._doc_lengths.itemsize * len(self._doc_lengths)
+
+    ## Writes
+    def _encode(self, embeddings: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1.0, norms)
+        if self.dtype == "int8":
+            return np.round(embeddings * _INT8_SCALE).astype(np.int8)
+        return embeddings.astype(DTYPES[self.dtype])
+
+    def _reserve(self, rows: int, dim: int):
+        """Grows the array geometrically, copying a memory-mapped array into memory on first write"""
+
+        if self._vectors is None:
+            self._vectors = np.empty((max(rows, 64), dim), dtype=DTYPES[self.dtype])
+        elif self._vectors.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match the store's {self._vectors.shape[1]}")
+        elif rows > self._vectors.shape[0] or isinstance(self._vectors, np.memmap):
+            grown = np.empty((max(rows, 2 * self._vectors.shape[0]), dim), dtype=self._vectors.dtype)
+            grown[: self._size] = self._vectors[: self._size]
+            self._vectors = grown
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        encoded = self._encode(np.asarray([node.get_embedding() for node in nodes], dtype=np.float32))
+        with self._lock:
+            self._reserve(self._size + len(nodes), encoded.shape[1])
+            for node, vector in zip(nodes, encoded):
+                if node.node_id in self._rows:
+                    self._alive[self._rows[node.node_id]] = 0  # Re-added nodes replace their old row
+                row = self._size
+                self._vectors[row] = vector
+                self._rows[node.node_id] = row
+                self._ids.append(node.node_id)
+                self._ref_doc_ids.append(node.ref_doc_id or "")
+                self._alive.append(1)
+                tokens = tokenize(node.get_content(metadata_mode=MetadataMode.EMBED))
+                self._doc_lengths.append(len(tokens))
+                counts: Dict[str, int] = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, count in counts.items():
+                    rows, tfs = self._postings.setdefault(token, (array("i"), array("i")))
+                    rows.append(row)
+                    tfs.append(count)
+                self._size += 1
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """Hides the rows of a document. They are reclaimed when the store is rebuilt."""
+
+        with self._lock:
+            for row, ref in enumerate(self._ref_doc_ids):
+                if ref == ref_doc_id and self._alive[row]:
+                    self._alive[row] = 0
+                    self._rows.pop(self._ids[row], None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors, self._size = None, 0
+            self._ids, self._ref_doc_ids, self._rows = [], [], {}
+            self._alive, self._doc_lengths, self._postings = array("b"), array("i"), {}
+
+    ## Search
+    def _cosine(self, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(self._size, dtype=np.float32)
+        for start in range(0, self._size, _SEARCH_BLOCK_ROWS):
+            block = self._vectors[start : min(start + _SEARCH_BLOCK_ROWS, self._size)]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)  # NumPy has no BLAS kernels for float16 or int8
+            scores[start : start + len(block)] = block @ query
+        if self.dtype == "int8":
+            scores /= _INT8_SCALE
+        return scores
+
+    def _bm25(self, query_str: str) -> np.ndarray:
+        scores = np.zeros(self._size, dtype=np.float32)
+        if not self._size:
+            return scores
+        lengths = np.frombuffer(self._doc_lengths, dtype=np.int32)[: self._size].astype(np.float32)
+        average = float(lengths.mean()) or 1.0
+        for token in set(tokenize(query_str)):
+            if token not in self._postings:
+                continue
+            rows, tfs = self._postings[token]
+            rows = np.frombuffer(rows, dtype=np.int32)
+            tfs = np.frombuffer(tfs, dtype=np.int32).astype(np.float32)
+            idf = math.log(1.0 + (self._size - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * lengths[rows] / average)
+            scores[rows] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+        return scores
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError("CompactVectorStore does not support metadata filters")
+        with self._lock:
+            if self._size == 0:
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+            alpha = query.alpha if query.mode == VectorStoreQueryMode.HYBRID and query.alpha is not None else self.alpha
+            scores = self._cosine(self._encode_query(query.query_embedding))
+            if alpha < 1.0 and query.query_str:
+                keywords = self._bm25(query.query_str)
+                top = keywords.max()
+                if top > 0:
+                    scores = alpha * scores + (1.0 - alpha) * keywords / top
+
+            mask = np.frombuffer(self._alive, dtype=np.int8)[: self._size] == 0
+            if query.node_ids or query.doc_ids:
+                wanted = set(query.node_ids or []) | set(query.doc_ids or [])
+                mask |= ~np.fromiter(
+                    (i in wanted or r in wanted for i, r in zip(self._ids, self._ref_doc_ids)), bool, self._size
+                )
+            scores[mask] = -np.inf
+
+            k = min(query.similarity_top_k, self._size)
+            top_rows = np.argpartition(-scores, k - 1)[:k]
+            top_rows = top_rows[np.argsort(-scores[top_rows])]
+            top_rows = top_rows[np.isfinite(scores[top_rows])]
+            return VectorStoreQueryResult(
+                similarities=[float(scores[row]) for row in top_rows],
+                ids=[self._ids[row] for row in top_rows],
+            )
+
+    @staticmethod
+    def _encode_query(embedding: Optional[List[float]]) -> np.ndarray:
+        if embedding is None:
+            raise ValueError("CompactVectorStore needs a query embedding")
+        query = np.asarray(embedding, dtype=np.float32)
+        return query / (np.linalg.norm(query) or 1.0)
+
+    ## Persistence
+    def persist(self, persist_path: str, fs=None) -> None:
+        """Writes next to the other files of the storage context, whatever name persist_path has"""
+
+        persist_dir = os.path.dirname(persist_path)
+        os.makedirs(persist_dir, exist_ok=True)
+        with self._lock:
+            dim = 0 if self._vectors is None else self._vectors.shape[1]
+            vectors = (
+                self._vectors[: self._size]
+                if self._vectors is not None
+                else np.empty((0, 0), dtype=DTYPES[self.dtype])
+            )
+            _replace(os.path.join(persist_dir, VECTORS_FNAME), lambda f: np.save(f, vectors))
+            terms = list(self._postings)
+            keywords = {
+                "alive": np.array(self._alive, dtype=np.int8),
+                "doc_lengths": np.array(self._doc_lengths, dtype=np.int32),
+                "offsets": np.cumsum([0] + [len(self._postings[term][0]) for term in terms]),
+                "rows": np.array([row for term in terms for row in self._postings[term][0]], dtype=np.int32),
+                "tfs": np.array([tf for term in terms for tf in self._postings[term][1]], dtype=np.int32),
+            }
+            _replace(os.path.join(persist_dir, KEYWORDS_FNAME), lambda f: np.savez(f, **keywords))
+            meta = {
+                "dtype": self.dtype,
+                "alpha": self.alpha,
+                "dim": dim,
+                "ids": self._ids,
+                "ref_doc_ids": self._ref_doc_ids,
+                "terms": terms,
+            }
+        _replace(os.path.join(persist_dir, META_FNAME), lambda f: f.write(json.dumps(meta).encode()))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, mmap: bool = True) -> "CompactVectorStore":
+        with open(os.path.join(persist_dir, META_FNAME), encoding="utf-8") as f:
+            meta = json.load(f)
+        store = cls(dtype=meta["dtype"], alpha=meta["alpha"])
+        if meta["ids"]:
+            store._vectors = np.load(os.path.join(persist_dir, VECTORS_FNAME), mmap_mode="r" if mmap else None)
+        store._size = len(meta["ids"])
+        store._ids, store._ref_doc_ids = meta["ids"], meta["ref_doc_ids"]
+        with np.load(os.path.join(persist_dir, KEYWORDS_FNAME)) as keywords:
+            store._alive = array("b", keywords["alive"].astype(np.int8).tobytes())
+            store._doc_lengths = array("i", keywords["doc_lengths"].astype(np.int32).tobytes())
+            offsets = keywords["offsets"]
+            rows = keywords["rows"].astype(np.int32)
+            tfs = keywords["tfs"].astype(np.int32)
+        for i, term in enumerate(meta["terms"]):
+            start, end = offsets[i], offsets[i + 1]
+            store._postings[term] = (array("i", rows[start:end].tobytes()), array("i", tfs[start:end].tobytes()))
+        store._rows = {node_id: row for row, node_id in enumerate(store._ids) if store._alive[row]}
+        return store